@@ -1,68 +1,134 @@
-from agents import Agent, function_tool, Runner
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+from datetime import datetime
+from functools import lru_cache
 import uuid
 import os
-from dotenv import load_dotenv
-from openai import OpenAI
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Set your OpenAI API key and disable tracing
-os.environ["OPENAI_TRACE"] = "false"
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Store patients and appointments in memory
-patients = {}  # name -> Patient object
-appointments = {}  # name -> list of appointments
-
-@dataclass
-class Patient:
-    name: str
-    phone: str
-    email: str
-    is_new_patient: bool
-
-@dataclass
-class Appointment:
-    patient_name: str
-    datetime: datetime
-    duration: timedelta = timedelta(minutes=30)
-    type: str = "regular_checkup"
-
-@function_tool
+import time
+from session_store import SessionStore, compact_history
+from slot_filling import SlotTracker, booking_problems, intent_confidence
+from context_slicing import ConversationContext, make_input_filter
+from model_policy import model_policy
+from model_client import ResilientClient, ModelUnavailable, degraded_answer
+from reminders import ReminderQueue, ReminderDispatcher, reminder_sender_from_env
+from rate_limiter import rate_limiter, estimate_tokens, PRIORITY_BOOKING, PRIORITY_FAQ
+from speculative import SpeculativeRunner, mutation_blocked, predict_agent
+from scheduling_store import SchedulingStore, Patient, Appointment, appointment_key
+from change_events import subscribe_from_env
+from policy_index import policy_index
+from profiling import profiler, profiled, profiled_turn, install_signal_toggle
+
+# The agents SDK takes ~2s to import, so it is only loaded when agents are first built
+if TYPE_CHECKING:
+    from agents import Agent, FunctionTool
+
+@lru_cache(maxsize=None)
+def configure_environment() -> None:
+    """Load .env and disable tracing; runs once, before the first agent is built"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    os.environ["OPENAI_TRACE"] = "false"
+
+# Agent runs execute tools, so they are retried and failed over but never hedged.
+# One run spans several model calls, hence the longer deadline.
+agent_client = ResilientClient("agents", deadline=90, hedge=False)
+
+# Checked before any booking; matches the hours in FAQS
+BOOKING_RULES = {
+    "hours": "Monday-Friday: 9:00 AM - 5:00 PM",
+    "open_days": range(0, 5),
+    "opening_time": "09:00",
+    "closing_time": "17:00",
+    "booking_window_days": 90,
+}
+
+FAQS = {
+    "hours": "We are open Monday to Friday, 9 AM to 5 PM",
+    "services": "We offer cleanings, fillings, and cosmetic services",
+    "insurance": "We accept most major insurance providers"
+}
+
+# Patients and appointments. In-process by default; server.py workers swap in
+# a proxy to the shared single-writer store with use_store().
+store = SchedulingStore()
+
+def use_store(shared_store) -> None:
+    global store
+    store = shared_store
+
+# Set by main() when DENTAL_REMINDERS=1
+reminder_queue: Optional[ReminderQueue] = None
+
+# Session whose turn is running, recorded on change events
+current_session_id: Optional[str] = None
+
+def registered_name(name: str, phone: Optional[str] = None) -> str:
+    """The name a patient is registered under; a misspelt one needs their phone, unknown names are returned as given"""
+    return store.resolve_name(name, phone) or name
+
+def unconfirmed_name(name: str) -> Optional[str]:
+    """What to ask when a name is not registered but close to names that are, else None"""
+    if store.resolve_name(name) is not None:
+        return None
+    candidates = store.name_candidates(name)
+    if not candidates:
+        return None
+    return (f"No patient is registered as {name}. Close matches: {', '.join(candidates)}. "
+            f"Ask the patient which one they are and confirm it with confirm_patient and their phone number.")
+
+def confirm_patient(name: str, phone: str) -> str:
+    """Confirm which registered patient is speaking from their name and phone number"""
+    registered = store.resolve_name(name, phone)
+    if registered is None:
+        return f"No registered patient matches {name} with phone {phone}"
+    conversation_state.patient_name = registered
+    return f"Confirmed: the patient is registered as {registered}. Use that name."
+
+def add_patient(name: str, phone: str, email: str) -> str:
+    """Register a new patient; shared by the tool and the local slot-filling path"""
+    if mutation_blocked():
+        return f"Registration for {name} is pending"
+    existing = store.add_patient(Patient(name=name, phone=phone, email=email, is_new_patient=True),
+                                 session_id=current_session_id)
+    if existing:
+        conversation_state.patient_name = existing
+        return f"Patient {name} is already registered" + (f" as {existing}" if existing != name else "")
+    conversation_state.patient_name = name
+    conversation_state.is_new_patient = True
+    return f"New patient {name} registered successfully"
+
+def reminder_key(name: str, dt: datetime) -> str:
+    return appointment_key(name, dt)
+
+def queue_reminders(name: str, dt: datetime) -> None:
+    """Queue the reminders for one appointment if reminders are enabled"""
+    if reminder_queue is None:
+        return
+    patient = store.get_patient(name)
+    contact = {"name": name, "phone": patient.phone if patient else None, "email": patient.email if patient else None}
+    message = f"Hi {name}, this is a reminder of your dental appointment on {dt.strftime('%Y-%m-%d at %H:%M')}."
+    reminder_queue.schedule(reminder_key(name, dt), dt, contact, message)
+
 def register_new_patient(name: str, phone: str, email: str) -> str:
     """Register a new patient with their details"""
-    if name in patients:
-        return f"Patient {name} is already registered"
-    
-    patients[name] = Patient(
-        name=name,
-        phone=phone,
-        email=email,
-        is_new_patient=True
-    )
-    return f"New patient {name} registered successfully"
+    return add_patient(name, phone, email)
 
-@function_tool
 def check_patient_status(name: str) -> str:
     """Check if a patient is new or existing"""
-    if name not in patients:
-        return "new"
-    return "existing"
+    if store.resolve_name(name) is not None:
+        return "existing"
+    return unconfirmed_name(name) or "new"
 
-@function_tool
 def get_patient_details(name: str) -> str:
     """Get details of an existing patient"""
-    if name not in patients:
+    question = unconfirmed_name(name)
+    if question:
+        return question
+    patient = store.get_patient(registered_name(name))
+    if patient is None:
         return f"No patient found with name {name}"
     
-    patient = patients[name]
     return f"Patient Details:\nName: {patient.name}\nPhone: {patient.phone}\nEmail: {patient.email}\nStatus: {'New' if patient.is_new_patient else 'Existing'} Patient"
 
-@function_tool
 def check_slots(date: str) -> str:
     """Check available slots for a given date"""
     try:
@@ -72,83 +138,122 @@ def check_slots(date: str) -> str:
     except ValueError:
         return "Invalid date format. Please use YYYY-MM-DD"
 
-@function_tool
-def book_appointment(date: str, time: str, name: str, is_new_patient: bool) -> str:
-    """Book an appointment for a patient"""
+def add_appointment(date: str, time: str, name: str, is_new_patient: bool) -> str:
+    """Book an appointment; shared by the tool and the local slot-filling path"""
+    if mutation_blocked():
+        return f"Booking for {name} is pending"
+    question = unconfirmed_name(name)
+    if question:
+        return question
+    name = registered_name(name)
     try:
         dt = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
         
         # For new patients, ensure they're registered first
-        if is_new_patient and name not in patients:
+        if is_new_patient and store.get_patient(name) is None:
             return "Please register the patient first using register_new_patient"
         
-        if name not in appointments:
-            appointments[name] = []
-            
-        appointments[name].append(Appointment(
+        # A retried agent run may book the same slot again; the store marks the patient as not new
+        appointment = Appointment(
             patient_name=name,
             datetime=dt,
             type="initial_consultation" if is_new_patient else "regular_checkup"
-        ))
+        )
+        if not store.add_appointment(appointment, session_id=current_session_id):
+            return f"{name} already has an appointment on {dt.strftime('%Y-%m-%d at %H:%M')}"
+        queue_reminders(name, dt)
         
-        # After first appointment, mark patient as not new
-        if name in patients:
-            patients[name].is_new_patient = False
+        conversation_state.current_action = "book"
+        conversation_state.patient_name = name
+        conversation_state.appointment_date = date
+        conversation_state.appointment_time = time
             
         return f"{'Initial consultation' if is_new_patient else 'Regular appointment'} booked for {name} on {dt.strftime('%Y-%m-%d at %H:%M')}"
     except ValueError:
         return "Invalid date/time format. Please use YYYY-MM-DD HH:MM"
 
-@function_tool
-def cancel_appointment(name: str) -> str:
-    """Cancel appointments for a patient"""
-    if name in appointments and appointments[name]:
-        appointments[name] = []  # Remove all appointments for this patient
-        return f"All appointments for {name} have been cancelled"
-    return f"No appointments found for {name}"
+def slot_problems(date: str, time: str) -> Dict[str, str]:
+    """Why a requested slot can't be booked, by slot; empty if it can"""
+    return booking_problems(date, time, BOOKING_RULES, int(Appointment.duration.total_seconds() // 60))
+
+def book_appointment(date: str, time: str, name: str, is_new_patient: bool) -> str:
+    """Book an appointment for a patient"""
+    problems = slot_problems(date, time)
+    if problems:
+        return "Not booked: " + " ".join(problems.values())
+    return add_appointment(date, time, name, is_new_patient)
+
+def cancel_appointment(name: str, date: Optional[str] = None, time: Optional[str] = None) -> str:
+    """Cancel one appointment for a patient; date and time are needed when they have more than one"""
+    if mutation_blocked():
+        return f"Cancellation for {name} is pending"
+    question = unconfirmed_name(name)
+    if question:
+        return question
+    name = registered_name(name)
+    appts = store.get_appointments(name)
+    if not appts:
+        return f"No appointments found for {name}"
+    if date and time:
+        try:
+            dt = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M")
+        except ValueError:
+            return "Invalid date/time format. Please use YYYY-MM-DD HH:MM"
+    elif len(appts) == 1:
+        dt = appts[0].datetime
+    else:
+        listed = ", ".join(appt.datetime.strftime('%Y-%m-%d at %H:%M') for appt in appts)
+        return f"{name} has {len(appts)} appointments ({listed}). Which one should be cancelled?"
+    cancelled = store.cancel_appointment(name, dt, session_id=current_session_id)
+    if cancelled is None:
+        return f"No appointment found for {name} on {dt.strftime('%Y-%m-%d at %H:%M')}"
+    if reminder_queue is not None:
+        reminder_queue.cancel(reminder_key(name, dt))
+    return f"Appointment for {name} on {dt.strftime('%Y-%m-%d at %H:%M')} has been cancelled"
 
-@function_tool
 def get_faq(question: str) -> str:
     """Get answer for frequently asked questions"""
-    faqs = {
-        "hours": "We are open Monday to Friday, 9 AM to 5 PM",
-        "services": "We offer cleanings, fillings, and cosmetic services",
-        "insurance": "We accept most major insurance providers"
-    }
     print('reached faq')
-    return faqs
+    # Only the policy excerpts matching the question, however many documents the clinic has
+    policy = policy_index.context_message(question)
+    if policy:
+        return f"{FAQS}\n\n{policy['content']}"
+    return FAQS
 
-@function_tool
 def check_appointments(name: str) -> str:
     """Check existing appointments for a patient"""
-    if name not in appointments or not appointments[name]:
-        return f"No appointments found for {name}"
-    
-    appts = appointments[name]
-    result = [f"Appointments for {name}:"]
-    for appt in appts:
-        result.append(f"- {appt.datetime.strftime('%Y-%m-%d at %H:%M')}")
-    return "\n".join(result)
+    question = unconfirmed_name(name)
+    if question:
+        return question
+    name = registered_name(name)
+    # Rendered by the store and cached there until the patient's bookings change
+    return store.appointments_table(name) or f"No appointments found for {name}"
 
-@function_tool
 def reschedule_appointment(name: str, old_date: str, old_time: str, new_date: str, new_time: str) -> str:
     """Reschedule an appointment for a patient"""
+    if mutation_blocked():
+        return f"Rescheduling for {name} is pending"
+    question = unconfirmed_name(name)
+    if question:
+        return question
+    name = registered_name(name)
     try:
         old_dt = datetime.strptime(f"{old_date} {old_time}", "%Y-%m-%d %H:%M")
         new_dt = datetime.strptime(f"{new_date} {new_time}", "%Y-%m-%d %H:%M")
         
-        if name not in appointments or not appointments[name]:
+        appts = store.get_appointments(name)
+        if not appts:
             return f"No appointments found for {name}"
         
+        if new_dt != old_dt and any(appt.datetime == new_dt for appt in appts):
+            return f"{name} already has an appointment on {new_dt.strftime('%Y-%m-%d at %H:%M')}"
+
         # Find the appointment to reschedule
-        found = False
-        for appt in appointments[name]:
-            if appt.datetime == old_dt:
-                appt.datetime = new_dt
-                found = True
-                break
-        
-        if found:
+        # The store publishes the change with the appointment as it was when moved
+        if store.move_appointment(name, old_dt, new_dt, session_id=current_session_id):
+            if reminder_queue is not None:
+                reminder_queue.cancel(reminder_key(name, old_dt))
+            queue_reminders(name, new_dt)
             return f"Appointment for {name} rescheduled from {old_dt.strftime('%Y-%m-%d at %H:%M')} to {new_dt.strftime('%Y-%m-%d at %H:%M')}"
         else:
             return f"No appointment found for {name} on {old_dt.strftime('%Y-%m-%d at %H:%M')}"
@@ -163,17 +268,49 @@ class ConversationState:
         self.appointment_date = None
         self.appointment_time = None
         self.is_new_patient = False
+        self.slots = {}  # Filled by SlotTracker from the patient's own words
+        self.summary = ""
+        self.last_agent = None
+        self.last_response_id = None
         
     def reset(self):
         self.__init__()
 
+    def known_details(self) -> Dict:
+        """Structured state shared with every agent instead of the full transcript"""
+        details = {k: v for k, v in self.slots.items() if k != "intent"}
+        details.setdefault("patient_name", self.patient_name)
+        details["last_agent"] = self.last_agent
+        if self.summary:
+            details["earlier_conversation"] = self.summary
+        return details
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ConversationState":
+        state = cls()
+        for key, value in data.items():
+            if hasattr(state, key):
+                setattr(state, key, value)
+        return state
+
 # Global conversation state
 conversation_state = ConversationState()
 
-# Create specialized agents
-registration_agent = Agent(
-    name="Registration Agent",
-    instructions="""You help register new patients. Follow these steps:
+# Per-agent views of the conversation, extended turn by turn
+conversation_context = ConversationContext()
+
+def sliced_handoff(agent: "Agent"):
+    """Hand off with only the turns relevant to the specialist"""
+    from agents import handoff
+    return handoff(agent, input_filter=make_input_filter(
+        conversation_context, agent.name, lambda: conversation_state.known_details()
+    ))
+
+# Agent prompts are plain strings so importing this module builds nothing
+REGISTRATION_INSTRUCTIONS = """You help register new patients. Follow these steps:
     1. Ask for the patient's name if not provided
     2. Use check_patient_status to see if they're new
     3. If new, collect their:
@@ -182,14 +319,9 @@ registration_agent = Agent(
     4. Use register_new_patient to create their record
     5. Hand off to booking_agent for appointment scheduling
     
-    Remember the patient's name and status throughout the conversation.""",
-    model="gpt-4o",
-    tools=[check_patient_status, register_new_patient, get_patient_details]
-)
-
-booking_agent = Agent(
-    name="Booking Agent",
-    instructions="""You help book appointments and check available slots.
+    Remember the patient's name and status throughout the conversation."""
+
+BOOKING_INSTRUCTIONS = """You help book appointments and check available slots.
     When booking, follow these steps:
     1. If patient name is not known, ask for it
     2. Use check_patient_status to verify if new or existing
@@ -199,46 +331,26 @@ booking_agent = Agent(
        - For new patients: book_appointment(..., is_new_patient=true)
        - For existing patients: book_appointment(..., is_new_patient=false)
     
-    Remember the patient's name and appointment details throughout the conversation.""",
-    model="gpt-4o",
-    tools=[check_slots, book_appointment, check_patient_status]
-)
-
-cancellation_agent = Agent(
-    name="Cancellation Agent",
-    instructions="""You help cancel appointments.
+    Remember the patient's name and appointment details throughout the conversation."""
+
+CANCELLATION_INSTRUCTIONS = """You help cancel appointments.
     1. If patient name not provided, ask for it
     2. Use check_appointments to view their appointments
-    3. Cancel the specified appointment""",
-    model="gpt-4o",
-    tools=[check_appointments, cancel_appointment]
-)
-
-rescheduling_agent = Agent(
-    name="Rescheduling Agent",
-    instructions="""You help reschedule appointments. Follow these steps:
+    3. If they have more than one, ask which one and pass its date and time to cancel_appointment
+    4. Cancel only that appointment"""
+
+RESCHEDULING_INSTRUCTIONS = """You help reschedule appointments. Follow these steps:
     1. If patient name not provided, ask for it
     2. Use check_appointments to see their current appointments
     3. Ask which appointment they want to reschedule
     4. Use check_slots to show available slots for the new date
     5. Use reschedule_appointment to make the change
     
-    Remember the patient's name and appointment details throughout the conversation.""",
-    model="gpt-4o",
-    tools=[check_appointments, check_slots, reschedule_appointment]
-)
-
-faq_agent = Agent(
-    name="FAQ Agent",
-    instructions="You answer questions about our services and policies.",
-    model = "gpt-4o",
-    tools=[get_faq]
-)
-
-# Main dental assistant that routes requests to specialized agents
-dental_assistant = Agent(
-    name="Dental Assistant",
-    instructions="""You are a dental office assistant. Route requests to the appropriate agent:
+    Remember the patient's name and appointment details throughout the conversation."""
+
+FAQ_INSTRUCTIONS = "You answer questions about our services and policies. Look them up with get_faq first."
+
+ROUTER_INSTRUCTIONS = """You are a dental office assistant. Route requests to the appropriate agent:
     - Use registration_agent for new patient registration
     - Use booking_agent for scheduling appointments
     - Use rescheduling_agent for changing existing appointments
@@ -249,54 +361,277 @@ dental_assistant = Agent(
     1. Maintain conversation context between agent handoffs
     2. Remember patient names and details throughout the conversation
     3. Don't ask for information that was already provided
-    4. When booking appointments, ensure new patients are registered first""",
-    model="gpt-4o",
-    handoffs=[registration_agent, booking_agent, rescheduling_agent, cancellation_agent, faq_agent],
-    tools=[check_slots, book_appointment, check_appointments, reschedule_appointment, cancel_appointment, get_faq, check_patient_status, register_new_patient, get_patient_details]
-)
+    4. When booking appointments, ensure new patients are registered first"""
 
-async def main():
+ROUTER_NAME = "Dental Assistant"
+SPECIALIST_NAMES = ("Registration Agent", "Booking Agent", "Rescheduling Agent", "Cancellation Agent", "FAQ Agent")
+
+@lru_cache(maxsize=None)
+def get_tools() -> Dict[str, "FunctionTool"]:
+    """Tool schemas for the functions above, built once on first use"""
+    from agents import function_tool
+    return {fn.__name__: function_tool(profiled(f"tool.{fn.__name__}")(fn)) for fn in [
+        register_new_patient, check_patient_status, confirm_patient, get_patient_details, check_slots,
+        book_appointment, cancel_appointment, get_faq, check_appointments, reschedule_appointment,
+    ]}
+
+@lru_cache(maxsize=None)
+def get_agents() -> Dict[str, "Agent"]:
+    """Build the router and specialists on first use; later calls return the same agents"""
+    configure_environment()
+    from agents import Agent
+    tools = get_tools()
+    
+    # Create specialized agents
+    registration_agent = Agent(
+        name="Registration Agent",
+        instructions=REGISTRATION_INSTRUCTIONS,
+        model=model_policy.select("Registration Agent").model,
+        tools=[tools["check_patient_status"], tools["confirm_patient"], tools["register_new_patient"],
+               tools["get_patient_details"]]
+    )
+    
+    booking_agent = Agent(
+        name="Booking Agent",
+        instructions=BOOKING_INSTRUCTIONS,
+        model=model_policy.select("Booking Agent").model,
+        tools=[tools["check_slots"], tools["book_appointment"], tools["check_patient_status"], tools["confirm_patient"]]
+    )
+    
+    cancellation_agent = Agent(
+        name="Cancellation Agent",
+        instructions=CANCELLATION_INSTRUCTIONS,
+        model=model_policy.select("Cancellation Agent").model,
+        tools=[tools["check_appointments"], tools["confirm_patient"], tools["cancel_appointment"]]
+    )
+    
+    rescheduling_agent = Agent(
+        name="Rescheduling Agent",
+        instructions=RESCHEDULING_INSTRUCTIONS,
+        model=model_policy.select("Rescheduling Agent").model,
+        tools=[tools["check_appointments"], tools["confirm_patient"], tools["check_slots"], tools["reschedule_appointment"]]
+    )
+    
+    faq_agent = Agent(
+        name="FAQ Agent",
+        instructions=FAQ_INSTRUCTIONS,
+        model=model_policy.select("FAQ Agent").model,
+        tools=[tools["get_faq"]]
+    )
+    
+    # Main dental assistant that routes requests to specialized agents
+    specialists = [registration_agent, booking_agent, rescheduling_agent, cancellation_agent, faq_agent]
+    dental_assistant = Agent(
+        name=ROUTER_NAME,
+        instructions=ROUTER_INSTRUCTIONS,
+        model=model_policy.select(ROUTER_NAME).model,
+        handoffs=[sliced_handoff(agent) for agent in specialists],
+        # The router only routes; specialists carry the working tools
+        tools=[tools["check_patient_status"]]
+    )
+    return {agent.name: agent for agent in [dental_assistant, *specialists]}
+
+@profiled("local_booking")
+def try_local_booking(tracker: SlotTracker) -> Optional[str]:
+    """Book straight from parsed slots; returns None when an agent is needed"""
+    slots = tracker.slots
+    if slots.get("intent") != "book":
+        return None
+    
+    name = registered_name(slots["patient_name"], slots.get("phone")) if slots.get("patient_name") else None
+    required = ["patient_name", "requested_date", "requested_time"]
+    patient = store.get_patient(name) if name else None
+    if name and patient is None:
+        required += ["phone", "email"]
+    question = tracker.next_question(required)
+    if question:
+        return question
+    problems = slot_problems(slots["requested_date"], slots["requested_time"])
+    if problems:
+        return tracker.reask(problems, required)
+    
+    if patient is None:
+        add_patient(name, slots["phone"], slots["email"])
+        if not mutation_blocked():
+            # add_patient names the record used; a close spelling of a registered patient books under theirs
+            name = conversation_state.patient_name
+            patient = store.get_patient(name)
+    result = add_appointment(slots["requested_date"], slots["requested_time"], name, patient is None or patient.is_new_patient)
+    tracker.clear_request()
+    return result
+
+@profiled("session.checkpoint")
+def checkpoint(session_store: Optional[SessionStore], session_id: Optional[str], conversation: List[Dict]) -> List[Dict]:
+    """Save the compact conversation state and return the messages kept verbatim"""
+    if not session_store or not session_id:
+        return conversation
+    conversation_state.summary, conversation = compact_history(conversation, conversation_state.summary)
+    session_store.save(session_id, {"state": conversation_state.to_dict(), "recent": conversation})
+    return conversation
+
+def restore(session_store: Optional[SessionStore], session_id: Optional[str]) -> Optional[List[Dict]]:
+    """
+    Make a saved session the current conversation
+
+    Returns the messages kept verbatim, or None for a new session, which
+    starts from an empty state.
+    """
     global conversation_state
-    runner = Runner()
+    saved = session_store.load(session_id) if session_store and session_id else None
+    conversation_state = ConversationState.from_dict(saved.get("state", {})) if saved else ConversationState()
+    conversation_context.clear()
+    if not saved:
+        return None
+    conversation = saved.get("recent", [])
+    conversation_context.load(conversation)
+    return conversation
+
+def reply(conversation: List[Dict], text: str) -> str:
+    conversation.append({"role": "assistant", "content": text})
+    conversation_context.add_assistant(text)
+    return text
+
+@profiled_turn("handle_turn")
+async def handle_turn(user_input: str, conversation: List[Dict], tracker: SlotTracker,
+                      speculative_runner: Optional[SpeculativeRunner] = None,
+                      session_store: Optional[SessionStore] = None, session_id: Optional[str] = None):
+    """
+    Answer one patient message
+
+    Returns:
+        tuple: (reply, conversation to carry into the next turn)
+    """
+    from agents import ModelBehaviorError, RunConfig, Runner
+    global current_session_id
+    current_session_id = session_id
+    dental_assistant = get_agents()[ROUTER_NAME]
+    
+    # Add user input to conversation
+    conversation.append({"role": "user", "content": user_input})
+    conversation_context.add_user(user_input)
     
-    print("Hello! I'm your dental assistant. How can I help you today?")
+    # Booking details we can parse ourselves don't need an agent run
+    local_reply = try_local_booking(tracker) if tracker.update(user_input) else None
+    if local_reply:
+        reply(conversation, local_reply)
+        return local_reply, checkpoint(session_store, session_id, conversation)
+    
+    # The router sees the structured state and the latest exchange; each
+    # specialist gets its own view through the handoff input filter
+    with profiler.span("build_prompt"):
+        router_input = conversation_context.router_view(conversation_state.known_details())
+    
+    # Agents run on their policy tiers; an unclear turn runs every agent on the large tier
+    choice = model_policy.select(ROUTER_NAME, confidence=intent_confidence(user_input))
+    models = [choice.model if choice.escalated else None, model_policy.fallback_model()]
+
+    async def run_router(model: Optional[str]):
+        # First try: every agent uses its policy model; failover overrides them all
+        if model is None and speculative_runner:
+            predicted = predict_agent(conversation_context.topic, conversation_state.last_agent)
+            specialist_input = conversation_context.view_for(predicted, conversation_state.known_details()) if predicted else []
+            return await speculative_runner.run(router_input, predicted, specialist_input)
+        return await Runner.run(dental_assistant, router_input, run_config=RunConfig(model=model) if model else None)
+    
+    # A run makes several model calls (router, specialist, tool follow-ups), so
+    # reserve a few requests' worth of tokens and settle on the real usage.
+    # Runs execute tools, so unlike plain completions they are never coalesced.
+    priority = PRIORITY_FAQ if conversation_context.topic in (None, "faq") else PRIORITY_BOOKING
+    tokens = estimate_tokens(router_input, max_output_tokens=1500)
+    
+    def limited_run(run_models):
+        # Quota is taken once per run, not per retry or failover, and settled on the usage
+        return rate_limiter.acall(
+            lambda: agent_client.acall(rate_limiter.apausing(run_router), run_models),
+            tokens, priority, usage=lambda result: result.context_wrapper.usage.total_tokens,
+            timeout=agent_client.deadline
+        )
+    
+    started = time.perf_counter()
+    # Model I/O and the tools the agents call, which appear as nested tool.* spans
+    with profiler.span("agent_run"):
+        try:
+            result = await limited_run(models)
+        except ModelBehaviorError as e:
+            # Invalid tool arguments from a smaller model: retry the turn on the large tier
+            choice = model_policy.select(conversation_state.last_agent or dental_assistant.name, escalate=True, reason=str(e))
+            result = await limited_run([choice.model])
+        except ModelUnavailable:
+            # Answer what we can locally until the model is reachable again
+            return reply(conversation, degraded_answer(user_input, FAQS)), conversation
+    usage = result.context_wrapper.usage
+    model_policy.log(
+        "turn", agent=result.last_agent.name, model=result.last_agent.model,
+        latency_ms=round((time.perf_counter() - started) * 1000, 1),
+        input_tokens=usage.input_tokens, output_tokens=usage.output_tokens
+    )
+    result_text = str(result)
+    
+    # Add assistant's response to conversation
+    reply(conversation, result_text)
+    conversation_state.last_agent = result.last_agent.name
+    conversation_state.last_response_id = result.last_response_id
+    
+    # Check if the task is complete
+    if any(phrase in result_text.lower() for phrase in [
+        "appointment booked", 
+        "appointment cancelled",
+        "appointment rescheduled",
+        "registration complete",
+        "no appointments found"
+    ]):
+        # Keep the last exchange for context but remove older messages
+        conversation = conversation[-2:]
+        conversation_context.reset_topic()
+    
+    return result_text, checkpoint(session_store, session_id, conversation)
+
+async def main():
+    global reminder_queue
+    agents = get_agents()
+    
+    # Set DENTAL_REMINDERS=1 to queue and send appointment reminders
+    if os.getenv("DENTAL_REMINDERS") == "1":
+        reminder_queue = ReminderQueue()
+        ReminderDispatcher(reminder_queue, reminder_sender_from_env()).start()
+    # DENTAL_CHANGES_FILE / _SOCKET / _WEBHOOK stream every mutation
+    subscribe_from_env()
+    # DENTAL_PROFILE=1 profiles turns from the start; SIGUSR2 toggles it
+    install_signal_toggle()
+    
+    # DENTAL_SPECULATIVE=1 starts the likely specialist alongside the router
+    speculative_runner = None
+    if os.getenv("DENTAL_SPECULATIVE") == "1":
+        speculative_runner = SpeculativeRunner(agents[ROUTER_NAME], [agents[name] for name in SPECIALIST_NAMES])
+    
+    # Set DENTAL_SESSION_ID to resume the same conversation after a restart
+    session_id = os.getenv("DENTAL_SESSION_ID")
+    session_store = SessionStore() if session_id else None
+    conversation = restore(session_store, session_id)
+    if conversation is not None:
+        print("Welcome back! Let's pick up where we left off.")
+    else:
+        conversation = []
+        print("Hello! I'm your dental assistant. How can I help you today?")
+    
+    tracker = SlotTracker(slots=conversation_state.slots)
     
-    conversation = []
     while True:
         user_input = input("> ").strip()
         if user_input.lower() in ['quit', 'exit', 'bye']:
+            if speculative_runner:
+                print(speculative_runner.stats.summary())
             print("Goodbye!")
             break
             
         try:
-            # Add user input to conversation
-            conversation.append({"role": "user", "content": user_input})
-            
-            # Join all conversation messages with newlines
-            full_context = "\n".join([msg["content"] for msg in conversation])
-            
-            # Run the main dental assistant with full conversation context
-            result = await runner.run(dental_assistant, full_context)
-            result_text = str(result)
+            result_text, conversation = await handle_turn(
+                user_input, conversation, tracker, speculative_runner, session_store, session_id
+            )
             print("\nAssistant:", result_text)
-            
-            # Add assistant's response to conversation
-            conversation.append({"role": "assistant", "content": result_text})
-            
-            # Check if the task is complete
-            if any(phrase in result_text.lower() for phrase in [
-                "appointment booked", 
-                "appointment cancelled",
-                "appointment rescheduled",
-                "registration complete",
-                "no appointments found"
-            ]):
-                # Keep the last exchange for context but remove older messages
-                conversation = conversation[-2:]
-            
         except Exception as e:
+            # Keep the conversation so the patient doesn't have to repeat themselves
             print(f"\nError: {str(e)}")
-            conversation = []  # Reset conversation on error
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,210 @@
+import sys
+import json
+from collections import defaultdict
+from dataclasses import dataclass, asdict, fields
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Appointments carry no chair yet; everything is booked into this one
+DEFAULT_CHAIR = "Chair 1"
+
+# Bookable minutes per chair per day (9:00 AM - 6:00 PM)
+OPEN_MINUTES_PER_DAY = 9 * 60
+
+
+class AppointmentRecord(NamedTuple):
+    """The fields of an appointment the aggregates are built from"""
+    day: str        # ISO date
+    service: str
+    chair: str
+    minutes: int
+    cost: float
+    cancelled: bool
+
+
+def make_record(day: date, service: str, cancelled: bool, services: Dict, chair: str = DEFAULT_CHAIR) -> AppointmentRecord:
+    """Build a record using durations and costs from practice_info["services"]"""
+    details = services.get(service, {})
+    return AppointmentRecord(
+        day.isoformat(), service, chair,
+        int(details.get("duration", 0)), float(details.get("cost", 0)), cancelled
+    )
+
+
+@dataclass
+class Bucket:
+    booked: int = 0       # appointments in this bucket, cancelled or not
+    active: int = 0
+    cancelled: int = 0
+    minutes: int = 0      # minutes of active appointments
+    revenue: float = 0.0  # cost of active appointments
+    rescheduled_in: int = 0   # event counters, not derivable from current state
+    rescheduled_out: int = 0
+
+    # Fields a full rebuild from current appointments can reproduce
+    STATE_FIELDS = ("booked", "active", "cancelled", "minutes", "revenue")
+
+
+class AppointmentAggregates:
+    """
+    Materialized per-day, per-service, per-chair aggregates
+
+    Updated in O(1) on every book, cancel and reschedule so dashboards never
+    scan appointments; queries cost O(buckets in the requested days).
+    """
+
+    def __init__(self, open_minutes: int = OPEN_MINUTES_PER_DAY):
+        self.open_minutes = open_minutes
+        self._days: Dict[str, Dict[tuple, Bucket]] = defaultdict(dict)
+
+    def _bucket(self, record: AppointmentRecord) -> Bucket:
+        return self._days[record.day].setdefault((record.service, record.chair), Bucket())
+
+    def _add(self, record: AppointmentRecord) -> Bucket:
+        bucket = self._bucket(record)
+        bucket.booked += 1
+        if record.cancelled:
+            bucket.cancelled += 1
+        else:
+            bucket.active += 1
+            bucket.minutes += record.minutes
+            bucket.revenue += record.cost
+        return bucket
+
+    def _remove(self, record: AppointmentRecord) -> Bucket:
+        bucket = self._bucket(record)
+        bucket.booked -= 1
+        if record.cancelled:
+            bucket.cancelled -= 1
+        else:
+            bucket.active -= 1
+            bucket.minutes -= record.minutes
+            bucket.revenue -= record.cost
+        return bucket
+
+    def apply(self, event: str, before: Optional[AppointmentRecord], after: Optional[AppointmentRecord]) -> None:
+        """
+        Update the aggregates for one mutation
+
+        Args:
+            event: "booked", "cancelled" or "rescheduled"
+            before: The appointment before the change (None when booked)
+            after: The appointment after the change
+        """
+        if event == "booked":
+            self._add(after)
+        elif event == "cancelled":
+            self._remove(before)
+            self._add(after)
+        elif event == "rescheduled":
+            self._remove(before).rescheduled_out += 1
+            self._add(after).rescheduled_in += 1
+
+    @classmethod
+    def rebuild(cls, records: Iterable[AppointmentRecord], open_minutes: int = OPEN_MINUTES_PER_DAY) -> "AppointmentAggregates":
+        """Recompute every aggregate from scratch"""
+        aggregates = cls(open_minutes)
+        for record in records:
+            aggregates._add(record)
+        return aggregates
+
+    def diff(self, other: "AppointmentAggregates") -> List[str]:
+        """Describe buckets whose derivable state differs; empty when consistent"""
+        problems = []
+        for day in sorted(set(self._days) | set(other._days)):
+            keys = set(self._days.get(day, {})) | set(other._days.get(day, {}))
+            for key in sorted(keys):
+                mine = self._days.get(day, {}).get(key, Bucket())
+                theirs = other._days.get(day, {}).get(key, Bucket())
+                for field in Bucket.STATE_FIELDS:
+                    if abs(getattr(mine, field) - getattr(theirs, field)) > 1e-6:
+                        problems.append(f"{day} {key[0]} {key[1]} {field}: {getattr(mine, field)} != {getattr(theirs, field)}")
+        return problems
+
+    def _range(self, start: date, end: date):
+        day = start
+        while day <= end:
+            yield day.isoformat(), self._days.get(day.isoformat(), {})
+            day += timedelta(days=1)
+
+    def utilization(self, day: date) -> Dict[str, float]:
+        """Share of each chair's open minutes that are booked on a day"""
+        minutes = defaultdict(int)
+        for (_, chair), bucket in self._days.get(day.isoformat(), {}).items():
+            minutes[chair] += bucket.minutes
+        return {chair: booked / self.open_minutes for chair, booked in minutes.items()}
+
+    def revenue_by_service(self, start: date, end: date) -> Dict[str, float]:
+        revenue = defaultdict(float)
+        for _, buckets in self._range(start, end):
+            for (service, _), bucket in buckets.items():
+                revenue[service] += bucket.revenue
+        return dict(revenue)
+
+    def cancellation_rate(self, start: date, end: date) -> float:
+        booked = cancelled = 0
+        for _, buckets in self._range(start, end):
+            for bucket in buckets.values():
+                booked += bucket.booked
+                cancelled += bucket.cancelled
+        return cancelled / booked if booked else 0.0
+
+    def daily_summary(self, start: date, end: date) -> List[Dict]:
+        """One row per day with totals across services and chairs"""
+        rows = []
+        for day, buckets in self._range(start, end):
+            if not buckets:
+                continue
+            totals = Bucket()
+            for bucket in buckets.values():
+                for field in fields(Bucket):
+                    setattr(totals, field.name, getattr(totals, field.name) + getattr(bucket, field.name))
+            rows.append({"day": day, **asdict(totals)})
+        return rows
+
+
+def records_from_export(appointments: Dict, services: Dict) -> List[AppointmentRecord]:
+    """
+    Records from a JSON dump of either assistant's `appointments` dict
+
+    dental_assistant.py stores dates as DD/MM/YYYY, the Responses-API
+    assistant as YYYY-MM-DD.
+    """
+    records = []
+    for appointment in appointments.values():
+        raw = appointment["date"]
+        day = datetime.strptime(raw, "%d/%m/%Y" if "/" in raw else "%Y-%m-%d").date()
+        records.append(make_record(
+            day, appointment["service"], appointment["status"] == "cancelled", services,
+            appointment.get("chair", DEFAULT_CHAIR)
+        ))
+    return records
+
+
+def main():
+    """Full rebuild from an export: python analytics.py appointments.json [services.json]"""
+    if len(sys.argv) < 2:
+        print("usage: python analytics.py appointments.json [services.json]")
+        return 1
+    with open(sys.argv[1]) as f:
+        appointments = json.load(f)
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            services = json.load(f)
+    else:
+        from dental_assistant import DentalAssistant
+        services = DentalAssistant().practice_info["services"]
+    records = records_from_export(appointments, services)
+    aggregates = AppointmentAggregates.rebuild(records)
+    if records:
+        days = sorted(record.day for record in records)
+        start, end = date.fromisoformat(days[0]), date.fromisoformat(days[-1])
+        for row in aggregates.daily_summary(start, end):
+            print(json.dumps(row))
+        print(json.dumps({"revenue_by_service": aggregates.revenue_by_service(start, end),
+                          "cancellation_rate": aggregates.cancellation_rate(start, end)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
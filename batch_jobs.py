@@ -0,0 +1,429 @@
+"""
+Overnight batch pipeline
+
+    python batch_jobs.py summaries [--local]   summarise yesterday's conversations
+    python batch_jobs.py poll [--local]        collect finished jobs and write results back
+    python batch_jobs.py status                list tracked jobs
+
+Non-interactive work (appointment confirmations, re-engagement of patients
+overdue for a check-up, conversation summaries) is built into one JSONL file
+per job and sent through the Batch API, which is cheaper than per-item
+completions and does not compete with patients for the interactive rate
+limit. LocalBatchBackend stands in for the API in tests and offline runs.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, date, timedelta
+from typing import Callable, Dict, List, Optional
+
+from session_store import DEFAULT_DB_PATH, SessionStore
+from model_policy import model_policy
+
+# Job state lives next to the sessions and reminders
+BATCH_DB_PATH = os.getenv("DENTAL_BATCH_DB", DEFAULT_DB_PATH)
+BATCH_DIR = os.getenv("DENTAL_BATCH_DIR", "batches")
+
+CHAT_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+MAX_OUTPUT_TOKENS = 200
+
+# Patients without a check-up or cleaning in this many days are invited back
+OVERDUE_DAYS = 180
+RECALL_SERVICES = ("Check-up", "Cleaning")
+
+# Job states; the first three mirror the Batch API, the rest are ours
+OPEN_STATES = ("validating", "in_progress", "finalizing")
+FINAL_STATES = ("written_back", "failed", "expired", "cancelled")
+
+
+def chat_request(custom_id: str, system: str, prompt: str, model: str) -> Dict:
+    """One line of a Batch API input file"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+            "max_tokens": MAX_OUTPUT_TOKENS,
+        },
+    }
+
+
+# Request builders. dental_assistant.py keeps patients by id and appointments
+# with DD/MM/YYYY dates.
+
+def confirmation_requests(assistant, day: Optional[date] = None) -> List[Dict]:
+    """Confirmation messages for every appointment scheduled on `day` (tomorrow by default)"""
+    day = day or date.today() + timedelta(days=1)
+    model = model_policy.select("Batch Jobs", reason="confirmations").model
+    practice = assistant.practice_info
+    system = (f"You write short, friendly appointment confirmation texts for {practice['name']}, "
+              f"{practice['location']}. Mention the service, date and time, and ask the patient to call "
+              f"{practice['phone']} to reschedule. No more than 3 sentences.")
+    requests = []
+    for appointment_id, appointment in assistant.appointments.items():
+        if appointment["status"] != "scheduled" or appointment["date"] != day.strftime("%d/%m/%Y"):
+            continue
+        patient = assistant.patients[appointment["patient_id"]]
+        prompt = (f"Patient: {patient['name']}\nService: {appointment['service']}\n"
+                  f"Date: {appointment['date']}\nTime: {appointment['time']}")
+        requests.append(chat_request(f"confirm:{appointment_id}", system, prompt, model))
+    return requests
+
+
+def reengagement_requests(assistant, today: Optional[date] = None, overdue_days: int = OVERDUE_DAYS) -> List[Dict]:
+    """Invitations for patients whose last check-up or cleaning is overdue"""
+    today = today or date.today()
+    model = model_policy.select("Batch Jobs", reason="re-engagement").model
+    practice = assistant.practice_info
+    system = (f"You write short re-engagement messages for {practice['name']} inviting a patient back "
+              f"for a routine check-up. Be warm, not pushy. Include the phone number {practice['phone']}. "
+              f"No more than 3 sentences.")
+    requests = []
+    for patient_id, patient in assistant.patients.items():
+        visits = [datetime.strptime(assistant.appointments[app_id]["date"], "%d/%m/%Y").date()
+                  for app_id in patient["appointments"]
+                  if assistant.appointments[app_id]["status"] == "scheduled"
+                  and assistant.appointments[app_id]["service"] in RECALL_SERVICES]
+        if any(visit >= today for visit in visits):
+            continue  # Already booked
+        last = max(visits, default=None)
+        if last is not None and (today - last).days < overdue_days:
+            continue
+        prompt = (f"Patient: {patient['name']}\n"
+                  f"Last check-up: {last.strftime('%d/%m/%Y') if last else 'never'}")
+        requests.append(chat_request(f"reengage:{patient_id}", system, prompt, model))
+    return requests
+
+
+def summary_requests(session_store: SessionStore, since: float) -> List[Dict]:
+    """Summaries of every conversation checkpointed since `since` (epoch seconds)"""
+    model = model_policy.select("Batch Jobs", reason="summaries").model
+    system = ("Summarise this dental front-desk conversation for the staff in 2-3 sentences: "
+              "what the patient wanted, what was done, and anything left to follow up.")
+    requests = []
+    for session_id, state in session_store.updated_since(since):
+        recent = state.get("recent") or []
+        if not recent:
+            continue
+        transcript = "\n".join(f"{msg.get('role')}: {msg.get('content')}" for msg in recent)
+        earlier = state.get("summary") or (state.get("state") or {}).get("summary")
+        prompt = f"Earlier: {earlier}\n\n{transcript}" if earlier else transcript
+        requests.append(chat_request(f"summary:{session_id}", system, prompt, model))
+    return requests
+
+
+# Backends
+
+class OpenAIBatchBackend:
+    """The OpenAI Batch API"""
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from dental_assistant_responsesApi import get_client
+            self._client = get_client()
+        return self._client
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id, endpoint=CHAT_ENDPOINT, completion_window=COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def status(self, remote_id: str) -> Dict:
+        batch = self.client.batches.retrieve(remote_id)
+        counts = batch.request_counts
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "counts": {"total": counts.total, "completed": counts.completed, "failed": counts.failed} if counts else {},
+        }
+
+    def download(self, file_id: str, path: str) -> None:
+        self.client.files.content(file_id).write_to_file(path)
+
+
+def template_responder(body: Dict) -> str:
+    """Default local answer: echoes the request's details so write-back can be checked"""
+    details = body["messages"][-1]["content"].replace("\n", "; ")
+    return f"[local batch] {details}"
+
+
+class LocalBatchBackend:
+    """
+    Stand-in for the Batch API that runs the requests in-process
+
+    A job is `in_progress` after submit and completes on the first status
+    check, so callers see the same submit/poll/download sequence as with the
+    real API without spending tokens.
+    """
+
+    def __init__(self, responder: Callable[[Dict], str] = template_responder, directory: str = BATCH_DIR):
+        self.responder = responder
+        self.directory = directory
+        self._jobs: Dict[str, Dict] = {}
+
+    def submit(self, input_path: str) -> str:
+        remote_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        self._jobs[remote_id] = {"input_path": input_path, "status": "in_progress"}
+        return remote_id
+
+    def _run(self, remote_id: str) -> None:
+        job = self._jobs[remote_id]
+        output_path = os.path.join(self.directory, f"{remote_id}_output.jsonl")
+        completed = failed = 0
+        with open(job["input_path"]) as src, open(output_path, "w") as out:
+            for line in src:
+                request = json.loads(line)
+                try:
+                    content = self.responder(request["body"])
+                    response = {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}}
+                    error = None
+                    completed += 1
+                except Exception as e:
+                    response, error = None, {"message": str(e)}
+                    failed += 1
+                out.write(json.dumps({"custom_id": request["custom_id"], "response": response, "error": error}) + "\n")
+        job.update(status="completed", output_file_id=output_path,
+                   counts={"total": completed + failed, "completed": completed, "failed": failed})
+
+    def status(self, remote_id: str) -> Dict:
+        job = self._jobs.get(remote_id)
+        if job is None:
+            # Local jobs do not survive a restart
+            return {"status": "expired", "output_file_id": None, "error_file_id": None, "counts": {}}
+        if job["status"] == "in_progress":
+            self._run(remote_id)
+        return {"status": job["status"], "output_file_id": job.get("output_file_id"),
+                "error_file_id": None, "counts": job.get("counts", {})}
+
+    def download(self, file_id: str, path: str) -> None:
+        if os.path.abspath(file_id) != os.path.abspath(path):
+            with open(file_id) as src, open(path, "w") as dst:
+                dst.write(src.read())
+
+
+class BatchJobStore:
+    """Job state in SQLite, so a job submitted tonight can be collected by tomorrow's process"""
+
+    def __init__(self, path: str = BATCH_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, remote_id TEXT, status TEXT NOT NULL, "
+            "input_path TEXT NOT NULL, output_path TEXT, requests INTEGER NOT NULL, "
+            "counts TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add(self, job_id: str, kind: str, remote_id: str, input_path: str, requests: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO batch_jobs VALUES (?, ?, ?, 'validating', ?, NULL, ?, NULL, ?, ?)",
+                (job_id, kind, remote_id, input_path, requests, now, now),
+            )
+            self._conn.commit()
+
+    def update(self, job_id: str, **fields) -> None:
+        if "counts" in fields:
+            fields["counts"] = json.dumps(fields["counts"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE batch_jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def jobs(self, open_only: bool = False) -> List[Dict]:
+        query = "SELECT * FROM batch_jobs"
+        if open_only:
+            query += f" WHERE status NOT IN ({', '.join('?' * len(FINAL_STATES))})"
+        query += " ORDER BY created_at"
+        with self._lock:
+            cursor = self._conn.execute(query, FINAL_STATES if open_only else ())
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        jobs = [dict(zip(columns, row)) for row in rows]
+        for job in jobs:
+            job["counts"] = json.loads(job["counts"]) if job["counts"] else {}
+        return jobs
+
+
+def parse_results(output_path: str) -> Dict[str, Optional[str]]:
+    """custom_id -> generated text, or None for requests that failed"""
+    results = {}
+    with open(output_path) as f:
+        for line in f:
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            choices = body.get("choices") or []
+            ok = response.get("status_code") == 200 and choices
+            results[record["custom_id"]] = choices[0]["message"]["content"] if ok else None
+    return results
+
+
+class BatchPipeline:
+    """
+    Builds, submits and tracks batch jobs and writes their results back
+
+    Results land on the records they were built from: `confirmation_message`
+    on appointments, `reengagement_message` on patients and `daily_summary`
+    in the session state.
+    """
+
+    def __init__(self, backend=None, jobs: Optional[BatchJobStore] = None, assistant=None,
+                 session_store: Optional[SessionStore] = None, directory: str = BATCH_DIR):
+        self.backend = backend or OpenAIBatchBackend()
+        self.jobs = jobs or BatchJobStore()
+        self.assistant = assistant
+        self.session_store = session_store
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, kind: str, requests: List[Dict]) -> Optional[str]:
+        """Write the requests to a JSONL file and submit it; returns the job id, or None if empty"""
+        if not requests:
+            return None
+        job_id = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        input_path = os.path.join(self.directory, f"{job_id}.jsonl")
+        with open(input_path, "w") as f:
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+        remote_id = self.backend.submit(input_path)
+        self.jobs.add(job_id, kind, remote_id, input_path, len(requests))
+        model_policy.log("batch_submit", job_id=job_id, kind=kind, requests=len(requests))
+        return job_id
+
+    def submit_confirmations(self, day: Optional[date] = None) -> Optional[str]:
+        return self.submit("confirmations", confirmation_requests(self.assistant, day))
+
+    def submit_reengagement(self, today: Optional[date] = None) -> Optional[str]:
+        return self.submit("reengagement", reengagement_requests(self.assistant, today))
+
+    def submit_summaries(self, since: Optional[float] = None) -> Optional[str]:
+        since = time.time() - 24 * 3600 if since is None else since
+        return self.submit("summaries", summary_requests(self.session_store, since))
+
+    def can_write_back(self, kind: str) -> bool:
+        """Whether this pipeline holds the records a kind of job writes its results to"""
+        return self.session_store is not None if kind == "summaries" else self.assistant is not None
+
+    def poll(self) -> List[Dict]:
+        """
+        Check every open job once; finished ones are downloaded and written back
+
+        Returns the jobs that changed to a final state, or to `completed`
+        when their results could not be applied here; those stay open until
+        a pipeline holding the records polls.
+        """
+        finished = []
+        for job in self.jobs.jobs(open_only=True):
+            remote = self.backend.status(job["remote_id"])
+            if remote["status"] in OPEN_STATES:
+                self.jobs.update(job["job_id"], status=remote["status"], counts=remote["counts"])
+                continue
+            if remote["status"] != "completed" or not remote["output_file_id"]:
+                status = remote["status"] if remote["status"] in FINAL_STATES else "failed"
+                self.jobs.update(job["job_id"], status=status, counts=remote["counts"])
+                finished.append(dict(job, status=status))
+                continue
+            if not self.can_write_back(job["kind"]):
+                self.jobs.update(job["job_id"], status="completed", counts=remote["counts"])
+                finished.append(dict(job, status="completed"))
+                continue
+            output_path = os.path.join(self.directory, f"{job['job_id']}_output.jsonl")
+            self.backend.download(remote["output_file_id"], output_path)
+            written = self.write_back(job["kind"], parse_results(output_path))
+            self.jobs.update(job["job_id"], status="written_back", output_path=output_path,
+                             counts=dict(remote["counts"], written_back=written))
+            model_policy.log("batch_written_back", job_id=job["job_id"], kind=job["kind"], written=written)
+            finished.append(dict(job, status="written_back"))
+        return finished
+
+    def write_back(self, kind: str, results: Dict[str, Optional[str]]) -> int:
+        """Store each result on the record its request came from; returns how many were stored"""
+        written = 0
+        for custom_id, text in results.items():
+            if text is None:
+                continue
+            prefix, _, key = custom_id.partition(":")
+            if prefix == "confirm" and self.assistant is not None:
+                appointment = self.assistant.appointments.get(int(key))
+                if appointment is not None:
+                    appointment["confirmation_message"] = text
+                    written += 1
+            elif prefix == "reengage" and self.assistant is not None:
+                patient = self.assistant.patients.get(int(key))
+                if patient is not None:
+                    patient["reengagement_message"] = text
+                    written += 1
+            elif prefix == "summary" and self.session_store is not None:
+                # Leaves updated_at alone, or tomorrow's run would summarise the session again
+                if self.session_store.set_field(key, "daily_summary", text):
+                    written += 1
+        return written
+
+    def wait(self, interval: float = 60.0, timeout: float = 24 * 3600) -> None:
+        """Poll until no job this pipeline can finish is open, or `timeout` seconds have passed"""
+        deadline = time.monotonic() + timeout
+        while self.waiting() and time.monotonic() < deadline:
+            self.poll()
+            if self.waiting():
+                time.sleep(interval)
+
+    def waiting(self) -> List[Dict]:
+        """Open jobs, apart from completed ones whose records are not held here"""
+        return [job for job in self.jobs.jobs(open_only=True)
+                if job["status"] != "completed" or self.can_write_back(job["kind"])]
+
+
+def main():
+    args = sys.argv[1:]
+    command = args[0] if args else "status"
+    local = "--local" in args
+    backend = LocalBatchBackend() if local else None
+    pipeline = BatchPipeline(backend, session_store=SessionStore())
+    if command == "summaries":
+        job_id = pipeline.submit_summaries()
+        print(f"Submitted {job_id}" if job_id else "No conversations to summarise")
+        if local:
+            pipeline.poll()
+    elif command == "poll":
+        unapplied = 0
+        for job in pipeline.poll():
+            if job["status"] == "completed":
+                unapplied += 1
+                print(f"{job['job_id']}: completed, results NOT applied (the {job['kind']} records are not loaded here)")
+            else:
+                print(f"{job['job_id']}: {job['status']}")
+        if unapplied:
+            print(f"{unapplied} job(s) left open; poll from a process with the appointment records to apply them")
+            return 1
+    elif command != "status":
+        print(__doc__)
+        return 1
+    for job in pipeline.jobs.jobs():
+        print(f"{job['job_id']}  {job['status']:<13} {job['requests']:>5} requests  {json.dumps(job['counts'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
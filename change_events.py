@@ -0,0 +1,296 @@
+"""
+Change events for patient and appointment mutations
+
+Every registration, booking, cancellation and reschedule, in all three
+assistants, publishes a ChangeEvent (before/after, actor, session id) to the
+in-process ring buffer `change_log`. Consumers either subscribe a sink, which
+a background thread feeds in order, or poll `events_since(seq)` for deltas.
+The multi-agent tools' SchedulingStore publishes under its own lock, so under
+server.py the log lives in the store process; poll it with
+store.changes_since(seq).
+
+Backpressure: a blocking subscriber that falls a full buffer behind makes
+publishers wait up to PUBLISH_TIMEOUT seconds for it; after that it is
+skipped ahead, its missed events are counted and nobody waits for it again
+until it delivers, so a dead webhook costs one timeout, not one per booking.
+Non-blocking subscribers and pollers just see a gap.
+
+Sinks are chosen with environment variables (see sinks_from_env):
+
+    DENTAL_CHANGES_FILE=changes.jsonl       append JSON lines, for tail -f
+    DENTAL_CHANGES_SOCKET=127.0.0.1:7070    JSON lines over TCP, or a Unix socket path
+    DENTAL_CHANGES_WEBHOOK=http://...       POST {"events": [...]} batches
+"""
+import os
+import json
+import time
+import socket
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CHANGE_BUFFER = int(os.getenv("DENTAL_CHANGE_BUFFER", "4096"))
+PUBLISH_TIMEOUT = float(os.getenv("DENTAL_CHANGE_PUBLISH_TIMEOUT", "2.0"))
+DELIVERY_BATCH = 256
+RETRY_DELAY = 1.0  # Seconds before a failed delivery is retried
+
+
+@dataclass
+class ChangeEvent:
+    seq: int                    # Position in the log; also a version number of the data
+    ts: float
+    source: str                 # Which assistant or clinic made the change
+    entity: str                 # "patient" or "appointment"
+    action: str                 # "registered", "booked", "cancelled" or "rescheduled"
+    key: Any                    # Patient or appointment id after the change
+    before: Optional[Dict] = None
+    after: Optional[Dict] = None
+    actor: str = "assistant"
+    session_id: Optional[str] = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), default=str, separators=(",", ":"))
+
+
+class ChangeLog:
+    """Fixed-size ring buffer of change events with ordered, backpressured subscribers"""
+
+    def __init__(self, capacity: int = CHANGE_BUFFER, publish_timeout: float = PUBLISH_TIMEOUT):
+        self.capacity = capacity
+        self.publish_timeout = publish_timeout
+        self._events: List[Optional[ChangeEvent]] = [None] * capacity
+        self._next = 1  # Sequence number of the next event
+        self._cond = threading.Condition()
+        self._subscriptions: List["Subscription"] = []
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest event, 0 before the first"""
+        return self._next - 1
+
+    def publish(self, source: str, entity: str, action: str, key, before=None, after=None,
+                actor: str = "assistant", session_id: Optional[str] = None) -> ChangeEvent:
+        with self._cond:
+            deadline = time.monotonic() + self.publish_timeout
+            while True:
+                laggards = [sub for sub in self._subscriptions
+                            if sub.block and not sub.stalled and self._next - sub.cursor >= self.capacity]
+                if not laggards:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Give up on them rather than stall the mutation; they see a gap
+                    for sub in laggards:
+                        sub.skip_to(self._next - self.capacity + 1)
+                        sub.stalled = True
+                    break
+                self._cond.wait(remaining)
+            event = ChangeEvent(self._next, time.time(), source, entity, action, key,
+                                _snapshot(before), _snapshot(after), actor, session_id)
+            self._events[event.seq % self.capacity] = event
+            self._next += 1
+            self._cond.notify_all()
+            return event
+
+    def _read(self, cursor: int, limit: int) -> Tuple[List[ChangeEvent], int]:
+        """Events from `cursor` on, still held by the buffer; returns them and the seq they start at"""
+        start = max(cursor, self._next - self.capacity, 1)
+        end = min(self._next, start + limit)
+        return [self._events[seq % self.capacity] for seq in range(start, end)], start
+
+    def events_since(self, seq: int, limit: int = DELIVERY_BATCH) -> Tuple[List[ChangeEvent], int]:
+        """
+        Events after `seq`, for consumers that poll
+
+        Returns:
+            tuple: (events, missed) where missed counts events already
+                overwritten; a consumer with missed > 0 should rebuild
+        """
+        with self._cond:
+            events, start = self._read(seq + 1, limit)
+        return events, start - (seq + 1)
+
+    def subscribe(self, sink, block: bool = True, name: Optional[str] = None) -> "Subscription":
+        """Feed every event from now on to `sink.write(events)` on a background thread"""
+        subscription = Subscription(self, sink, block, name)
+        with self._cond:
+            subscription.cursor = self._next
+            self._subscriptions.append(subscription)
+        subscription.start()
+        return subscription
+
+    def unsubscribe(self, subscription: "Subscription", drain_timeout: float = 5.0) -> None:
+        subscription.drain(drain_timeout)
+        subscription.stop()
+        with self._cond:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "last_seq": self.last_seq,
+                "subscribers": {sub.name: {"lag": self._next - sub.cursor, "delivered": sub.delivered,
+                                           "missed": sub.missed, "failures": sub.failures,
+                                           "stalled": sub.stalled}
+                                for sub in self._subscriptions},
+            }
+
+
+def _snapshot(record):
+    """A copy of a record as plain data, so later mutations don't change published events"""
+    if record is None:
+        return None
+    if hasattr(record, "__dataclass_fields__"):
+        return asdict(record)
+    return json.loads(json.dumps(record, default=str))
+
+
+class Subscription(threading.Thread):
+    """Delivers a log's events to one sink in order, retrying a failed batch until it goes through"""
+
+    def __init__(self, log: ChangeLog, sink, block: bool = True, name: Optional[str] = None):
+        super().__init__(daemon=True, name=name or f"changes-{type(sink).__name__}")
+        self.log = log
+        self.sink = sink
+        self.block = block
+        self.cursor = 1  # Next sequence number to deliver
+        self.delivered = 0
+        self.missed = 0
+        self.failures = 0
+        self.stalled = False  # Set when publishers gave up waiting; cleared by the next delivery
+        self._stopped = threading.Event()
+
+    def skip_to(self, seq: int) -> None:
+        """Called with the log's lock held"""
+        if seq > self.cursor:
+            self.missed += seq - self.cursor
+            self.cursor = seq
+
+    def run(self):
+        log = self.log
+        while not self._stopped.is_set():
+            with log._cond:
+                while self.cursor >= log._next and not self._stopped.is_set():
+                    log._cond.wait(0.5)
+                if self._stopped.is_set():
+                    return
+                events, start = log._read(self.cursor, DELIVERY_BATCH)
+                self.skip_to(start)
+            try:
+                self.sink.write(events)
+            except Exception as e:
+                self.failures += 1
+                print(f"Change sink {self.name} failed: {e}")
+                self._stopped.wait(RETRY_DELAY)
+                continue
+            with log._cond:
+                # A publisher may have skipped us ahead meanwhile
+                self.cursor = max(self.cursor, events[-1].seq + 1)
+                self.delivered += len(events)
+                self.stalled = False
+                log._cond.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """Wait until every event published so far has been delivered"""
+        deadline = time.monotonic() + timeout
+        with self.log._cond:
+            while self.cursor < self.log._next and self.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.log._cond.wait(remaining)
+        return True
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self.log._cond:
+            self.log._cond.notify_all()
+
+
+# Sinks: anything with write(events)
+
+class FileSink:
+    """Appends events as JSON lines"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, events: List[ChangeEvent]) -> None:
+        with open(self.path, "a") as f:
+            f.write("".join(event.to_json() + "\n" for event in events))
+
+
+class SocketSink:
+    """Streams events as JSON lines to a TCP "host:port" or a Unix socket path, reconnecting as needed"""
+
+    def __init__(self, address: str, timeout: float = 5.0):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+
+    def _connect(self):
+        if ":" in self.address and not self.address.startswith("/"):
+            host, port = self.address.rsplit(":", 1)
+            return socket.create_connection((host, int(port)), timeout=self.timeout)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        return sock
+
+    def write(self, events: List[ChangeEvent]) -> None:
+        if self._sock is None:
+            self._sock = self._connect()
+        try:
+            self._sock.sendall("".join(event.to_json() + "\n" for event in events).encode())
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+
+
+class WebhookSink:
+    """POSTs {"events": [...]} batches; any non-2xx answer is retried"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def write(self, events: List[ChangeEvent]) -> None:
+        from urllib.request import Request, urlopen
+        body = ('{"events":[' + ",".join(event.to_json() for event in events) + "]}").encode()
+        request = Request(self.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class CallbackSink:
+    """Hands each batch to a function; the in-process stand-in for a webhook"""
+
+    def __init__(self, callback: Callable[[List[ChangeEvent]], None]):
+        self.callback = callback
+
+    def write(self, events: List[ChangeEvent]) -> None:
+        self.callback(events)
+
+
+def sinks_from_env() -> List:
+    sinks = []
+    if os.getenv("DENTAL_CHANGES_FILE"):
+        sinks.append(FileSink(os.environ["DENTAL_CHANGES_FILE"]))
+    if os.getenv("DENTAL_CHANGES_SOCKET"):
+        sinks.append(SocketSink(os.environ["DENTAL_CHANGES_SOCKET"]))
+    if os.getenv("DENTAL_CHANGES_WEBHOOK"):
+        sinks.append(WebhookSink(os.environ["DENTAL_CHANGES_WEBHOOK"]))
+    return sinks
+
+
+def subscribe_from_env(log: Optional["ChangeLog"] = None) -> List[Subscription]:
+    """Subscribe the sinks configured in the environment; call once per process"""
+    log = log or change_log
+    return [log.subscribe(sink) for sink in sinks_from_env()]
+
+
+# Shared by all three assistants
+change_log = ChangeLog()
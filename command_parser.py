@@ -0,0 +1,94 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from slot_filling import (
+    DEFAULT_SERVICES, WEEKDAYS,
+    extract_date, extract_name, extract_phone, extract_service, extract_time,
+)
+
+# Commands are matched against the whole message so sentences that merely
+# mention cancelling or booking still go to the model
+CANCEL_RE = re.compile(r"^\s*cancel\s+(?:appointment|appt)?\s*#?\s*(?P<id>\d+)\s*\.?\s*$", re.I)
+RESCHEDULE_RE = re.compile(
+    r"^\s*reschedule\s+(?:(?:appointment|appt)\s*#?\s*(?P<id>\d+)|(?P<old>.+?))\s+to\s+(?P<new>.+?)"
+    r"(?:\s+for\s+(?P<name>[A-Za-z][A-Za-z'\-]*(?:\s+[A-Za-z][A-Za-z'\-]*){0,2}))?\s*\.?\s*$",
+    re.I
+)
+BOOK_RE = re.compile(r"^\s*(?:please\s+|i(?:'d| would)? (?:like|want) to\s+|can you\s+)?book\b", re.I)
+FOR_NAME_RE = re.compile(r"\bfor\s+([A-Z][A-Za-z'\-]+(?:\s+[A-Z][A-Za-z'\-]+){0,2})")
+
+# Capitalised words after "for" that are dates, not names ("for Friday", "for Nov 3")
+MONTH_NAMES = ["january", "february", "march", "april", "may", "june", "july",
+               "august", "september", "october", "november", "december"]
+NOT_NAMES = set(WEEKDAYS) | {"today", "tomorrow", "next", "this"}
+
+
+@dataclass
+class Command:
+    action: str                           # "book", "cancel" or "reschedule"
+    appointment_id: Optional[int] = None
+    patient_name: Optional[str] = None
+    phone: Optional[str] = None
+    service: Optional[str] = None
+    date: Optional[str] = None            # ISO date of the appointment to book or move
+    time: Optional[str] = None            # HH:MM
+    new_date: Optional[str] = None
+    new_time: Optional[str] = None
+
+
+def _for_name(text):
+    for match in FOR_NAME_RE.finditer(text):
+        words = []
+        for word in match.group(1).split():
+            lowered = word.lower().rstrip(".")
+            if lowered in NOT_NAMES or (len(lowered) >= 3 and any(m.startswith(lowered) for m in MONTH_NAMES)):
+                break
+            words.append(word)
+        if words:
+            return " ".join(words)
+    return None
+
+
+def _when(text, today):
+    found = extract_date(text, today)
+    return (found.isoformat() if found else None), extract_time(text)
+
+
+def parse_command(text, services=DEFAULT_SERVICES, today=None):
+    """
+    Parse a fully specified command
+
+    Understands "cancel appointment 42", "reschedule appointment 42 to Friday at 2pm",
+    "reschedule 2026-11-03 10:00 to 2026-11-05 14:00 for Jane Doe" and
+    "book a cleaning on Friday at 9" (optionally "for Jane Doe" or with a phone number).
+
+    Returns:
+        Command: The parsed command, or None when the text is not a complete command
+    """
+    match = CANCEL_RE.match(text)
+    if match:
+        return Command("cancel", appointment_id=int(match.group("id")))
+
+    match = RESCHEDULE_RE.match(text)
+    if match:
+        new_date, new_time = _when(match.group("new"), today)
+        if not (new_date and new_time):
+            return None
+        if match.group("id"):
+            return Command("reschedule", appointment_id=int(match.group("id")), new_date=new_date, new_time=new_time)
+        old_date, old_time = _when(match.group("old"), today)
+        name = match.group("name")
+        if not (old_date and old_time and name):
+            return None
+        return Command("reschedule", patient_name=" ".join(w.capitalize() for w in name.split()),
+                       date=old_date, time=old_time, new_date=new_date, new_time=new_time)
+
+    if BOOK_RE.match(text):
+        booking_date, booking_time = _when(text, today)
+        service = extract_service(text, services)
+        if not (booking_date and booking_time and service):
+            return None
+        return Command("book", patient_name=_for_name(text) or extract_name(text), phone=extract_phone(text),
+                       service=service, date=booking_date, time=booking_time)
+    return None
@@ -0,0 +1,96 @@
+import re
+from typing import Callable, Dict, List, Optional
+from slot_filling import detect_intent
+
+QUESTION_RE = re.compile(r"\?\s*$|^(what|when|where|how|why|do|does|is|are|can|will)\b", re.I)
+
+# Most recent relevant turns each specialist sees; older ones live in the summary
+MAX_VIEW_TURNS = 8
+
+# Topics of conversation each specialist needs to see
+AGENT_TOPICS = {
+    "Registration Agent": {"book"},
+    "Booking Agent": {"book"},
+    "Rescheduling Agent": {"reschedule", "history"},
+    "Cancellation Agent": {"cancel", "history"},
+    "FAQ Agent": {"faq"},
+}
+
+
+class ConversationContext:
+    """
+    Per-agent views of the conversation
+
+    Every turn is tagged with a topic (the intent it started, or the one it
+    continues). Each agent's view is cached and only extended with the turns
+    added since it was last built, so a handoff costs O(new turns).
+    """
+
+    def __init__(self, max_turns: int = MAX_VIEW_TURNS):
+        self.max_turns = max_turns
+        self.turns: List[tuple] = []  # (topic, input item)
+        self.topic: Optional[str] = None
+        self._views: Dict[str, list] = {}  # agent name -> [turns consumed, cached items]
+
+    def add_user(self, text: str) -> str:
+        # Questions without a booking intent go to the FAQ agent; other answers,
+        # like a phone number, continue the current topic
+        intent = detect_intent(text)
+        if not intent and (self.topic is None or QUESTION_RE.search(text.strip())):
+            intent = "faq"
+        self.topic = intent or self.topic
+        self.turns.append((self.topic, {"role": "user", "content": text}))
+        return self.topic
+
+    def add_assistant(self, text: str) -> None:
+        self.turns.append((self.topic, {"role": "assistant", "content": text}))
+
+    def load(self, messages: List[Dict]) -> None:
+        """Rebuild the context from checkpointed {"role", "content"} messages"""
+        for msg in messages:
+            if msg["role"] == "user":
+                self.add_user(msg["content"])
+            else:
+                self.add_assistant(msg["content"])
+
+    def clear(self) -> None:
+        """Drop every turn and cached view, keeping this object for the handoff filters"""
+        self.turns.clear()
+        self._views.clear()
+        self.topic = None
+
+    def reset_topic(self) -> None:
+        """Called when a task completes so the next message starts fresh"""
+        self.topic = None
+
+    @staticmethod
+    def state_item(state: Dict) -> Dict:
+        lines = [f"{key}: {value}" for key, value in state.items() if value]
+        return {"role": "system", "content": "Known details:\n" + "\n".join(lines)}
+
+    def view_for(self, agent_name: str, state: Dict) -> List[Dict]:
+        """Structured state plus the turns relevant to one specialist"""
+        topics = AGENT_TOPICS.get(agent_name)
+        consumed, items = self._views.get(agent_name, (0, []))
+        for topic, item in self.turns[consumed:]:
+            if topics is None or topic in topics:
+                items.append(item)
+        if len(items) > self.max_turns:
+            del items[:-self.max_turns]
+        self._views[agent_name] = [len(self.turns), items]
+        return [self.state_item(state), *items] if any(state.values()) else list(items)
+
+    def router_view(self, state: Dict) -> List[Dict]:
+        """The router only needs the state and the latest exchange to pick a specialist"""
+        recent = [item for _, item in self.turns[-2:]]
+        return [self.state_item(dict(state, current_topic=self.topic)), *recent]
+
+
+def make_input_filter(context: ConversationContext, agent_name: str, state_fn: Callable[[], Dict]):
+    """Handoff input filter that swaps the router's input for the specialist's own view"""
+    def input_filter(data):
+        return data.clone(
+            input_history=tuple(context.view_for(agent_name, state_fn())),
+            pre_handoff_items=(),
+        )
+    return input_filter
@@ -1,43 +1,163 @@
 import os
-import openai
+import copy
+import time
 from datetime import datetime, timedelta
 import re
-from dotenv import load_dotenv
 import json
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from session_store import SessionStore, compact_history
+from model_policy import model_policy
+from model_client import ResilientClient, ModelUnavailable, degraded_answer
+from rate_limiter import rate_limiter, coalescer, estimate_tokens, request_key, PRIORITY_BOOKING, PRIORITY_FAQ
+from slot_filling import detect_intent, intent_confidence
+from command_parser import parse_command
+from reminders import ReminderQueue, ReminderDispatcher, reminder_sender_from_env
+from analytics import AppointmentAggregates, make_record
+from history_export import export_history
+from patient_index import PatientIndex
+from render_cache import RenderCache
+from policy_index import policy_index
+from change_events import change_log, subscribe_from_env
+from profiling import profiler, profiled, profiled_turn, install_signal_toggle
 
-# Load environment variables
-load_dotenv()
+@lru_cache(maxsize=None)
+def get_openai():
+    """Import and configure the OpenAI client on first use so importing this module stays cheap"""
+    import openai
+    from dotenv import load_dotenv
+    
+    # Load environment variables
+    load_dotenv()
+    
+    # Set OpenAI API key
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    return openai
+
+# Terminal prompts used by the CLI adapters for each field a flow can ask for
+FIELD_PROMPTS = {
+    "phone": "\nPlease enter your phone number (10 digits): ",
+    "name": "Full Name: ",
+    "email": "Email Address: ",
+    "dob": "Date of Birth (DD/MM/YYYY): ",
+    "service": "\nSelect service number: ",
+    "date": "Date (DD/MM/YYYY): ",
+    "time": "Time (HH:MM, 24-hour format): ",
+    "appointment_id": "\nEnter appointment ID: ",
+    "confirm": "\nAre you sure you want to cancel this appointment? (yes/no): ",
+}
+
+@dataclass
+class FlowResult:
+    """Outcome of one step of a booking, rescheduling, cancellation or history flow."""
+    ok: bool = False
+    message: str = ""
+    needs: Optional[str] = None  # Next field to collect; None when the flow is finished
+    error: Optional[str] = None  # Why the last value given was rejected
+    options: List[str] = field(default_factory=list)  # Choices to show with the question
+    clear: Tuple[str, ...] = ()  # Fields to drop before asking again
+    data: Dict = field(default_factory=dict)
+
+# Messages that leave a flow respond() is running
+ABANDON_PHRASES = ("stop", "never mind", "nevermind", "forget it")
 
-# Set OpenAI API key
-openai.api_key = os.getenv('OPENAI_API_KEY')
+# Messages that start a flow without asking the model, and the action tags the model answers with
+HISTORY_PHRASES = ["show my appointment", "view my appointment", "appointment history",
+                   "my appointments", "check my appointments"]
+ACTION_TAGS = {
+    "ACTION: BOOK_APPOINTMENT": "book",
+    "ACTION: RESCHEDULE_APPOINTMENT": "reschedule",
+    "ACTION: CANCEL_APPOINTMENT": "cancel",
+    "ACTION: VIEW_APPOINTMENTS": "history",
+}
+
+# Used when no clinic config is given; see tenancy.py for multi-clinic setups
+DEFAULT_PRACTICE_INFO = {
+    "name": "Smile Bright Dental",
+    "hours": "Monday-Friday: 9:00 AM - 6:00 PM",
+    "services": {
+        "Cleaning": {"duration": "60", "cost": "100"},
+        "Check-up": {"duration": "30", "cost": "75"},
+        "Fillings": {"duration": "60", "cost": "150"},
+        "Root Canal": {"duration": "90", "cost": "800"},
+        "Crown": {"duration": "90", "cost": "1000"},
+        "Extraction": {"duration": "45", "cost": "200"}
+    },
+    "location": "123 Dental Street, Suite 100",
+    "phone": "(555) 123-4567",
+    "faqs": {
+        "parking": "Yes, we have free parking available in front of the clinic.",
+        "insurance": "We accept most major insurance providers. Please contact us with your specific provider.",
+        "emergency": "Yes, we provide emergency dental services. Call our emergency line at (555) 999-9999.",
+        "payment": "We accept cash, credit cards, and offer various payment plans.",
+        "cancellation": "Please provide at least 24 hours notice for cancellations to avoid any fees."
+    }
+}
+
+# Retries, hedging and failover for every chat completion
+model_client = ResilientClient("chat")
 
 class DentalAssistant:
-    def __init__(self):
+    def __init__(self, session_id=None, session_store=None, reminders=None, practice_info=None):
         self.patients = {}  # Dictionary to store patient information
+        self.patient_index = PatientIndex()  # Patients by name, phone and date of birth, tolerating typos
         self.appointments = {}  # Dictionary to store appointments
         self.current_patient = None
         self.conversation_history = []
-        self.practice_info = {
-            "name": "Smile Bright Dental",
-            "hours": "Monday-Friday: 9:00 AM - 6:00 PM",
-            "services": {
-                "Cleaning": {"duration": "60", "cost": "100"},
-                "Check-up": {"duration": "30", "cost": "75"},
-                "Fillings": {"duration": "60", "cost": "150"},
-                "Root Canal": {"duration": "90", "cost": "800"},
-                "Crown": {"duration": "90", "cost": "1000"},
-                "Extraction": {"duration": "45", "cost": "200"}
-            },
-            "location": "123 Dental Street, Suite 100",
-            "phone": "(555) 123-4567",
-            "faqs": {
-                "parking": "Yes, we have free parking available in front of the clinic.",
-                "insurance": "We accept most major insurance providers. Please contact us with your specific provider.",
-                "emergency": "Yes, we provide emergency dental services. Call our emergency line at (555) 999-9999.",
-                "payment": "We accept cash, credit cards, and offer various payment plans.",
-                "cancellation": "Please provide at least 24 hours notice for cancellations to avoid any fees."
-            }
-        }
+        self.session_id = session_id
+        self.session_store = session_store
+        self.summary = ""
+        self.slots = {}  # Details collected so far: patient_name, phone, service, requested_date
+        self.reminders = reminders  # ReminderQueue, or None to send no reminders
+        self._lock = threading.RLock()  # Flows may run concurrently from a server or batch job
+        self.analytics = AppointmentAggregates()  # Kept up to date on every book, cancel and reschedule
+        self.render_cache = RenderCache()  # History views per patient, rebuilt after their appointments change
+        self.policies = policy_index  # Clinic policy documents; excerpts go into the prompt per turn
+        self.pending_action = None  # Flow asked for by the last stream_response
+        self.flow = None  # Action whose flow respond() is collecting fields for, e.g. "book"
+        self.flow_fields = {}
+        self.flow_needs = None  # Field the last respond() asked for
+        self.flow_said = ""  # Flow message already given, so it isn't repeated for every field
+        # What respond() asks for each field, and how it reads the answer; voice swaps in spoken versions
+        self.field_prompts = {name: prompt.strip() for name, prompt in FIELD_PROMPTS.items()}
+        self.answer_parser = None  # (field, answer) -> value for the flow; None takes the answer as typed
+        self.change_source = "dental_assistant"  # Recorded on change events with the actor and session
+        self.actor = "assistant"
+        self.practice_info = practice_info or copy.deepcopy(DEFAULT_PRACTICE_INFO)
+        self.restore_session()
+
+    def restore_session(self):
+        """Resume a previously checkpointed conversation, if there is one."""
+        if not self.session_store or not self.session_id:
+            return False
+        state = self.session_store.load(self.session_id)
+        if not state:
+            return False
+        self.summary = state.get("summary", "")
+        self.slots = state.get("slots", {})
+        self.current_patient = state.get("current_patient")
+        self.conversation_history = state.get("recent", [])
+        flow = state.get("flow") or {}
+        self.flow, self.flow_fields, self.flow_needs = flow.get("action"), flow.get("fields", {}), flow.get("needs")
+        self.flow_said = flow.get("said", "")
+        return True
+
+    @profiled("session.checkpoint")
+    def checkpoint_session(self):
+        """Save compact conversation state so any worker can resume it."""
+        if not self.session_store or not self.session_id:
+            return
+        self.summary, self.conversation_history = compact_history(self.conversation_history, self.summary)
+        self.session_store.save(self.session_id, {
+            "summary": self.summary,
+            "slots": self.slots,
+            "current_patient": self.current_patient,
+            "flow": {"action": self.flow, "fields": self.flow_fields, "needs": self.flow_needs,
+                     "said": self.flow_said} if self.flow else None,
+            "recent": self.conversation_history
+        })
 
     def get_system_prompt(self):
         """Generate the system prompt for OpenAI."""
@@ -69,28 +189,43 @@ For general inquiries about services, policies, or other topics, provide a helpf
 Keep responses concise and professional. If you need specific information, ask for it clearly.
 Always validate dates and times against business hours before confirming appointments."""
 
+    def get_context_messages(self):
+        """Messages describing earlier parts of a resumed conversation."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Earlier in this conversation:\n{self.summary}"})
+        if self.slots:
+            messages.append({"role": "system", "content": f"Known details: {json.dumps(self.slots)}"})
+        return messages
+
+    def get_policy_messages(self, user_input):
+        """Excerpts of the clinic's policy documents relevant to this message; not kept in the history."""
+        message = self.policies.context_message(user_input)
+        return [message] if message else []
+
+    @profiled_turn("generate_response")
     def generate_response(self, user_input):
         """Generate a response using OpenAI's API."""
-        # Check for direct commands first
-        user_input_lower = user_input.lower()
-        
+        # Fully specified commands run locally without a model call
+        command_result = self.run_command(user_input)
+        if command_result:
+            return command_result
+
         # Direct command handling
-        if any(phrase in user_input_lower for phrase in [
-            "show my appointment", "view my appointment", "appointment history",
-            "my appointments", "check my appointments"
-        ]):
+        action = self.direct_action(user_input)
+        if action == "history":
             self.handle_appointment_history()
             return "I've displayed your appointment history above."
             
-        if "book" in user_input_lower and "appointment" in user_input_lower:
+        if action == "book":
             self.handle_booking()
             return "I've helped you book your appointment above."
             
-        if "cancel" in user_input_lower and "appointment" in user_input_lower:
+        if action == "cancel":
             self.handle_cancellation()
             return "I've helped you with your cancellation request above."
             
-        if "reschedule" in user_input_lower and "appointment" in user_input_lower:
+        if action == "reschedule":
             self.handle_rescheduling()
             return "I've helped you reschedule your appointment above."
 
@@ -99,15 +234,39 @@ Always validate dates and times against business hours before confirming appoint
         
         try:
             # Get completion from OpenAI
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
+            choice = model_policy.select("Front Desk Chat", confidence=intent_confidence(user_input))
+            started = time.perf_counter()
+            with profiler.span("build_prompt"):
+                messages = [
                     {"role": "system", "content": self.get_system_prompt()},
+                    *self.get_context_messages(),
+                    *self.get_policy_messages(user_input),
                     *self.conversation_history
-                ],
+                ]
+            request = lambda model: get_openai().ChatCompletion.create(
+                model=model,
+                messages=messages,
                 temperature=0.7,
                 max_tokens=150
             )
+            # Patients mid-booking go ahead of general questions when we're near quota
+            priority = PRIORITY_BOOKING if detect_intent(user_input) else PRIORITY_FAQ
+            tokens = estimate_tokens(messages, max_output_tokens=150)
+
+            def limited_call():
+                # Quota is taken once for the call, not per retry or hedge, and settled on the usage
+                return rate_limiter.call(
+                    lambda: model_client.call(
+                        rate_limiter.pausing(request), [choice.model, model_policy.fallback_model(choice)]
+                    ),
+                    tokens, priority, usage=lambda result: result["usage"]["total_tokens"],
+                    timeout=model_client.deadline
+                )
+
+            # Identical prompts already in flight share one request
+            with profiler.span("model_call"):
+                response = coalescer.call(request_key(choice.model, messages), limited_call)
+            model_policy.record_call(choice, started, response.get("usage"))
             
             # Extract and store assistant's response
             assistant_response = response.choices[0].message['content']
@@ -115,14 +274,242 @@ Always validate dates and times against business hours before confirming appoint
             
             # Process any actions in the response
             action_result = self.process_assistant_response(assistant_response)
+            self.checkpoint_session()
             if action_result:
                 return action_result
             
             return assistant_response
             
+        except ModelUnavailable:
+            # Answer what we can locally until the model is reachable again
+            return degraded_answer(user_input, self.practice_info["faqs"], self.practice_info["phone"])
         except Exception as e:
             return f"I apologize, but I encountered an error: {str(e)}"
 
+    @staticmethod
+    def direct_action(user_input):
+        """The flow a message asks for outright ("book an appointment"), or None."""
+        user_input_lower = user_input.lower()
+        if any(phrase in user_input_lower for phrase in HISTORY_PHRASES):
+            return "history"
+        if "appointment" in user_input_lower:
+            for action in ("book", "cancel", "reschedule"):
+                if action in user_input_lower:
+                    return action
+        return None
+
+    @profiled_turn("stream_response")
+    def stream_response(self, user_input, cancelled=None):
+        """
+        Generate a response as a stream of text deltas, for voice.
+
+        Flows are not run here: when the patient or the model asks for one,
+        nothing is streamed and self.pending_action names it ("book",
+        "reschedule", "cancel" or "history") for the caller to drive with
+        the matching *_flow method. Setting `cancelled` (barge-in) stops the
+        model stream; the part already streamed is kept in the history.
+        """
+        self.pending_action = None
+        command_result = self.run_command(user_input)
+        if command_result:
+            yield command_result
+            return
+        self.pending_action = self.direct_action(user_input)
+        if self.pending_action:
+            return
+
+        self.conversation_history.append({"role": "user", "content": user_input})
+        choice = model_policy.select("Front Desk Chat", confidence=intent_confidence(user_input))
+        started = time.perf_counter()
+        with profiler.span("build_prompt"):
+            messages = [
+                {"role": "system", "content": self.get_system_prompt()},
+                *self.get_context_messages(),
+                *self.get_policy_messages(user_input),
+                *self.conversation_history
+            ]
+        request = lambda model: get_openai().ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=150,
+            stream=True
+        )
+        priority = PRIORITY_BOOKING if detect_intent(user_input) else PRIORITY_FAQ
+        tokens = estimate_tokens(messages, max_output_tokens=150)
+        parts = []
+        try:
+            # Streams can't be shared, so unlike generate_response this is never coalesced
+            with profiler.span("model_call"):
+                stream = rate_limiter.call(
+                    lambda: model_client.call(
+                        rate_limiter.pausing(request), [choice.model, model_policy.fallback_model(choice)]
+                    ),
+                    tokens, priority, timeout=model_client.deadline
+                )
+            held = ""  # Start of the reply, held back while it could still be an action tag
+            for chunk in stream:
+                if cancelled is not None and cancelled.is_set():
+                    getattr(stream, "close", lambda: None)()
+                    break
+                delta = chunk["choices"][0]["delta"].get("content") or ""
+                parts.append(delta)
+                if held is None:
+                    yield delta
+                    continue
+                held += delta
+                start = held.lstrip()
+                if not ("ACTION:".startswith(start) or start.startswith("ACTION:")):
+                    yield held
+                    held = None
+            model_policy.record_call(choice, started)
+            reply = "".join(parts)
+            if held is not None:
+                self.pending_action = next((action for tag, action in ACTION_TAGS.items() if tag in reply), None)
+                if self.pending_action is None and held:
+                    yield held
+        except ModelUnavailable:
+            reply = degraded_answer(user_input, self.practice_info["faqs"], self.practice_info["phone"])
+            yield reply
+        except Exception as e:
+            reply = f"I apologize, but I encountered an error: {str(e)}"
+            yield reply
+        self.conversation_history.append({"role": "assistant", "content": reply})
+        self.checkpoint_session()
+
+    def respond(self, user_input):
+        """
+        Reply to one message without a terminal, for routers and servers.
+
+        Booking, rescheduling, cancellation and history go through the
+        headless *_flow methods instead of the CLI adapters: the reply asks
+        for the next field the flow needs, and the next message answers it.
+        "Stop" or "never mind" leaves the flow.
+        """
+        return "".join(self.respond_stream(user_input))
+
+    def respond_stream(self, user_input, cancelled=None):
+        """respond() as a stream of text deltas, for voice; `cancelled` stops a streamed model reply."""
+        if self.flow:
+            if user_input.strip().lower().strip(" .!") in ABANDON_PHRASES:
+                self.flow, self.flow_fields, self.flow_needs = None, {}, None
+                self.checkpoint_session()
+                yield "Okay, I've stopped. What else can I help with?"
+                return
+            yield self.continue_flow(user_input)
+            return
+        yield from self.stream_response(user_input, cancelled)
+        if self.pending_action:
+            self.flow, self.flow_fields, self.flow_needs, self.flow_said = self.pending_action, {}, None, ""
+            yield self.continue_flow()
+
+    def continue_flow(self, answer=None):
+        """Give the pending flow the answer to its last question; returns what to say next."""
+        if answer is not None and self.flow_needs:
+            value = self.answer_parser(self.flow_needs, answer) if self.answer_parser else answer.strip()
+            self.flow_fields[self.flow_needs] = value
+        flow = {"book": self.book_flow, "reschedule": self.reschedule_flow,
+                "cancel": self.cancel_flow, "history": self.history_flow}[self.flow]
+        result = flow(**self.flow_fields)
+        for field_name in result.clear:
+            self.flow_fields.pop(field_name, None)
+        # Flows repeat their message while collecting fields ("new patient..."); give it once
+        message = result.message if result.message != self.flow_said else ""
+        self.flow_said = result.message
+        lines = [text for text in (result.error, message) if text] + list(result.options)
+        if result.needs:
+            lines.append(self.field_prompts.get(result.needs, f"What's your {result.needs}?"))
+        else:
+            self.flow, self.flow_fields = None, {}
+        self.flow_needs = result.needs
+        self.checkpoint_session()
+        return "\n".join(lines)
+
+    @profiled("local_command")
+    def run_command(self, user_input):
+        """Parse and run a fully specified book/cancel/reschedule command; None if it needs the model."""
+        command = parse_command(user_input, list(self.practice_info["services"]))
+        if command is None:
+            return None
+
+        # The fast path acts only for the patient this session has identified by
+        # phone; anything else goes to the flows, which ask for the phone number
+        if command.action == "cancel":
+            appointment = self.own_appointment(command.appointment_id)
+            if appointment is None:
+                return None
+            if appointment["status"] == "cancelled":
+                result = f"Appointment {command.appointment_id} is already cancelled."
+            else:
+                self.cancel_appointment(command.appointment_id)
+                result = (f"Appointment {command.appointment_id} ({appointment['service']} on "
+                          f"{appointment['date']} at {appointment['time']}) has been cancelled.")
+
+        elif command.action == "reschedule":
+            appointment_id = command.appointment_id
+            if appointment_id is None:
+                patient_id = self.find_patient_by_name(command.patient_name, command.phone)
+                if patient_id is None or patient_id != self.current_patient:
+                    return None
+                old_date = self.to_display_date(command.date)
+                appointment_id = next((app["id"] for app in self.get_patient_appointments(patient_id)
+                                       if app["date"] == old_date and app["time"] == command.time), None)
+                if appointment_id is None:
+                    return (f"No scheduled appointment found for {command.patient_name} "
+                            f"on {old_date} at {command.time}.")
+            elif self.own_appointment(appointment_id) is None:
+                return None
+            new_date = self.to_display_date(command.new_date)
+            success, message = self.reschedule_appointment(appointment_id, new_date, command.new_time)
+            result = f"Appointment {appointment_id}: {message}" if success else f"Could not reschedule appointment {appointment_id}: {message}"
+
+        else:
+            if command.phone:
+                # The phone number identifies the patient, as in book_flow; a name
+                # only settles which of the patients sharing that number is meant
+                on_phone = self.patient_index.by_phone(command.phone)
+                if command.patient_name:
+                    patient_id = self.find_patient_by_name(command.patient_name, command.phone)
+                    patient_id = patient_id if patient_id in on_phone else None
+                else:
+                    patient_id = on_phone[0] if on_phone else None
+            elif command.patient_name:
+                patient_id = self.find_patient_by_name(command.patient_name)
+                if patient_id != self.current_patient:
+                    patient_id = None
+            else:
+                patient_id = self.current_patient
+            if patient_id is None:
+                # New or unidentified patients go through the registration flow
+                return None
+            service = command.service
+            date_str = self.to_display_date(command.date)
+            appointment_id, error = self.book_appointment(patient_id, date_str, command.time, service)
+            if not appointment_id:
+                return f"Booking failed: {error}"
+            self.current_patient = patient_id
+            details = self.practice_info["services"][service]
+            result = (f"Booked {service} for {self.patients[patient_id]['name']} on {date_str} at {command.time} "
+                      f"({details['duration']} mins, ${details['cost']}). Appointment ID: {appointment_id}")
+
+        self.conversation_history.append({"role": "user", "content": user_input})
+        self.conversation_history.append({"role": "assistant", "content": result})
+        self.checkpoint_session()
+        return result
+
+    def own_appointment(self, appointment_id):
+        """The appointment if it belongs to the patient identified in this session, else None."""
+        appointment = self.appointments.get(appointment_id)
+        if appointment is None or self.current_patient is None or appointment["patient_id"] != self.current_patient:
+            return None
+        return appointment
+
+    @staticmethod
+    def to_display_date(iso_date):
+        """YYYY-MM-DD from the parser to the DD/MM/YYYY used for appointments."""
+        return datetime.strptime(iso_date, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+    @profiled("tool_dispatch")
     def process_assistant_response(self, response):
         """Process any actions needed based on the assistant's response."""
         # Check for appointment-related intents
@@ -136,174 +523,139 @@ Always validate dates and times against business hours before confirming appoint
             return self.handle_appointment_history()
         return None
 
-    def handle_booking(self):
-        """Handle the appointment booking process."""
-        # Check if patient exists
-        phone = input("\nPlease enter your phone number (10 digits): ").strip()
-        patient_id = self.find_patient(phone)
-        
-        if not patient_id:
-            print("\nLooks like you're a new patient. Let's get you registered.")
-            name = input("Full Name: ").strip()
-            email = input("Email Address: ").strip()
-            dob = input("Date of Birth (DD/MM/YYYY): ").strip()
-            patient_id = self.register_patient(name, phone, email, dob)
-            print("\nRegistration successful!")
-        else:
-            print(f"\nWelcome back, {self.patients[patient_id]['name']}!")
-        
-        # Show available services with duration and cost
-        print("\nAvailable Services:")
-        for i, (service, details) in enumerate(self.practice_info["services"].items(), 1):
-            print(f"{i}. {service} ({details['duration']} mins, ${details['cost']})")
+    # Request/response flows. Each takes every detail collected so far and
+    # either finishes or names the next field it needs, so it can be driven by
+    # the CLI adapters below, a server or a batch job without blocking on input().
 
-        # Get service selection
-        while True:
-            try:
-                service_num = int(input("\nSelect service number: "))
-                if 1 <= service_num <= len(self.practice_info["services"]):
-                    service = list(self.practice_info["services"].keys())[service_num - 1]
-                    break
-                print("Invalid selection. Please try again.")
-            except ValueError:
-                print("Please enter a valid number.")
+    def book_flow(self, phone=None, name=None, email=None, dob=None, service=None, date=None, time=None):
+        """Book an appointment, registering new patients on the way."""
+        if not phone:
+            return FlowResult(needs="phone")
+        with self._lock:
+            patient_id = self.find_patient(phone)
+            if not patient_id:
+                for field_name, value in (("name", name), ("email", email), ("dob", dob)):
+                    if not value:
+                        return FlowResult(needs=field_name, message="Looks like you're a new patient. Let's get you registered.")
+                patient_id = self.register_patient(name, phone, email, dob)
+        self.current_patient = patient_id
+        self.slots.update({"patient_name": self.patients[patient_id]["name"], "phone": phone})
 
-        # Get appointment date and time
-        print("\nAppointment Scheduling")
-        print("Available hours: Monday-Friday, 9:00 AM - 6:00 PM")
-        
-        while True:
-            date_str = input("Preferred date (DD/MM/YYYY): ").strip()
-            time_str = input("Preferred time (HH:MM, 24-hour format): ").strip()
-            
-            is_valid, error_msg = self.validate_appointment_time(date_str, time_str)
-            if is_valid:
-                appointment_id, error = self.book_appointment(patient_id, date_str, time_str, service)
-                if appointment_id:
-                    print(f"\nAppointment successfully booked!")
-                    print(f"Service: {service}")
-                    print(f"Duration: {self.practice_info['services'][service]['duration']} minutes")
-                    print(f"Cost: ${self.practice_info['services'][service]['cost']}")
-                    print(f"Date: {date_str}")
-                    print(f"Time: {time_str}")
-                    print(f"Appointment ID: {appointment_id}")
-                    return
-                print(f"Booking failed: {error}")
-            else:
-                print(f"Invalid date/time: {error_msg}")
-            
-            if input("\nWould you like to try another date/time? (yes/no): ").strip().lower() != 'yes':
-                return
+        services = list(self.practice_info["services"])
+        if not service:
+            return FlowResult(
+                needs="service",
+                message=f"Welcome, {self.patients[patient_id]['name']}! Available Services:",
+                options=[f"{i}. {name} ({details['duration']} mins, ${details['cost']})"
+                         for i, (name, details) in enumerate(self.practice_info["services"].items(), 1)]
+            )
+        if str(service).isdigit() and 1 <= int(service) <= len(services):
+            service = services[int(service) - 1]
+        if service not in services:
+            return FlowResult(needs="service", error="Invalid selection. Please try again.", clear=("service",))
+        self.slots["service"] = service
 
-    def handle_rescheduling(self):
-        """Handle the appointment rescheduling process."""
-        # Verify patient
-        phone = input("\nPlease enter your phone number (10 digits): ").strip()
-        patient_id = self.find_patient(phone)
-        
-        if not patient_id:
-            print("No appointments found. Please register as a new patient first.")
-            return
-        
-        # Get active appointments
-        appointments = [app for app in self.get_patient_appointments(patient_id) 
-                       if app["status"] == "scheduled"]
-        
-        if not appointments:
-            print("You don't have any active appointments to reschedule.")
-            return
-        
-        # Show appointments
-        print("\nYour appointments:")
-        for app in appointments:
-            print(f"ID: {app['id']} | {app['service']} on {app['date']} at {app['time']}")
-        
-        # Get appointment selection
-        while True:
-            try:
-                app_id = int(input("\nEnter appointment ID to reschedule: "))
-                if any(app['id'] == app_id for app in appointments):
-                    break
-                print("Invalid appointment ID. Please try again.")
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        # Get new date and time
-        print("\nNew Appointment Time")
-        print("Available hours: Monday-Friday, 9:00 AM - 6:00 PM")
-        
-        while True:
-            date_str = input("New date (DD/MM/YYYY): ").strip()
-            time_str = input("New time (HH:MM, 24-hour format): ").strip()
-            
-            success, message = self.reschedule_appointment(app_id, date_str, time_str)
-            if success:
-                print("\nAppointment successfully rescheduled!")
-                print(f"New date: {date_str}")
-                print(f"New time: {time_str}")
-                return
-            
-            print(f"Rescheduling failed: {message}")
-            if input("\nWould you like to try another date/time? (yes/no): ").strip().lower() != 'yes':
-                return
+        if not date:
+            return FlowResult(needs="date", message="Appointment Scheduling\nAvailable hours: Monday-Friday, 9:00 AM - 6:00 PM")
+        if not time:
+            return FlowResult(needs="time")
+        is_valid, error_msg = self.validate_appointment_time(date, time)
+        if not is_valid:
+            return FlowResult(needs="date", error=f"Invalid date/time: {error_msg}", clear=("date", "time"))
+        requested_date = datetime.strptime(date, "%d/%m/%Y").date().isoformat()
+        self.slots.update({"requested_date": requested_date, "requested_time": time})
+        appointment_id, error = self.book_appointment(patient_id, date, time, service)
+        if not appointment_id:
+            return FlowResult(needs="date", error=f"Booking failed: {error}", clear=("date", "time"))
+        self.checkpoint_session()
+        details = self.practice_info["services"][service]
+        return FlowResult(
+            ok=True,
+            message=(f"Appointment successfully booked!\nService: {service}\n"
+                     f"Duration: {details['duration']} minutes\nCost: ${details['cost']}\n"
+                     f"Date: {date}\nTime: {time}\nAppointment ID: {appointment_id}"),
+            data={"appointment": dict(self.appointments[appointment_id])}
+        )
 
-    def handle_cancellation(self):
-        """Handle the appointment cancellation process."""
-        # Verify patient
-        phone = input("\nPlease enter your phone number (10 digits): ").strip()
+    def _choose_active_appointment(self, phone, appointment_id, verb):
+        """Shared first steps of rescheduling and cancelling; returns (appointment_id, FlowResult or None)."""
+        if not phone:
+            return None, FlowResult(needs="phone")
         patient_id = self.find_patient(phone)
-        
         if not patient_id:
-            print("No appointments found. Please register as a new patient first.")
-            return
-        
-        # Get active appointments
-        appointments = [app for app in self.get_patient_appointments(patient_id) 
-                       if app["status"] == "scheduled"]
-        
+            return None, FlowResult(message="No appointments found. Please register as a new patient first.")
+        appointments = self.get_patient_appointments(patient_id)
         if not appointments:
-            print("You don't have any active appointments to cancel.")
-            return
-        
-        # Show appointments
-        print("\nYour appointments:")
-        for app in appointments:
-            print(f"ID: {app['id']} | {app['service']} on {app['date']} at {app['time']}")
-        
-        # Get appointment selection
-        while True:
-            try:
-                app_id = int(input("\nEnter appointment ID to cancel: "))
-                if any(app['id'] == app_id for app in appointments):
-                    break
-                print("Invalid appointment ID. Please try again.")
-            except ValueError:
-                print("Please enter a valid number.")
-        
-        # Confirm cancellation
-        if input("\nAre you sure you want to cancel this appointment? (yes/no): ").strip().lower() == 'yes':
-            success, message = self.cancel_appointment(app_id)
-            if success:
-                print("\nAppointment successfully cancelled!")
-            else:
-                print(f"Cancellation failed: {message}")
+            return None, FlowResult(message=f"You don't have any active appointments to {verb}.")
+        if not appointment_id:
+            return None, FlowResult(
+                needs="appointment_id", message="Your appointments:",
+                options=[f"ID: {app['id']} | {app['service']} on {app['date']} at {app['time']}" for app in appointments]
+            )
+        try:
+            appointment_id = int(appointment_id)
+        except ValueError:
+            appointment_id = None
+        if not any(app["id"] == appointment_id for app in appointments):
+            return None, FlowResult(needs="appointment_id", error="Invalid appointment ID. Please try again.",
+                                    clear=("appointment_id",))
+        return appointment_id, None
 
-    def handle_appointment_history(self):
-        """Handle viewing appointment history."""
-        # Verify patient
-        phone = input("\nPlease enter your phone number (10 digits): ").strip()
+    def reschedule_flow(self, phone=None, appointment_id=None, date=None, time=None):
+        """Move one of the patient's active appointments to a new date and time."""
+        appointment_id, pending = self._choose_active_appointment(phone, appointment_id, "reschedule")
+        if pending:
+            return pending
+        if not date:
+            return FlowResult(needs="date", message="New Appointment Time\nAvailable hours: Monday-Friday, 9:00 AM - 6:00 PM")
+        if not time:
+            return FlowResult(needs="time")
+        success, message = self.reschedule_appointment(appointment_id, date, time)
+        if not success:
+            return FlowResult(needs="date", error=f"Rescheduling failed: {message}", clear=("date", "time"))
+        return FlowResult(ok=True, message=f"Appointment successfully rescheduled!\nNew date: {date}\nNew time: {time}",
+                          data={"appointment": dict(self.appointments[appointment_id])})
+
+    def cancel_flow(self, phone=None, appointment_id=None, confirm=None):
+        """Cancel one of the patient's active appointments once confirmed."""
+        appointment_id, pending = self._choose_active_appointment(phone, appointment_id, "cancel")
+        if pending:
+            return pending
+        if not confirm:
+            return FlowResult(needs="confirm")
+        if str(confirm).strip().lower() != "yes":
+            return FlowResult(message="Your appointment has not been cancelled.")
+        success, message = self.cancel_appointment(appointment_id)
+        if not success:
+            return FlowResult(message=f"Cancellation failed: {message}")
+        return FlowResult(ok=True, message="Appointment successfully cancelled!",
+                          data={"appointment": dict(self.appointments[appointment_id])})
+
+    def history_flow(self, phone=None):
+        """All of a patient's appointments, upcoming and cancelled."""
+        if not phone:
+            return FlowResult(needs="phone")
         patient_id = self.find_patient(phone)
-        
         if not patient_id:
-            print("No appointments found. Please register as a new patient first.")
-            return
-        
-        # Get all appointments including cancelled ones
-        appointments = self.get_patient_appointments(patient_id, include_cancelled=True)
-        
+            return FlowResult(message="No appointments found. Please register as a new patient first.")
+        history = self.render_cache.get(patient_id, "history", lambda: self.render_history(patient_id))
+        if history is None:
+            return FlowResult(message="No appointment history found.")
+        message, scheduled, cancelled = history
+        return FlowResult(ok=True, message=message, data={
+            "phone": phone,
+            "scheduled": [dict(app) for app in scheduled],
+            "cancelled": [dict(app) for app in cancelled],
+        })
+
+    def render_history(self, patient_id):
+        """The history view of a patient: (message, scheduled, cancelled), or None without appointments."""
+        with self._lock:
+            # Get all appointments including cancelled ones
+            appointments = [dict(app) for app in self.get_patient_appointments(patient_id, include_cancelled=True)]
+            patient = dict(self.patients[patient_id])
         if not appointments:
-            print("No appointment history found.")
-            return
+            return None
         
         # Sort appointments by date and time
         appointments.sort(key=lambda x: (
@@ -315,37 +667,68 @@ Always validate dates and times against business hours before confirming appoint
         scheduled = [app for app in appointments if app['status'] == 'scheduled']
         cancelled = [app for app in appointments if app['status'] == 'cancelled']
         
-        # Display patient information
-        patient = self.patients[patient_id]
-        print(f"\nAppointment History for {patient['name']}")
-        print(f"Phone: {patient['phone']}")
-        print(f"Email: {patient['email']}")
-        print("=" * 50)
+        # Patient information
+        lines = [f"Appointment History for {patient['name']}", f"Phone: {patient['phone']}",
+                 f"Email: {patient['email']}", "=" * 50]
         
-        # Display scheduled appointments
+        # Scheduled appointments
         if scheduled:
-            print("\nUpcoming Appointments:")
+            lines.append("\nUpcoming Appointments:")
             for app in scheduled:
                 service_details = self.practice_info['services'][app['service']]
-                print(f"\nID: {app['id']}")
-                print(f"Service: {app['service']}")
-                print(f"Date: {app['date']}")
-                print(f"Time: {app['time']}")
-                print(f"Duration: {service_details['duration']} minutes")
-                print(f"Cost: ${service_details['cost']}")
+                lines += [f"\nID: {app['id']}", f"Service: {app['service']}", f"Date: {app['date']}",
+                          f"Time: {app['time']}", f"Duration: {service_details['duration']} minutes",
+                          f"Cost: ${service_details['cost']}"]
         
-        # Display cancelled appointments
+        # Cancelled appointments
         if cancelled:
-            print("\nCancelled Appointments:")
+            lines.append("\nCancelled Appointments:")
             for app in cancelled:
-                print(f"\nID: {app['id']}")
-                print(f"Service: {app['service']}")
-                print(f"Date: {app['date']}")
-                print(f"Time: {app['time']}")
-                print(f"Status: Cancelled")
+                lines += [f"\nID: {app['id']}", f"Service: {app['service']}", f"Date: {app['date']}",
+                          f"Time: {app['time']}", "Status: Cancelled"]
+        
+        return "\n".join(lines), scheduled, cancelled
+
+    # CLI adapters
+
+    def run_cli_flow(self, flow, **fields):
+        """Prompt on the terminal for whatever a flow needs until it finishes."""
+        while True:
+            result = flow(**fields)
+            if result.error:
+                print(result.error)
+                # Re-entering a date/time is optional; a bad selection is simply asked again
+                if result.needs in ("date", "time") and \
+                        input("\nWould you like to try another date/time? (yes/no): ").strip().lower() != 'yes':
+                    return result
+            elif result.message:
+                print(f"\n{result.message}")
+            for option in result.options:
+                print(option)
+            if result.needs is None:
+                return result
+            for field_name in result.clear:
+                fields.pop(field_name, None)
+            fields[result.needs] = input(FIELD_PROMPTS[result.needs]).strip()
+
+    def handle_booking(self):
+        """Handle the appointment booking process."""
+        self.run_cli_flow(self.book_flow)
+
+    def handle_rescheduling(self):
+        """Handle the appointment rescheduling process."""
+        self.run_cli_flow(self.reschedule_flow)
+
+    def handle_cancellation(self):
+        """Handle the appointment cancellation process."""
+        self.run_cli_flow(self.cancel_flow)
+
+    def handle_appointment_history(self):
+        """Handle viewing appointment history."""
+        result = self.run_cli_flow(self.history_flow)
         
         # Show options for appointment management
-        if scheduled:
+        if result.ok and result.data["scheduled"]:
             print("\nOptions:")
             print("1. Reschedule an appointment")
             print("2. Cancel an appointment")
@@ -353,10 +736,11 @@ Always validate dates and times against business hours before confirming appoint
             
             choice = input("\nSelect an option (1-3): ").strip()
             if choice == '1':
-                return self.handle_rescheduling()
+                return self.run_cli_flow(self.reschedule_flow, phone=result.data["phone"])
             elif choice == '2':
-                return self.handle_cancellation()
+                return self.run_cli_flow(self.cancel_flow, phone=result.data["phone"])
 
+    @profiled("appointments.by_patient")
     def get_patient_appointments(self, patient_id, include_cancelled=False):
         """Get all appointments for a patient."""
         if patient_id in self.patients:
@@ -391,68 +775,134 @@ Always validate dates and times against business hours before confirming appoint
         except ValueError:
             return False, "Invalid date/time format."
 
+    @profiled("patients.register")
     def register_patient(self, name, phone, email, dob):
-        """Register a new patient."""
-        patient_id = len(self.patients) + 1
-        self.patients[patient_id] = {
-            "name": name,
-            "phone": phone,
-            "email": email,
-            "dob": dob,
-            "appointments": []
-        }
-        return patient_id
+        """Register a new patient, or return the existing one with a close name and the same date of birth."""
+        with self._lock:
+            duplicate = self.patient_index.find_duplicate(name, phone, dob)
+            if duplicate is not None:
+                return duplicate.patient_id
+            patient_id = len(self.patients) + 1
+            self.patients[patient_id] = {
+                "name": name,
+                "phone": phone,
+                "email": email,
+                "dob": dob,
+                "appointments": []
+            }
+            self.patient_index.add(patient_id, name, phone, dob)
+            self.publish_change("patient", "registered", patient_id, None, self.patients[patient_id])
+            return patient_id
+
+    @profiled("patients.find_by_name")
+    def find_patient_by_name(self, name, phone=None):
+        """Find a patient by name, in any case or word order; a misspelt name also needs the phone to match."""
+        return self.patient_index.resolve(name, phone)
 
+    @profiled("patients.find")
     def find_patient(self, phone):
-        """Find a patient by phone number."""
-        for patient_id, patient in self.patients.items():
-            if patient["phone"] == phone:
-                return patient_id
-        return None
+        """Find a patient by phone number, in any format."""
+        patient_ids = self.patient_index.by_phone(phone)
+        return patient_ids[0] if patient_ids else None
 
+    @profiled("appointments.book")
     def book_appointment(self, patient_id, date, time, service):
         """Book an appointment for a patient."""
-        is_valid, error_msg = self.validate_appointment_time(date, time)
-        if not is_valid:
-            return None, error_msg
-
-        appointment_id = len(self.appointments) + 1
-        appointment = {
-            "id": appointment_id,
-            "patient_id": patient_id,
-            "date": date,
-            "time": time,
-            "service": service,
-            "status": "scheduled"
-        }
+        with self._lock:
+            is_valid, error_msg = self.validate_appointment_time(date, time)
+            if not is_valid:
+                return None, error_msg
+
+            appointment_id = len(self.appointments) + 1
+            appointment = {
+                "id": appointment_id,
+                "patient_id": patient_id,
+                "date": date,
+                "time": time,
+                "service": service,
+                "status": "scheduled"
+            }
         
-        self.appointments[appointment_id] = appointment
-        self.patients[patient_id]["appointments"].append(appointment_id)
-        return appointment_id, None
+            self.appointments[appointment_id] = appointment
+            self.patients[patient_id]["appointments"].append(appointment_id)
+            self.appointment_changed("booked", None, appointment)
+            return appointment_id, None
 
+    @profiled("appointments.cancel")
     def cancel_appointment(self, appointment_id):
         """Cancel an appointment."""
-        if appointment_id in self.appointments:
-            self.appointments[appointment_id]["status"] = "cancelled"
-            return True, "Appointment cancelled successfully."
-        return False, "Appointment not found."
+        with self._lock:
+            if appointment_id in self.appointments:
+                before = dict(self.appointments[appointment_id])
+                self.appointments[appointment_id]["status"] = "cancelled"
+                self.appointment_changed("cancelled", before, self.appointments[appointment_id])
+                return True, "Appointment cancelled successfully."
+            return False, "Appointment not found."
 
+    @profiled("appointments.reschedule")
     def reschedule_appointment(self, appointment_id, new_date, new_time):
         """Reschedule an appointment."""
-        if appointment_id not in self.appointments:
-            return False, "Appointment not found."
+        with self._lock:
+            if appointment_id not in self.appointments:
+                return False, "Appointment not found."
             
-        appointment = self.appointments[appointment_id]
-        if appointment["status"] == "cancelled":
-            return False, "Cannot reschedule a cancelled appointment."
+            appointment = self.appointments[appointment_id]
+            if appointment["status"] == "cancelled":
+                return False, "Cannot reschedule a cancelled appointment."
             
-        is_valid, error_msg = self.validate_appointment_time(new_date, new_time)
-        if not is_valid:
-            return False, error_msg
+            is_valid, error_msg = self.validate_appointment_time(new_date, new_time)
+            if not is_valid:
+                return False, error_msg
             
-        appointment["date"] = new_date
-        appointment["time"] = new_time
-        return True, f"Appointment successfully rescheduled to {new_date} at {new_time}."
+            before = dict(appointment)
+            appointment["date"] = new_date
+            appointment["time"] = new_time
+            self.appointment_changed("rescheduled", before, appointment)
+            return True, f"Appointment successfully rescheduled to {new_date} at {new_time}."
+
+    def schedule_reminders(self, appointment):
+        """Queue the reminders for an appointment, replacing any queued before."""
+        if self.reminders is None:
+            return
+        patient = self.patients[appointment["patient_id"]]
+        when = datetime.strptime(f"{appointment['date']} {appointment['time']}", "%d/%m/%Y %H:%M")
+        message = (f"Hi {patient['name']}, this is a reminder of your {appointment['service']} appointment "
+                   f"at {self.practice_info['name']} on {appointment['date']} at {appointment['time']}. "
+                   f"Call {self.practice_info['phone']} if you need to reschedule.")
+        contact = {"name": patient["name"], "phone": patient["phone"], "email": patient["email"]}
+        self.reminders.schedule(str(appointment["id"]), when, contact, message)
+
+    def appointment_changed(self, event, before, after):
+        """Keep reminders, analytics and cached views in step with a booked, cancelled or rescheduled appointment."""
+        self.render_cache.invalidate(after["patient_id"])
+        if event == "cancelled":
+            if self.reminders is not None:
+                self.reminders.cancel(str(after["id"]))
+        else:
+            self.schedule_reminders(after)
+        self.analytics.apply(
+            event,
+            self.analytics_record(before) if before else None,
+            self.analytics_record(after)
+        )
+        self.publish_change("appointment", event, after["id"], before, after)
+
+    def publish_change(self, entity, action, key, before, after):
+        change_log.publish(self.change_source, entity, action, key, before, after, self.actor, self.session_id)
+
+    def analytics_record(self, appointment):
+        day = datetime.strptime(appointment["date"], "%d/%m/%Y").date()
+        return make_record(day, appointment["service"], appointment["status"] == "cancelled",
+                           self.practice_info["services"])
+
+    def verify_analytics(self):
+        """Rebuild the aggregates from all appointments; returns any mismatches with the live ones."""
+        rebuilt = AppointmentAggregates.rebuild(self.analytics_record(app) for app in self.appointments.values())
+        return self.analytics.diff(rebuilt)
+
+    def export_history(self, path, fmt=None):
+        """Write appointments and patients to Parquet, Arrow IPC or .npz for offline analysis."""
+        return export_history(self.appointments, self.practice_info["services"], path, self.patients, fmt)
 
 def main():
     print("Welcome to Smile Bright Dental!")
@@ -462,7 +912,18 @@ def main():
     print("- Cancel or reschedule existing appointments")
     print("- Ask questions about our services and policies")
     
-    assistant = DentalAssistant()
+    # Set DENTAL_SESSION_ID to resume the same conversation after a restart
+    session_id = os.getenv("DENTAL_SESSION_ID")
+    # Set DENTAL_REMINDERS=1 to queue and send appointment reminders
+    reminders = None
+    if os.getenv("DENTAL_REMINDERS") == "1":
+        reminders = ReminderQueue()
+        ReminderDispatcher(reminders, reminder_sender_from_env()).start()
+    # DENTAL_CHANGES_FILE / _SOCKET / _WEBHOOK stream every mutation
+    subscribe_from_env()
+    # DENTAL_PROFILE=1 profiles turns from the start; SIGUSR2 toggles it
+    install_signal_toggle()
+    assistant = DentalAssistant(session_id, SessionStore() if session_id else None, reminders)
     
     while True:
         user_input = input("\nYou: ").strip()
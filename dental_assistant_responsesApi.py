@@ -1,26 +1,64 @@
 import os
-from openai import OpenAI
+import time
 from datetime import datetime, timedelta
 import re
-from dotenv import load_dotenv
 import json
+import threading
+from functools import lru_cache
+from session_store import SessionStore, compact_history
+from slot_filling import SlotTracker, booking_problems, intent_confidence
+from model_policy import model_policy
+from model_client import ResilientClient, ModelUnavailable, degraded_answer
+from reminders import ReminderQueue, ReminderDispatcher, reminder_sender_from_env
+from analytics import AppointmentAggregates, make_record
+from history_export import export_history
+from patient_index import PatientIndex
+from render_cache import RenderCache, render_table
+from policy_index import policy_index
+from change_events import change_log, subscribe_from_env
+from profiling import profiler, profiled, profiled_turn, install_signal_toggle
+from rate_limiter import rate_limiter, coalescer, estimate_tokens, request_key, PRIORITY_BOOKING, PRIORITY_FAQ
 
+@lru_cache(maxsize=None)
+def get_client():
+    """Build the OpenAI client on first use so importing this module stays cheap"""
+    from openai import OpenAI
+    from dotenv import load_dotenv
+    
+    # Load environment variables
+    load_dotenv()
+    
+    # Set OpenAI API key
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Load environment variables
-load_dotenv()
-
-# Set OpenAI API key
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Retries, hedging and failover for every Responses API call
+model_client = ResilientClient("responses")
 
 class DentalAssistant:
-    def __init__(self):
+    def __init__(self, session_id=None, session_store=None, reminders=None):
         self.patients = {}  # Dictionary to store patient information
+        self.patient_index = PatientIndex()  # Registered names, so a misspelt name finds the same patient
         self.appointments = {}  # Dictionary to store appointments
         self.current_patient = None
         self.conversation_history = []
+        self.session_id = session_id
+        self.session_store = session_store
+        self.summary = ""
+        self.slots = {}  # Details collected so far: patient_name, service, requested_date
+        self.last_response_id = None
+        self.reminders = reminders  # ReminderQueue, or None to send no reminders
+        self.analytics = AppointmentAggregates()  # Kept up to date on every book, cancel and reschedule
+        self.render_cache = RenderCache()  # Appointment tables per patient, rebuilt after their appointments change
+        self.policies = policy_index  # Clinic policy documents; excerpts go into the input per turn
+        self.actor = "assistant"  # Recorded on change events with the session id
+        self._lock = threading.RLock()  # Mutations may run concurrently from a server or batch job
         self.practice_info = {
             "name": "Smile Bright Dental",
             "hours": "Monday-Friday: 9:00 AM - 6:00 PM",
+            "open_days": range(0, 5),  # Monday to Friday, as in "hours"
+            "opening_time": "09:00",
+            "closing_time": "18:00",
+            "booking_window_days": 90,
             "services": {
                 "Cleaning": {"duration": "60", "cost": "100"},
                 "Check-up": {"duration": "30", "cost": "75"},
@@ -39,6 +77,54 @@ class DentalAssistant:
                 "cancellation": "Please provide at least 24 hours notice for cancellations to avoid any fees."
             }
         }
+        self.restore_session()
+        self.slot_tracker = SlotTracker(self.practice_info["services"].keys(), self.slots)
+
+    def restore_session(self):
+        """
+        Resume a previously checkpointed conversation
+
+        Returns:
+            bool: True if a checkpoint was found and loaded
+        """
+        if not self.session_store or not self.session_id:
+            return False
+        state = self.session_store.load(self.session_id)
+        if not state:
+            return False
+        self.summary = state.get("summary", "")
+        self.slots = state.get("slots", {})
+        self.last_response_id = state.get("last_response_id")
+        self.conversation_history = state.get("recent", [])
+        return True
+
+    @profiled("session.checkpoint")
+    def checkpoint_session(self):
+        """Save compact conversation state so any worker can resume it"""
+        if not self.session_store or not self.session_id:
+            return
+        self.summary, self.conversation_history = compact_history(self.conversation_history, self.summary)
+        self.session_store.save(self.session_id, {
+            "summary": self.summary,
+            "slots": self.slots,
+            "last_response_id": self.last_response_id,
+            "recent": self.conversation_history
+        })
+
+    def build_input(self):
+        """Flatten the system prompt, resumed context and recent history into the model input"""
+        messages = [{"role": "system", "content": self.get_system_prompt()}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Earlier in this conversation:\n{self.summary}"})
+        if self.slots:
+            messages.append({"role": "system", "content": f"Known details: {json.dumps(self.slots)}"})
+        # Only the excerpts for the latest message, so the input doesn't grow with the document set
+        question = next((msg["content"] for msg in reversed(self.conversation_history) if msg["role"] == "user"), None)
+        policy = self.policies.context_message(str(question)) if question else None
+        if policy:
+            messages.append(policy)
+        messages.extend(self.conversation_history)
+        return "\n".join(str(msg["content"]) for msg in messages)
 
     def get_system_prompt(self):
         """Generate the system prompt for OpenAI."""
@@ -138,6 +224,10 @@ Provide clear, direct responses to questions about our services, policies, or ot
                         "name": {
                             "type": "string",
                             "description": "Patient's full name"
+                        },
+                        "phone": {
+                            "type": "string",
+                            "description": "Patient's phone number, to confirm a name that is not registered exactly"
                         }
                     },
                     "required": ["name"]
@@ -187,6 +277,7 @@ Provide clear, direct responses to questions about our services, policies, or ot
             }
         ]
 
+    @profiled("appointments.history")
     def get_appointment_history(self, name=None):
         """
         Get appointment history for a patient
@@ -200,6 +291,7 @@ Provide clear, direct responses to questions about our services, policies, or ot
         if not name:
             return []
 
+        name = self.resolve_patient_name(name) or name
         patient_appointments = []
         for appointment_id, appointment in self.appointments.items():
             if appointment["patient"]["name"].lower() == name.lower():
@@ -214,71 +306,313 @@ Provide clear, direct responses to questions about our services, policies, or ot
         
         return patient_appointments
 
+    def render_appointment_history(self, name):
+        """
+        A patient's appointments as a compact table for the model, cached until one of them changes
+
+        Args:
+            name (str): Patient's full name, possibly misspelt
+
+        Returns:
+            str: The table, or None if the patient has no appointments
+        """
+        name = self.resolve_patient_name(name) or name
+        # History matches names case-insensitively, so the cache does too
+        return self.render_cache.get(name.lower(), "history", lambda: self.appointment_table(name))
+
+    def appointment_table(self, name):
+        """Uncached rendering behind render_appointment_history"""
+        with self._lock:
+            appointments = sorted(self.get_appointment_history(name), key=lambda appt: (appt["date"], appt["time"]))
+        if not appointments:
+            return None
+        return render_table(f"Appointments for {name}", ["date", "time", "service", "status"],
+                            [(appt["date"], appt["time"], appt["service"], appt["status"]) for appt in appointments])
+
+    def find_appointment_by_name(self, name):
+        """
+        Find a patient's appointments that are not cancelled
+
+        Args:
+            name (str): Patient's name, possibly misspelt
+
+        Returns:
+            dict: Appointment details by appointment ID
+        """
+        name = self.resolve_patient_name(name)
+        if not name:
+            return {}
+        return {
+            appointment_id: appointment for appointment_id, appointment in self.appointments.items()
+            if appointment["patient"]["name"] == name and appointment["status"] != "cancelled"
+        }
+
+    def resolve_patient_name(self, name, phone=None):
+        """
+        Find the name a patient is registered under
+
+        Args:
+            name (str): Patient's name, in any word order ("Smith, John")
+            phone (str, optional): Phone number, needed for a misspelt name ("Jon Smith")
+
+        Returns:
+            str: Registered name, or None if no patient clearly matches
+        """
+        if name in self.patients:
+            return name
+        return self.patient_index.resolve(name, phone)
+
+    def unconfirmed_name(self, name):
+        """
+        What to ask when a name is not registered but close to names that are
+
+        Args:
+            name (str): Patient's name as given
+
+        Returns:
+            str: A request to confirm one of the close names by phone, or None
+        """
+        if self.resolve_patient_name(name):
+            return None
+        candidates = self.patient_index.candidates(name)
+        if not candidates:
+            return None
+        return (f"No patient is registered as {name}. Close matches: {', '.join(candidates)}. "
+                f"Ask the patient which one they are, then call get_appointment_history with their name and phone number.")
+
+    @profiled("patients.register")
+    def register_patient(self, patient_info):
+        """
+        Register a patient unless a close match with the same phone number already is
+
+        Args:
+            patient_info (dict): Patient details including name, phone, email
+
+        Returns:
+            str: Name the patient is registered under
+        """
+        with self._lock:
+            name = patient_info["name"]
+            if name in self.patients:
+                return name
+            duplicate = self.patient_index.find_duplicate(name, patient_info.get("phone"))
+            if duplicate is not None:
+                return duplicate.patient_id
+            self.patients[name] = dict(patient_info)
+            self.patient_index.add(name, name, patient_info.get("phone"))
+            self.publish_change("patient", "registered", name, None, patient_info)
+            return name
+
+
+    def remember_slots(self, function_args):
+        """Keep the details the model passed to a tool for the rest of the session"""
+        for arg, slot in (("name", "patient_name"), ("patient_name", "patient_name"),
+                          ("service", "service"), ("date", "requested_date"),
+                          ("new_date", "requested_date")):
+            if function_args.get(arg):
+                self.slots[slot] = function_args[arg]
+
+    @profiled("local_booking")
+    def handle_booking_slots(self, user_input):
+        """
+        Advance a booking without the model when the message can be parsed locally
+
+        Args:
+            user_input (str): The patient's message
+
+        Returns:
+            str: Templated reply, or None if the model should handle the message
+        """
+        filled = self.slot_tracker.update(user_input)
+        if self.slots.get("intent") != "book" or not filled:
+            return None
+
+        question = self.slot_tracker.next_question()
+        if question:
+            return question
+
+        problems = self.slot_problems(self.slots["requested_date"], self.slots["requested_time"], self.slots["service"])
+        if problems:
+            # Ask again for just the slots that were wrong
+            return self.slot_tracker.reask(problems)
+
+        patient_info = {
+            "name": self.slots["patient_name"],
+            "phone": self.slots["phone"],
+            "email": self.slots.get("email", "")
+        }
+        result = self.book_appointment(
+            patient_info,
+            self.slots["service"],
+            self.slots["requested_date"],
+            self.slots["requested_time"]
+        )
+        if not result:
+            self.slots.pop("requested_time", None)
+            return "Sorry, that time slot is not available. What other time would work for you?"
+
+        reply = (f"You're all set, {patient_info['name']}! Your {result['service']} "
+                 f"({result['duration']} minutes) is booked for {self.slot_tracker.describe_date()} "
+                 f"at {result['time']}.")
+        self.slot_tracker.clear_request()
+        return reply
+
+    def slot_problems(self, date, time, service=None):
+        """
+        Check a requested slot against the practice hours and booking rules
+
+        Returns:
+            dict: "requested_date" and/or "requested_time" -> why it can't be booked; empty if it can
+        """
+        duration = int(self.practice_info["services"].get(service, {}).get("duration", 0))
+        return booking_problems(date, time, self.practice_info, duration, service, self.slot_tracker.today)
+
+    def create_response(self, choice, **kwargs):
+        """
+        Call the Responses API with the model picked by the policy
+
+        Args:
+            choice (ModelChoice): Model selected by model_policy
+            **kwargs: Extra arguments for client.responses.create
 
+        Returns:
+            Response: The API response
+        """
+        started = time.perf_counter()
+        with profiler.span("build_prompt"):
+            model_input = self.build_input()
+        request = lambda model: get_client().responses.create(model=model, input=model_input, **kwargs)
+        # Patients mid-booking go ahead of general questions when we're near quota
+        priority = PRIORITY_BOOKING if self.slots.get("intent") else PRIORITY_FAQ
+        tokens = estimate_tokens(model_input)
 
+        def limited_call():
+            # Quota is taken once for the call, not per retry or hedge, and settled on the usage
+            return rate_limiter.call(
+                lambda: model_client.call(
+                    rate_limiter.pausing(request), [choice.model, model_policy.fallback_model(choice)]
+                ),
+                tokens, priority, usage=lambda result: result.usage.total_tokens if result.usage else None,
+                timeout=model_client.deadline
+            )
+
+        try:
+            # Identical prompts already in flight share one request
+            with profiler.span("model_call"):
+                response = coalescer.call(request_key(choice.model, model_input, kwargs), limited_call)
+        except Exception:
+            model_policy.record_call(choice, started, ok=False)
+            raise
+        model_policy.record_call(choice, started, response.usage)
+        self.last_response_id = response.id
+        return response
+
+    @profiled("validate_function_call")
+    def validate_function_call(self, function_call, functions):
+        """
+        Check a function call against the tool schemas
+
+        Returns:
+            str: Description of the problem, or None if the call is valid
+        """
+        schemas = {function["name"]: function["parameters"] for function in functions}
+        if function_call.name not in schemas:
+            return f"unknown function {function_call.name}"
+        try:
+            args = json.loads(function_call.arguments)
+        except json.JSONDecodeError:
+            return f"unparseable arguments for {function_call.name}"
+        schema = schemas[function_call.name]
+        missing = [arg for arg in schema.get("required", []) if not args.get(arg)]
+        if missing:
+            return f"{function_call.name} missing {', '.join(missing)}"
+        for arg, spec in schema["properties"].items():
+            if "enum" in spec and arg in args and args[arg] not in spec["enum"]:
+                return f"{function_call.name} got invalid {arg} {args[arg]!r}"
+        return None
+
+    @profiled_turn("generate_response")
     def generate_response(self, user_input):
         """Generate a response using OpenAI's GPT-4 API."""
         try:
             # Add user's message to conversation history
             self.conversation_history.append({"role": "user", "content": user_input})
             
+            # Booking details we can parse ourselves don't need a model round trip
+            local_reply = self.handle_booking_slots(user_input)
+            if local_reply:
+                self.conversation_history.append({"role": "assistant", "content": local_reply})
+                self.checkpoint_session()
+                return local_reply
+            
             # Get available functions
             functions = self.get_available_functions()
             
             # Make the API call
-            response = client.responses.create(
-                model="gpt-4o",
-                input="\n".join(str(msg["content"]) for msg in [{"role": "system", "content": self.get_system_prompt()}, *self.conversation_history]),
-                tools=functions,
-                tool_choice="auto"
-            )
+            choice = model_policy.select("Responses Assistant", confidence=intent_confidence(user_input))
+            response = self.create_response(choice, tools=functions, tool_choice="auto")
             
             # Get the response
             assistant_message = response.output[0]
             
+            # A smaller model that gets the tool arguments wrong is retried on the large one
+            if assistant_message.type == "function_call":
+                error = self.validate_function_call(assistant_message, functions)
+                if error:
+                    choice = model_policy.select("Responses Assistant", escalate=True, reason=error)
+                    response = self.create_response(choice, tools=functions, tool_choice="auto")
+                    assistant_message = response.output[0]
+            
             # Check if the model wants to call a function
             if assistant_message.type == "function_call":
                 function_name = assistant_message.name
-                function_args = json.loads(assistant_message.arguments)
+                with profiler.span("parse_function_args"):
+                    function_args = json.loads(assistant_message.arguments)
+                self.remember_slots(function_args)
                 
                 # Execute the function
-                if function_name == "book_appointment":
-                    patient_info = {
-                        "name": function_args["name"],
-                        "phone": function_args["phone"],
-                        "email": function_args.get("email", "")
-                    }
-                    result = self.book_appointment(
-                        patient_info,
-                        function_args["service"],
-                        function_args["date"],
-                        function_args["time"]
-                    )
-                    function_response = "Appointment booked successfully." if result else "Failed to book appointment. Time slot might be unavailable."
+                with profiler.span(f"tool.{function_name}"):
+                    if function_name == "book_appointment":
+                        patient_info = {
+                            "name": function_args["name"],
+                            "phone": function_args["phone"],
+                            "email": function_args.get("email", "")
+                        }
+                        problems = self.slot_problems(function_args["date"], function_args["time"], function_args["service"])
+                        result = None if problems else self.book_appointment(
+                            patient_info,
+                            function_args["service"],
+                            function_args["date"],
+                            function_args["time"]
+                        )
+                        if problems:
+                            function_response = "Not booked: " + " ".join(problems.values())
+                        else:
+                            function_response = "Appointment booked successfully." if result else "Failed to book appointment. Time slot might be unavailable."
                 
-                elif function_name == "get_appointment_history":
-                    result = self.get_appointment_history(function_args["name"])
-                    if result:
-                        appointments_str = "\n".join([
-                            f"- {appt['date']} at {appt['time']}: {appt['service']} ({appt['status']})"
-                            for appt in result
-                        ])
-                        function_response = f"Here are your appointments:\n{appointments_str}"
-                    else:
-                        function_response = f"No appointments found for patient '{function_args['name']}'."
+                    elif function_name == "get_appointment_history":
+                        name = self.resolve_patient_name(function_args["name"], function_args.get("phone")) or function_args["name"]
+                        result = self.render_appointment_history(name)
+                        if result:
+                            function_response = result
+                        else:
+                            function_response = self.unconfirmed_name(name) or f"No appointments found for patient '{name}'."
                 
-                elif function_name == "cancel_appointment":
-                    result = self.cancel_appointment(function_args["appointment_id"])
-                    function_response = "Appointment cancelled successfully." if result else "Failed to cancel appointment. Appointment ID not found."
+                    elif function_name == "cancel_appointment":
+                        result = self.cancel_appointment(function_args["appointment_id"])
+                        function_response = "Appointment cancelled successfully." if result else "Failed to cancel appointment. Appointment ID not found."
                 
-                elif function_name == "reschedule_appointment":
-                    result = self.reschedule_appointment(
-                        function_args.get("appointment_id"),
-                        function_args.get("new_date"),
-                        function_args.get("new_time"),
-                        function_args.get("patient_name")
-                    )
-                    function_response = "Appointment rescheduled successfully." if result else "Failed to reschedule appointment. Time slot might be unavailable or appointment ID not found."
+                    elif function_name == "reschedule_appointment":
+                        question = None
+                        if not function_args.get("appointment_id") and function_args.get("patient_name"):
+                            question = self.unconfirmed_name(function_args["patient_name"])
+                        result = None if question else self.reschedule_appointment(
+                            function_args.get("appointment_id"),
+                            function_args.get("new_date"),
+                            function_args.get("new_time"),
+                            function_args.get("patient_name")
+                        )
+                        function_response = question or ("Appointment rescheduled successfully." if result else "Failed to reschedule appointment. Time slot might be unavailable or appointment ID not found.")
                 
                 # Add function response to conversation history
                 self.conversation_history.append({
@@ -287,9 +621,8 @@ Provide clear, direct responses to questions about our services, policies, or ot
                 })
                 
                 # Get final response from GPT
-                second_response = client.responses.create(
-                    model="gpt-4o",
-                    input="\n".join(str(msg["content"]) for msg in [{"role": "system", "content": self.get_system_prompt()}, *self.conversation_history]),
+                second_response = self.create_response(
+                    model_policy.select("Responses Follow-up"),
                     temperature=0.7  # Add some variability to responses
                 )
                 
@@ -302,13 +635,19 @@ Provide clear, direct responses to questions about our services, policies, or ot
                 "role": "assistant",
                 "content": response_text
             })
+            self.checkpoint_session()
             
             return response_text
             
+        except ModelUnavailable as e:
+            # Answer what we can locally until the model is reachable again
+            print(f"Error generating response: {str(e)}")
+            return degraded_answer(user_input, self.practice_info["faqs"], self.practice_info["phone"])
         except Exception as e:
             print(f"Error generating response: {str(e)}")
             return "I apologize, but I encountered an error. Please try again or contact support."
 
+    @profiled("appointments.book")
     def book_appointment(self, patient_info, service, date, time):
         """
         Book a new appointment for a patient
@@ -322,31 +661,37 @@ Provide clear, direct responses to questions about our services, policies, or ot
         Returns:
             dict: Appointment details if successful, None if failed
         """
-        # Validate service exists
-        if service not in self.practice_info["services"]:
-            return None
+        with self._lock:
+            # Validate service exists
+            if service not in self.practice_info["services"]:
+                return None
             
-        # Create unique appointment ID
-        appointment_id = f"{date}-{time}-{patient_info['name']}"
+            # Book under the registered name so "Jon Smith" and "John Smith" share one record
+            patient_info = dict(patient_info, name=self.register_patient(patient_info))
+
+            # Create unique appointment ID
+            appointment_id = f"{date}-{time}-{patient_info['name']}"
         
-        # Check if timeslot is available
-        if appointment_id in self.appointments:
-            return None
+            # Check if timeslot is available
+            if appointment_id in self.appointments:
+                return None
             
-        # Create appointment
-        appointment = {
-            "patient": patient_info,
-            "service": service,
-            "date": date,
-            "time": time,
-            "duration": self.practice_info["services"][service]["duration"],
-            "status": "confirmed"
-        }
+            # Create appointment
+            appointment = {
+                "patient": patient_info,
+                "service": service,
+                "date": date,
+                "time": time,
+                "duration": self.practice_info["services"][service]["duration"],
+                "status": "confirmed"
+            }
         
-        # Store appointment
-        self.appointments[appointment_id] = appointment
-        return appointment
+            # Store appointment
+            self.appointments[appointment_id] = appointment
+            self.appointment_changed("booked", appointment_id, None, appointment)
+            return appointment
 
+    @profiled("appointments.cancel")
     def cancel_appointment(self, appointment_id):
         """
         Cancel an existing appointment
@@ -357,12 +702,16 @@ Provide clear, direct responses to questions about our services, policies, or ot
         Returns:
             bool: True if cancelled successfully, False otherwise
         """
-        if appointment_id not in self.appointments:
-            return False
+        with self._lock:
+            if appointment_id not in self.appointments:
+                return False
             
-        self.appointments[appointment_id]["status"] = "cancelled"
-        return True
+            before = dict(self.appointments[appointment_id])
+            self.appointments[appointment_id]["status"] = "cancelled"
+            self.appointment_changed("cancelled", appointment_id, before, self.appointments[appointment_id])
+            return True
 
+    @profiled("appointments.reschedule")
     def reschedule_appointment(self, appointment_id=None, new_date=None, new_time=None, patient_name=None):
         """
         Reschedule an existing appointment
@@ -376,48 +725,143 @@ Provide clear, direct responses to questions about our services, policies, or ot
         Returns:
             dict: Updated appointment details if successful, None if failed
         """
-        # If no appointment_id but patient name is provided, look up their active appointment
-        if not appointment_id and patient_name:
-            active_appointments = self.find_appointment_by_name(patient_name)
-            if not active_appointments:
-                return None
-            # If patient has only one active appointment, use that
-            if len(active_appointments) == 1:
-                appointment_id = list(active_appointments.keys())[0]
-            else:
-                # Multiple appointments found - this should be handled by the conversation flow
-                return None
+        with self._lock:
+            # If no appointment_id but patient name is provided, look up their active appointment
+            if not appointment_id and patient_name:
+                active_appointments = self.find_appointment_by_name(patient_name)
+                if not active_appointments:
+                    return None
+                # If patient has only one active appointment, use that
+                if len(active_appointments) == 1:
+                    appointment_id = list(active_appointments.keys())[0]
+                else:
+                    # Multiple appointments found - this should be handled by the conversation flow
+                    return None
 
-        # Proceed with rescheduling if we have an appointment_id
-        if not appointment_id or appointment_id not in self.appointments:
-            return None
+            # Proceed with rescheduling if we have an appointment_id
+            if not appointment_id or appointment_id not in self.appointments:
+                return None
             
-        if not new_date or not new_time:
-            return None
+            if not new_date or not new_time:
+                return None
             
-        # Get the existing appointment
-        appointment = self.appointments[appointment_id]
+            # Get the existing appointment
+            appointment = self.appointments[appointment_id]
         
-        # Create new appointment ID
-        new_appointment_id = f"{new_date}-{new_time}-{appointment['patient']['name']}"
+            # Create new appointment ID
+            new_appointment_id = f"{new_date}-{new_time}-{appointment['patient']['name']}"
         
-        # Check if new timeslot is available
-        if new_appointment_id in self.appointments and new_appointment_id != appointment_id:
-            return None
+            # Check if new timeslot is available
+            if new_appointment_id in self.appointments and new_appointment_id != appointment_id:
+                return None
             
-        # Update appointment
-        appointment["date"] = new_date
-        appointment["time"] = new_time
+            # Update appointment
+            before = dict(appointment)
+            appointment["date"] = new_date
+            appointment["time"] = new_time
         
-        # If the appointment ID changed, update the dictionary
-        if new_appointment_id != appointment_id:
-            self.appointments[new_appointment_id] = appointment
-            del self.appointments[appointment_id]
+            # If the appointment ID changed, update the dictionary
+            if new_appointment_id != appointment_id:
+                self.appointments[new_appointment_id] = appointment
+                del self.appointments[appointment_id]
+            self.appointment_changed("rescheduled", new_appointment_id, before, appointment, previous_id=appointment_id)
         
-        return appointment
+            return appointment
+
+    def schedule_reminders(self, appointment_id, appointment):
+        """
+        Queue the reminders for an appointment, replacing any queued before
+
+        Args:
+            appointment_id (str): Unique appointment identifier
+            appointment (dict): The appointment as stored in self.appointments
+        """
+        if self.reminders is None:
+            return
+        patient = appointment["patient"]
+        when = datetime.strptime(f"{appointment['date']} {appointment['time']}", "%Y-%m-%d %H:%M")
+        message = (f"Hi {patient['name']}, this is a reminder of your {appointment['service']} appointment "
+                   f"at {self.practice_info['name']} on {appointment['date']} at {appointment['time']}. "
+                   f"Call {self.practice_info['phone']} if you need to reschedule.")
+        self.reminders.schedule(appointment_id, when, patient, message)
+
+    def appointment_changed(self, event, appointment_id, before, after, previous_id=None):
+        """
+        Keep reminders, analytics and cached views in step with an appointment mutation
+
+        Args:
+            event (str): "booked", "cancelled" or "rescheduled"
+            appointment_id (str): Identifier of the appointment after the change
+            before (dict): Copy of the appointment before the change, None when booked
+            after (dict): The appointment as now stored
+            previous_id (str, optional): Old identifier when rescheduling changed it
+        """
+        self.render_cache.invalidate(after["patient"]["name"].lower())
+        if self.reminders is not None and (event == "cancelled" or previous_id not in (None, appointment_id)):
+            self.reminders.cancel(previous_id or appointment_id)
+        if event != "cancelled":
+            self.schedule_reminders(appointment_id, after)
+        self.analytics.apply(
+            event,
+            self.analytics_record(before) if before else None,
+            self.analytics_record(after)
+        )
+        self.publish_change("appointment", event, appointment_id, before, after)
+
+    def publish_change(self, entity, action, key, before, after):
+        """
+        Publish a mutation to the change log
+
+        Args:
+            entity (str): "patient" or "appointment"
+            action (str): "registered", "booked", "cancelled" or "rescheduled"
+            key (str): Patient name or appointment identifier after the change
+            before (dict): Record before the change, None when created
+            after (dict): Record after the change
+        """
+        change_log.publish("responses", entity, action, key, before, after, self.actor, self.session_id)
+
+    def analytics_record(self, appointment):
+        day = datetime.strptime(appointment["date"], "%Y-%m-%d").date()
+        return make_record(day, appointment["service"], appointment["status"] == "cancelled",
+                           self.practice_info["services"])
+
+    def verify_analytics(self):
+        """
+        Rebuild the aggregates from all appointments and compare them with the live ones
+
+        Returns:
+            list: Mismatches, empty when the incremental aggregates are consistent
+        """
+        rebuilt = AppointmentAggregates.rebuild(self.analytics_record(app) for app in self.appointments.values())
+        return self.analytics.diff(rebuilt)
+
+    def export_history(self, path, fmt=None):
+        """
+        Write appointments and their patients to a columnar file for offline analysis
+
+        Args:
+            path (str): Output file; .parquet or .arrow need pyarrow, anything else is .npz
+            fmt (str, optional): Force "parquet", "arrow" or "npz"
+
+        Returns:
+            dict: Output paths, format and row counts
+        """
+        return export_history(self.appointments, self.practice_info["services"], path, None, fmt)
 
 def main():
-    assistant = DentalAssistant()
+    # Set DENTAL_SESSION_ID to resume the same conversation after a restart
+    session_id = os.getenv("DENTAL_SESSION_ID")
+    # Set DENTAL_REMINDERS=1 to queue and send appointment reminders
+    reminders = None
+    if os.getenv("DENTAL_REMINDERS") == "1":
+        reminders = ReminderQueue()
+        ReminderDispatcher(reminders, reminder_sender_from_env()).start()
+    # DENTAL_CHANGES_FILE / _SOCKET / _WEBHOOK stream every mutation
+    subscribe_from_env()
+    # DENTAL_PROFILE=1 profiles turns from the start; SIGUSR2 toggles it
+    install_signal_toggle()
+    assistant = DentalAssistant(session_id, SessionStore() if session_id else None, reminders)
     
     while True:
         user_input = input("\nYou: ").strip()
@@ -0,0 +1,264 @@
+import sys
+import json
+import zipfile
+from functools import lru_cache
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Rows per row group; only one group is held in memory at a time
+ROW_GROUP_SIZE = 65536
+
+# Stored as int8 codes. dental_assistant.py uses "scheduled", the Responses-API
+# assistant "confirmed"; both mean an active booking.
+STATUS_CODES = {"scheduled": 0, "confirmed": 1, "cancelled": 2}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Column name -> numpy dtype
+APPOINTMENT_COLUMNS = {
+    "start_minute": "int64",   # minutes since 1970-01-01, clinic local time
+    "duration": "int16",       # minutes
+    "service_id": "int8",      # index into the service list stored with the export
+    "status": "int8",          # STATUS_CODES
+    "patient_id": "int32",
+}
+PATIENT_COLUMNS = ("patient_id", "name", "phone", "email", "dob")
+
+FORMATS = ("parquet", "arrow", "npz")
+
+
+@lru_cache(maxsize=4096)
+def day_minute(raw: str) -> int:
+    """Minutes since EPOCH at the start of a date stored by either assistant"""
+    date_format = "%d/%m/%Y" if "/" in raw else "%Y-%m-%d"
+    return int((datetime.strptime(raw, date_format) - EPOCH).total_seconds()) // 60
+
+
+def start_minute(appointment: Dict) -> int:
+    hours, minutes = appointment["time"].split(":")
+    return day_minute(appointment["date"]) + int(hours) * 60 + int(minutes)
+
+
+class PatientIds:
+    """
+    Integer patient ids for the export
+
+    dental_assistant.py already numbers its patients; the Responses-API
+    assistant embeds patient details in each appointment, so those patients
+    are numbered the first time they are seen.
+    """
+
+    def __init__(self, patients: Optional[Dict] = None):
+        self.rows: Dict[int, Dict] = {}
+        self._keys: Dict[Tuple, int] = {}
+        for patient_id, patient in (patients or {}).items():
+            self.rows[int(patient_id)] = dict(patient)
+
+    def lookup(self, appointment: Dict) -> int:
+        if "patient_id" in appointment:
+            return int(appointment["patient_id"])
+        patient = appointment["patient"]
+        key = (patient.get("name"), patient.get("phone"))
+        if key not in self._keys:
+            self._keys[key] = len(self.rows) + 1
+            while self._keys[key] in self.rows:
+                self._keys[key] += 1
+            self.rows[self._keys[key]] = dict(patient)
+        return self._keys[key]
+
+
+def row_groups(appointments: Dict, services: Dict, patient_ids: PatientIds,
+               size: int = ROW_GROUP_SIZE) -> Iterator[Dict[str, list]]:
+    """Yield the appointments as column lists, `size` rows at a time"""
+    service_ids = {name: index for index, name in enumerate(services)}
+    group = {column: [] for column in APPOINTMENT_COLUMNS}
+    for appointment in appointments.values():
+        group["start_minute"].append(start_minute(appointment))
+        # dental_assistant.py does not copy the duration into the appointment
+        duration = appointment.get("duration") or services.get(appointment["service"], {}).get("duration", 0)
+        group["duration"].append(int(duration))
+        group["service_id"].append(service_ids.get(appointment["service"], -1))
+        group["status"].append(STATUS_CODES.get(appointment["status"], -1))
+        group["patient_id"].append(patient_ids.lookup(appointment))
+        if len(group["start_minute"]) == size:
+            yield group
+            group = {column: [] for column in APPOINTMENT_COLUMNS}
+    if group["start_minute"]:
+        yield group
+
+
+def patient_table(patient_ids: PatientIds) -> Dict[str, list]:
+    table = {column: [] for column in PATIENT_COLUMNS}
+    for patient_id, patient in sorted(patient_ids.rows.items()):
+        table["patient_id"].append(patient_id)
+        for column in PATIENT_COLUMNS[1:]:
+            table[column].append(str(patient.get(column) or ""))
+    return table
+
+
+def _metadata(services: List[str]) -> Dict:
+    return {"services": list(services), "statuses": STATUS_CODES, "epoch": EPOCH.isoformat()}
+
+
+class ArrowWriter:
+    """Parquet or Arrow IPC output through pyarrow, one row group per batch"""
+
+    def __init__(self, path: str, fmt: str, services: List[str]):
+        import pyarrow as pa
+        self.pa = pa
+        self.path = path
+        self.fmt = fmt
+        self.schema = pa.schema(
+            [(name, getattr(pa, dtype)()) for name, dtype in APPOINTMENT_COLUMNS.items()],
+            metadata={"dental_export": json.dumps(_metadata(services))},
+        )
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self.schema)
+
+    def write_group(self, group: Dict[str, list]) -> None:
+        batch = self.pa.record_batch([group[name] for name in APPOINTMENT_COLUMNS], schema=self.schema)
+        if self.fmt == "parquet":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+
+    def write_patients(self, path: str, table: Dict[str, list]) -> None:
+        patients = self.pa.table(table)
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(patients, path)
+        else:
+            with self.pa.ipc.new_file(path, patients.schema) as writer:
+                writer.write_table(patients)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class NpzWriter:
+    """
+    Pure-NumPy fallback: a zip of .npy arrays, one entry per column per row group
+
+    Entries are streamed straight into the archive, so the file is readable
+    with np.load (see `read_npz`) but nothing larger than one row group is
+    ever built in memory.
+    """
+
+    def __init__(self, path: str, fmt: str, services: List[str]):
+        import numpy as np
+        self.np = np
+        self.path = path
+        self.groups = 0
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._zip.writestr("metadata.json", json.dumps(_metadata(services)))
+
+    def _write_array(self, name: str, array) -> None:
+        with self._zip.open(f"{name}.npy", "w", force_zip64=True) as f:
+            self.np.lib.format.write_array(f, array, allow_pickle=False)
+
+    def write_group(self, group: Dict[str, list]) -> None:
+        for name, dtype in APPOINTMENT_COLUMNS.items():
+            self._write_array(f"{name}.{self.groups:05d}", self.np.asarray(group[name], dtype=dtype))
+        self.groups += 1
+
+    def write_patients(self, path: str, table: Dict[str, list]) -> None:
+        with zipfile.ZipFile(path, "w", allowZip64=True) as archive:
+            for name, values in table.items():
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+                    array = self.np.asarray(values, dtype="int32" if name == "patient_id" else str)
+                    self.np.lib.format.write_array(f, array, allow_pickle=False)
+
+    def close(self) -> None:
+        self._zip.close()
+
+
+def default_format(path: str) -> str:
+    """Pick the format from the file extension, falling back to npz without pyarrow"""
+    suffix = path.rsplit(".", 1)[-1].lower()
+    fmt = {"parquet": "parquet", "arrow": "arrow", "feather": "arrow", "ipc": "arrow"}.get(suffix, "npz")
+    if fmt != "npz":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            fmt = "npz"
+    return fmt
+
+
+def patients_path(path: str) -> str:
+    stem, dot, suffix = path.rpartition(".")
+    return f"{stem}_patients.{suffix}" if dot else f"{path}_patients"
+
+
+def export_history(appointments: Dict, services: Dict, path: str, patients: Optional[Dict] = None,
+                   fmt: Optional[str] = None, row_group_size: int = ROW_GROUP_SIZE) -> Dict:
+    """
+    Write appointments, and the patients they reference, in a columnar format
+
+    Args:
+        appointments: The `appointments` dict of either assistant
+        services: practice_info["services"]; its order defines service_id
+        path: Output file; patients go to a sibling "<name>_patients" file
+        patients: The `patients` dict of dental_assistant.py, if any
+        fmt: "parquet", "arrow" or "npz"; chosen from the extension when omitted
+        row_group_size: Rows per row group
+
+    Returns:
+        dict: Output paths, format and row counts
+    """
+    fmt = fmt or default_format(path)
+    if fmt == "npz" and not path.endswith(".npz"):
+        # Don't leave an npz archive behind a .parquet/.arrow name when pyarrow is missing
+        path += ".npz"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    service_names = list(services)
+    writer = (NpzWriter if fmt == "npz" else ArrowWriter)(path, fmt, service_names)
+    patient_ids = PatientIds(patients)
+    rows = 0
+    try:
+        for group in row_groups(appointments, services, patient_ids, row_group_size):
+            writer.write_group(group)
+            rows += len(group["start_minute"])
+    finally:
+        writer.close()
+    writer.write_patients(patients_path(path), patient_table(patient_ids))
+    return {"format": fmt, "appointments": path, "patients": patients_path(path),
+            "rows": rows, "patient_rows": len(patient_ids.rows)}
+
+
+def read_npz(path: str) -> Dict:
+    """Load an npz export back into whole columns, plus its metadata"""
+    import numpy as np
+    with zipfile.ZipFile(path) as archive:
+        metadata = json.loads(archive.read("metadata.json"))
+        names = sorted(name for name in archive.namelist() if name.endswith(".npy"))
+    columns = {}
+    with np.load(path) as data:
+        for column in APPOINTMENT_COLUMNS:
+            parts = [data[name[:-4]] for name in names if name.startswith(f"{column}.")]
+            columns[column] = np.concatenate(parts) if parts else np.empty(0, dtype=APPOINTMENT_COLUMNS[column])
+    return {"metadata": metadata, **columns}
+
+
+def main():
+    """python history_export.py appointments.json out.(parquet|arrow|npz) [patients.json]"""
+    if len(sys.argv) < 3:
+        print("usage: python history_export.py appointments.json out.(parquet|arrow|npz) [patients.json]")
+        return 1
+    with open(sys.argv[1]) as f:
+        appointments = json.load(f)
+    patients = None
+    if len(sys.argv) > 3:
+        with open(sys.argv[3]) as f:
+            patients = json.load(f)
+    from dental_assistant import DentalAssistant
+    services = DentalAssistant().practice_info["services"]
+    print(json.dumps(export_history(appointments, services, sys.argv[2], patients)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Import-time benchmark: python import_benchmark.py [runs]
+
+Imports each entry module in a fresh interpreter and fails (exit 1) when the
+median import time exceeds DENTAL_IMPORT_BUDGET_MS or when the import pulled
+in a heavy dependency that should only load on first use.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+MODULES = ["dental_assistant", "dental_assistant_responsesApi", "agentSDK_multiAgent"]
+
+# Median wall time allowed for importing one module in a fresh interpreter
+IMPORT_BUDGET_MS = float(os.getenv("DENTAL_IMPORT_BUDGET_MS", "250"))
+
+# Loaded lazily by get_openai / get_client / get_agents, never at import
+LAZY_MODULES = ["openai", "agents", "dotenv", "numpy", "pyarrow", "smtplib", "sentence_transformers", "pypdf"]
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+# Cost of the first agent build versus the cached one, reported but not enforced
+AGENT_PROBE = """
+import time, json
+import agentSDK_multiAgent as m
+started = time.perf_counter()
+m.get_agents()
+cold = time.perf_counter() - started
+started = time.perf_counter()
+m.get_agents()
+print(json.dumps({"cold_ms": cold * 1000, "cached_ms": (time.perf_counter() - started) * 1000}))
+"""
+
+
+def probe(code: str) -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    failed = False
+    for module in MODULES:
+        results = [probe(PROBE.format(module=module, lazy=LAZY_MODULES)) for _ in range(runs)]
+        median = statistics.median(result["ms"] for result in results)
+        loaded = sorted({name for result in results for name in result["loaded"]})
+        ok = median <= IMPORT_BUDGET_MS and not loaded
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {median:.1f} ms median over {runs} runs "
+              f"(budget {IMPORT_BUDGET_MS:.0f} ms)" + (f", eagerly imported {', '.join(loaded)}" if loaded else ""))
+    try:
+        agents = probe(AGENT_PROBE)
+        print(f"     get_agents(): {agents['cold_ms']:.0f} ms on first use, {agents['cached_ms']:.3f} ms cached")
+    except subprocess.CalledProcessError:
+        print("     get_agents(): skipped, the agents SDK is not importable")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,631 @@
+"""
+Property and load harness
+
+    python load_harness.py properties [--target all] [--examples 100] [--threads 4] [--seed 0]
+    python load_harness.py load [--target all] [--patients 50] [--seconds 10] [--threads 8] [--latency 0.05]
+
+properties: random sequences of bookings, cancellations and reschedules run
+from several threads at once against each target, then the invariants are
+checked: unique ids, no chair double-booked, patient/slot indexes, cached
+views and analytics consistent with the records, and the change-event
+stream replaying to the same state. Sequences come from Hypothesis, which
+also shrinks a failing one, when it is installed (pip install hypothesis,
+an optional test dependency), and from a seeded generator otherwise.
+tests/test_load_harness.py runs these checks under pytest.
+
+load: N simulated patients book, reschedule, cancel and chat for a fixed
+time against FakeModel, a stand-in for the OpenAI APIs with configurable
+latency, and ops/sec and p50/p99 latency are reported per operation. Chat
+turns still pass through the real rate limiter, so set DENTAL_RPM_LIMIT and
+DENTAL_TPM_LIMIT above your quota to measure past it.
+
+Targets: dental_assistant, clinic (tenancy.ClinicAssistant with 2 chairs),
+responses and multi_agent (the agents SDK tools, called directly).
+"""
+import sys
+import copy
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import dental_assistant
+import dental_assistant_responsesApi
+import agentSDK_multiAgent
+from change_events import CallbackSink, change_log
+from scheduling_store import SchedulingStore
+from slot_filling import DEFAULT_SERVICES
+
+PATIENTS = [("John Smith", "555-010-0001", "01/02/1980"), ("Jane Doe", "555-010-0002", "15/06/1975"),
+            ("Ahmed Khan", "555-010-0003", "30/11/1990"), ("Maria Garcia", "555-010-0004", "07/07/1988"),
+            ("Wei Chen", "555-010-0005", "22/03/1965"), ("Olga Novak", "555-010-0006", "09/09/2001")]
+TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(9, 17) for minute in (0, 30)]
+SERVICES = list(DEFAULT_SERVICES)
+
+
+def booking_days(count: int = 15) -> List[date]:
+    """The next `count` weekdays, all bookable under every target's rules"""
+    days, day = [], date.today()
+    while len(days) < count:
+        day += timedelta(days=1)
+        if day.weekday() < 5:
+            days.append(day)
+    return days
+
+
+DAYS = booking_days()
+
+
+# Operations are plain tuples so Hypothesis can generate and shrink them:
+#   ("book", patient, service, day, time)     indexes into PATIENTS, SERVICES, DAYS, TIMES
+#   ("cancel", pick)                          pick % number of appointments
+#   ("reschedule", pick, day, time)
+#   ("history", patient)                      reads, and so caches, the patient's appointment view
+
+def random_ops(rng: random.Random, count: int) -> List[Tuple]:
+    ops = []
+    for _ in range(count):
+        kind = rng.choices(["book", "cancel", "reschedule", "history"], [3, 1, 1, 1])[0]
+        if kind == "book":
+            ops.append(("book", rng.randrange(len(PATIENTS)), rng.randrange(len(SERVICES)),
+                        rng.randrange(len(DAYS)), rng.randrange(len(TIMES))))
+        elif kind == "cancel":
+            ops.append(("cancel", rng.randrange(1000)))
+        elif kind == "reschedule":
+            ops.append(("reschedule", rng.randrange(1000), rng.randrange(len(DAYS)), rng.randrange(len(TIMES))))
+        else:
+            ops.append(("history", rng.randrange(len(PATIENTS))))
+    return ops
+
+
+def op_strategy():
+    from hypothesis import strategies as st
+    index = lambda items: st.integers(0, len(items) - 1)
+    return st.one_of(
+        st.tuples(st.just("book"), index(PATIENTS), index(SERVICES), index(DAYS), index(TIMES)),
+        st.tuples(st.just("cancel"), st.integers(0, 999)),
+        st.tuples(st.just("reschedule"), st.integers(0, 999), index(DAYS), index(TIMES)),
+        st.tuples(st.just("history"), index(PATIENTS)),
+    )
+
+
+# Targets. Each wraps a fresh assistant, applies operations and lists the
+# invariants that do not hold.
+
+class DentalAssistantTarget:
+    name = "dental_assistant"
+    source = "dental_assistant"
+
+    def __init__(self):
+        self.assistant = dental_assistant.DentalAssistant()
+        self.record_changes()
+
+    def appointment_ids(self) -> List:
+        with self.assistant._lock:
+            return sorted(self.assistant.appointments)
+
+    def apply(self, op: Tuple) -> str:
+        assistant = self.assistant
+        if op[0] == "book":
+            name, phone, dob = PATIENTS[op[1]]
+            result = assistant.book_flow(phone, name, f"{phone}@example.com", dob, SERVICES[op[2]],
+                                         DAYS[op[3]].strftime("%d/%m/%Y"), TIMES[op[4]])
+            return "ok" if result.ok else "rejected"
+        if op[0] == "history":
+            return self.history(*PATIENTS[op[1]][:2])
+        ids = self.appointment_ids()
+        if not ids:
+            return "noop"
+        appointment_id = ids[op[1] % len(ids)]
+        if op[0] == "cancel":
+            ok, _ = assistant.cancel_appointment(appointment_id)
+        else:
+            ok, _ = assistant.reschedule_appointment(appointment_id, DAYS[op[2]].strftime("%d/%m/%Y"), TIMES[op[3]])
+        return "ok" if ok else "rejected"
+
+    def history(self, name: str, phone: str) -> str:
+        return "ok" if self.assistant.history_flow(phone).ok else "noop"
+
+    def check(self) -> List[str]:
+        assistant = self.assistant
+        problems = []
+        with assistant._lock:
+            ids = sorted(assistant.appointments)
+            if ids != list(range(1, len(ids) + 1)):
+                problems.append(f"appointment ids not unique and contiguous: {ids}")
+            if sorted(assistant.patients) != list(range(1, len(assistant.patients) + 1)):
+                problems.append(f"patient ids not unique and contiguous: {sorted(assistant.patients)}")
+            for appointment_id, appointment in assistant.appointments.items():
+                if appointment["id"] != appointment_id:
+                    problems.append(f"appointment {appointment_id} stored with id {appointment['id']}")
+                patient = assistant.patients.get(appointment["patient_id"])
+                if patient is None or appointment_id not in patient["appointments"]:
+                    problems.append(f"appointment {appointment_id} not linked from its patient")
+            linked = sum(len(patient["appointments"]) for patient in assistant.patients.values())
+            if linked != len(ids):
+                problems.append(f"{linked} patient links for {len(ids)} appointments")
+            phones = [patient["phone"] for patient in assistant.patients.values()]
+            if len(set(phones)) != len(phones):
+                problems.append("two patients registered with the same phone")
+            if len(assistant.patient_index) != len(assistant.patients):
+                problems.append(f"patient index holds {len(assistant.patient_index)} of {len(assistant.patients)} patients")
+            for patient_id, patient in assistant.patients.items():
+                if patient_id not in assistant.patient_index.by_phone(patient["phone"]):
+                    problems.append(f"patient {patient_id} not found by phone")
+            problems += [f"analytics: {problem}" for problem in assistant.verify_analytics()]
+            for patient_id in assistant.patients:
+                cached = assistant.render_cache.get(patient_id, "history", lambda: assistant.render_history(patient_id))
+                if cached != assistant.render_history(patient_id):
+                    problems.append(f"stale history view of patient {patient_id}")
+            problems += self.check_replay({key: (app["date"], app["time"], app["status"])
+                                           for key, app in assistant.appointments.items()})
+        return problems
+
+    def record_changes(self) -> None:
+        """Subscribe to the change log, so long runs are checked even after the ring buffer wraps"""
+        self.events: List = []
+        self.recorder = change_log.subscribe(CallbackSink(self.events.extend), name=f"harness-{self.name}")
+
+    def check_replay(self, actual: Dict) -> List[str]:
+        """Rebuild appointments from this target's change events and compare"""
+        change_log.unsubscribe(self.recorder)
+        if self.recorder.missed:
+            return [f"change log subscriber missed {self.recorder.missed} events"]
+        replayed = {}
+        for event in self.events:
+            if event.source == self.source and event.entity == "appointment":
+                if event.before:
+                    replayed.pop(self.replay_key(event.before), None)
+                if event.after:
+                    replayed[event.key] = self.replay_value(event.after)
+        if replayed != actual:
+            return [f"change events replay to {len(replayed)} appointments, store has {len(actual)}"]
+        return []
+
+    def replay_key(self, before: Dict):
+        return before["id"]
+
+    def replay_value(self, after: Dict):
+        return after["date"], after["time"], after["status"]
+
+
+class ClinicTarget(DentalAssistantTarget):
+    name = "clinic"
+    chairs = 2
+
+    def __init__(self):
+        from tenancy import ClinicConfig, ClinicShard
+        self.directory = tempfile.mkdtemp(prefix="harness-clinic-")
+        config = ClinicConfig("harness", copy.deepcopy(dental_assistant.DEFAULT_PRACTICE_INFO), chairs=self.chairs)
+        self.shard = ClinicShard(config, self.directory)
+        self.assistant = self.shard.records
+        self.source = self.assistant.change_source
+        self.record_changes()
+
+    def check(self) -> List[str]:
+        problems = super().check()
+        assistant, slots = self.assistant, self.shard.slots
+        with assistant._lock:
+            scheduled = {key: assistant._interval(app["date"], app["time"], app["service"])
+                         for key, app in assistant.appointments.items() if app["status"] == "scheduled"}
+            indexed = {key: (day, interval[0], interval[1]) for key, (day, interval) in slots._where.items()}
+            if indexed != scheduled:
+                problems.append(f"slot index holds {len(indexed)} intervals for {len(scheduled)} scheduled appointments")
+            # The most chairs in use at once is reached at the start of some appointment
+            for key, (day, start, _) in scheduled.items():
+                in_chair = sum(1 for other_day, other_start, other_end in scheduled.values()
+                               if other_day == day and other_start <= start < other_end)
+                if in_chair > self.chairs:
+                    problems.append(f"{in_chair} appointments in progress at the start of appointment {key} "
+                                    f"with {self.chairs} chairs")
+        self.shard.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return problems
+
+
+class ResponsesTarget(DentalAssistantTarget):
+    name = "responses"
+    source = "responses"
+
+    def __init__(self):
+        self.assistant = dental_assistant_responsesApi.DentalAssistant()
+        self.record_changes()
+
+    def appointment_ids(self) -> List:
+        with self.assistant._lock:
+            return sorted(self.assistant.appointments)
+
+    def apply(self, op: Tuple) -> str:
+        assistant = self.assistant
+        if op[0] == "book":
+            name, phone, _ = PATIENTS[op[1]]
+            result = assistant.book_appointment({"name": name, "phone": phone, "email": ""}, SERVICES[op[2]],
+                                                DAYS[op[3]].isoformat(), TIMES[op[4]])
+            return "ok" if result else "rejected"
+        if op[0] == "history":
+            return self.history(*PATIENTS[op[1]][:2])
+        ids = self.appointment_ids()
+        if not ids:
+            return "noop"
+        appointment_id = ids[op[1] % len(ids)]
+        if op[0] == "cancel":
+            return "ok" if assistant.cancel_appointment(appointment_id) else "rejected"
+        result = assistant.reschedule_appointment(appointment_id, DAYS[op[2]].isoformat(), TIMES[op[3]])
+        return "ok" if result else "rejected"
+
+    def history(self, name: str, phone: str) -> str:
+        return "ok" if self.assistant.render_appointment_history(name) else "noop"
+
+    def check(self) -> List[str]:
+        assistant = self.assistant
+        problems = []
+        with assistant._lock:
+            for key, appointment in assistant.appointments.items():
+                expected = f"{appointment['date']}-{appointment['time']}-{appointment['patient']['name']}"
+                if key != expected:
+                    problems.append(f"appointment {key} stored under the wrong id, expected {expected}")
+                if appointment["patient"]["name"] not in assistant.patients:
+                    problems.append(f"appointment {key} belongs to an unregistered patient")
+            if len(assistant.patient_index) != len(assistant.patients):
+                problems.append(f"patient index holds {len(assistant.patient_index)} of {len(assistant.patients)} patients")
+            problems += [f"analytics: {problem}" for problem in assistant.verify_analytics()]
+            for name in assistant.patients:
+                if assistant.render_appointment_history(name) != assistant.appointment_table(name):
+                    problems.append(f"stale history view of {name}")
+            problems += self.check_replay({key: (app["date"], app["time"], app["status"])
+                                           for key, app in assistant.appointments.items()})
+        return problems
+
+    def replay_key(self, before: Dict):
+        return f"{before['date']}-{before['time']}-{before['patient']['name']}"
+
+
+class MultiAgentTarget(DentalAssistantTarget):
+    name = "multi_agent"
+    source = "multi_agent"
+
+    def __init__(self):
+        self.store = SchedulingStore()
+        agentSDK_multiAgent.use_store(self.store)
+        agentSDK_multiAgent.conversation_state.reset()
+        self.lock = threading.Lock()
+        self.booked: List[Tuple[str, str, str]] = []  # (name, date, time) as booked; may be stale
+        self.record_changes()
+
+    def apply(self, op: Tuple) -> str:
+        tools = agentSDK_multiAgent
+        if op[0] == "book":
+            name, phone, _ = PATIENTS[op[1]]
+            tools.add_patient(name, phone, f"{phone}@example.com")
+            result = tools.add_appointment(DAYS[op[3]].isoformat(), TIMES[op[4]], name, False)
+            if "booked" not in result:
+                return "rejected"
+            with self.lock:
+                self.booked.append((name, DAYS[op[3]].isoformat(), TIMES[op[4]]))
+            return "ok"
+        if op[0] == "history":
+            return self.history(*PATIENTS[op[1]][:2])
+        with self.lock:
+            if not self.booked:
+                return "noop"
+            name, day, at = self.booked[op[1] % len(self.booked)]
+        if op[0] == "cancel":
+            result = tools.cancel_appointment(name, day, at)
+            ok = "cancelled" in result
+        else:
+            result = tools.reschedule_appointment(name, day, at, DAYS[op[2]].isoformat(), TIMES[op[3]])
+            ok = "rescheduled from" in result
+            if ok:
+                with self.lock:
+                    self.booked.append((name, DAYS[op[2]].isoformat(), TIMES[op[3]]))
+        return "ok" if ok else "rejected"
+
+    def history(self, name: str, phone: str) -> str:
+        return "noop" if agentSDK_multiAgent.check_appointments(name).startswith("No appointments") else "ok"
+
+    def check(self) -> List[str]:
+        problems = []
+        actual = {}
+        with self.lock:
+            names = {name for name, _, _ in PATIENTS} | {name for name, _, _ in self.booked}
+        for name in names:
+            appointments = self.store.get_appointments(name)
+            times = [appt.datetime for appt in appointments]
+            if len(set(times)) != len(times):
+                problems.append(f"{name} is double-booked")
+            if self.store.appointments_table(name) != self.store._render_appointments(name):
+                problems.append(f"stale appointments view of {name}")
+            actual.update({agentSDK_multiAgent.reminder_key(name, appt.datetime): appt.datetime.isoformat()
+                           for appt in appointments})
+        patients, appointments = self.store.counts()
+        if appointments != len(actual):
+            problems.append(f"store counts {appointments} appointments, lists {len(actual)}")
+        return problems + self.check_replay(actual)
+
+    def replay_key(self, before: Dict):
+        return agentSDK_multiAgent.reminder_key(before["patient_name"], before["datetime"])
+
+    def replay_value(self, after: Dict):
+        return after["datetime"].isoformat() if hasattr(after["datetime"], "isoformat") else after["datetime"]
+
+
+TARGETS = {target.name: target for target in (DentalAssistantTarget, ClinicTarget, ResponsesTarget, MultiAgentTarget)}
+
+
+def run_sequence(target_class, ops: List[Tuple], threads: int) -> List[str]:
+    """Apply `ops` round-robin from `threads` threads started together, then check the invariants"""
+    target = target_class()
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def worker(share):
+        barrier.wait()
+        for op in share:
+            try:
+                target.apply(op)
+            except Exception as e:
+                errors.append(f"{op} raised {type(e).__name__}: {e}")
+
+    workers = [threading.Thread(target=worker, args=(ops[i::threads],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return errors + target.check()
+
+
+def check_properties(target_name: str, examples: int, threads: int, seed: int) -> bool:
+    target_class = TARGETS[target_name]
+    try:
+        from hypothesis import given, settings, HealthCheck, strategies as st
+    except ImportError:
+        rng = random.Random(seed)
+        for example in range(examples):
+            ops = random_ops(rng, rng.randint(1, 60))
+            problems = run_sequence(target_class, ops, threads)
+            if problems:
+                print(f"FAIL {target_name} (example {example}, seed {seed}):\n  " + "\n  ".join(problems[:10]))
+                print(f"  ops: {ops}")
+                return False
+        print(f"ok   {target_name}: {examples} random sequences, {threads} threads (install hypothesis to shrink failures)")
+        return True
+
+    @settings(max_examples=examples, deadline=None, database=None, derandomize=True,
+              suppress_health_check=list(HealthCheck))
+    @given(st.lists(op_strategy(), min_size=1, max_size=60))
+    def invariants_hold(ops):
+        problems = run_sequence(target_class, ops, threads)
+        assert not problems, "\n  ".join(problems[:10])
+
+    try:
+        invariants_hold()
+    except AssertionError as e:
+        print(f"FAIL {target_name}:\n  {e}")
+        return False
+    print(f"ok   {target_name}: {examples} Hypothesis sequences, {threads} threads")
+    return True
+
+
+# Fake model backend
+
+class FakeModel:
+    """
+    Stand-in for the OpenAI APIs with a fixed latency plus jitter
+
+    Serves openai.ChatCompletion.create (dental_assistant.py) and
+    client.responses.create (dental_assistant_responsesApi.py). Answers are
+    canned text, except that a Responses request with tools whose last line
+    is "book <service> on <YYYY-MM-DD> at <HH:MM> for <name>, phone <phone>"
+    gets a book_appointment tool call, so tool turns make two model calls as
+    they do in production. Chat completions with stream=True arrive a word at
+    a time, `token_latency` apart, after the usual latency to the first one.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, seed: int = 0, token_latency: float = 0.01):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.ChatCompletion = SimpleNamespace(create=self.chat_completion)
+        self.responses = SimpleNamespace(create=self.responses_create)
+
+    def _wait(self) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+
+    def chat_completion(self, model, messages, stream=False, **kwargs):
+        self._wait()
+        if stream:
+            return self.stream_words(self.answer(model))
+        # openai<1.0 returned dicts that also allow attribute access
+        return _AttrDict(choices=[_AttrDict(message=_AttrDict(role="assistant", content=self.answer(model)))],
+                         usage=_AttrDict(prompt_tokens=200, completion_tokens=30, total_tokens=230))
+
+    def responses_create(self, model, input, tools=None, **kwargs):
+        self._wait()
+        usage = SimpleNamespace(input_tokens=300, output_tokens=40, total_tokens=340)
+        request = input.rsplit("\n", 1)[-1]
+        arguments = self.booking_arguments(request) if tools else None
+        if arguments:
+            output = [SimpleNamespace(type="function_call", name="book_appointment", arguments=json.dumps(arguments))]
+            return SimpleNamespace(id=f"resp_{self.calls}", output=output, output_text="", usage=usage)
+        text = self.answer(model)
+        output = [SimpleNamespace(type="message", content=[SimpleNamespace(text=text)])]
+        return SimpleNamespace(id=f"resp_{self.calls}", output=output, output_text=text, usage=usage)
+
+    def stream_words(self, text: str):
+        for i, word in enumerate(text.split(" ")):
+            if i:
+                time.sleep(self.token_latency)
+            yield _AttrDict(choices=[_AttrDict(delta=_AttrDict(content=word if i == 0 else " " + word))])
+
+    @staticmethod
+    def answer(model) -> str:
+        return "We're open Monday to Friday, 9:00 AM to 6:00 PM. Is there anything else I can help with?"
+
+    @staticmethod
+    def booking_arguments(request: str) -> Optional[Dict]:
+        words = request.replace(",", "").split()
+        if len(words) < 10 or words[0] != "book" or "for" not in words or "phone" not in words:
+            return None
+        on, at, for_, phone = words.index("on"), words.index("at"), words.index("for"), words.index("phone")
+        return {"service": " ".join(words[1:on]), "date": words[on + 1], "time": words[at + 1],
+                "name": " ".join(words[for_ + 1:phone]), "phone": words[phone + 1], "email": ""}
+
+
+class _AttrDict(dict):
+    """The legacy openai response objects: a dict whose keys are also attributes"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def install_fake_model(model: FakeModel) -> None:
+    """Route both assistants' model calls to `model`"""
+    dental_assistant.get_openai = lambda: model
+    dental_assistant_responsesApi.get_client = lambda: model
+
+
+# Load
+
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, op: str, seconds: float, outcome: str) -> None:
+        with self._lock:
+            self.latencies[op].append(seconds)
+            self.outcomes[op][outcome] += 1
+
+    def report(self, elapsed: float) -> None:
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"  {total} ops in {elapsed:.1f} s: {total / elapsed:.1f} ops/s")
+        for op in sorted(self.latencies):
+            values = sorted(self.latencies[op])
+            p50, p99 = values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))]
+            outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.outcomes[op].items()))
+            print(f"  {op:10s} {len(values) / elapsed:8.1f} ops/s  p50 {p50 * 1000:7.2f} ms  "
+                  f"p99 {p99 * 1000:7.2f} ms  ({outcomes})")
+
+
+def simulated_patients(count: int) -> List[Tuple[str, str, str]]:
+    """Distinct names (letters only, as the name extractor expects), phones and dates of birth"""
+    patients = []
+    for i in range(count):
+        suffix, n = "", i + 26 * 26
+        while n:
+            suffix = chr(ord("a") + n % 26) + suffix
+            n //= 26
+        patients.append((f"Pat {suffix.capitalize()}", f"555-2{i // 1000:02d}-{i % 1000:04d}",
+                         f"{i % 28 + 1:02d}/{i % 12 + 1:02d}/{1950 + i % 50}"))
+    return patients
+
+
+def run_load(target_name: str, patients: int, seconds: float, threads: int, model: FakeModel, seed: int) -> None:
+    """Each thread plays random patients until time is up; chat turns go through the fake model"""
+    people = simulated_patients(patients)
+    stats = LoadStats()
+    if target_name in ("dental_assistant", "clinic", "responses"):
+        target = TARGETS[target_name]()
+        new_chat = (dental_assistant_responsesApi.DentalAssistant if target_name == "responses"
+                    else dental_assistant.DentalAssistant)
+    else:
+        target, new_chat = MultiAgentTarget(), None
+    deadline = time.monotonic() + seconds
+
+    def play(worker: int):
+        rng = random.Random(seed * 1000 + worker)
+        chats = {}
+        while time.monotonic() < deadline:
+            index = rng.randrange(len(people))
+            name, phone, dob = people[index]
+            kind = rng.choices(["book", "reschedule", "cancel", "history", "chat"], [4, 2, 1, 2, 3 if new_chat else 0])[0]
+            day, at = rng.randrange(len(DAYS)), rng.randrange(len(TIMES))
+            started = time.perf_counter()
+            if kind == "chat":
+                chat = chats.setdefault(index, new_chat())
+                if target_name == "responses" and rng.random() < 0.5:
+                    message = (f"book {rng.choice(SERVICES)} on {DAYS[day].isoformat()} at {TIMES[at]} "
+                               f"for {name}, phone {phone}")
+                else:
+                    message = "What are your opening hours?"
+                chat.generate_response(message)
+                outcome = "answered"
+            elif kind == "book":
+                if target_name == "multi_agent":
+                    agentSDK_multiAgent.add_patient(name, phone, f"{phone}@example.com")
+                    result = agentSDK_multiAgent.add_appointment(DAYS[day].isoformat(), TIMES[at], name, False)
+                    with target.lock:
+                        target.booked.append((name, DAYS[day].isoformat(), TIMES[at]))
+                    outcome = "ok" if "booked" in result else "rejected"
+                elif target_name == "responses":
+                    result = target.assistant.book_appointment({"name": name, "phone": phone, "email": ""},
+                                                               rng.choice(SERVICES), DAYS[day].isoformat(), TIMES[at])
+                    outcome = "ok" if result else "rejected"
+                else:
+                    result = target.assistant.book_flow(phone, name, f"{phone}@example.com", dob, rng.choice(SERVICES),
+                                                        DAYS[day].strftime("%d/%m/%Y"), TIMES[at])
+                    outcome = "ok" if result.ok else "rejected"
+            elif kind == "cancel":
+                outcome = target.apply(("cancel", rng.randrange(1000)))
+            elif kind == "history":
+                outcome = target.history(name, phone)
+            else:
+                outcome = target.apply(("reschedule", rng.randrange(1000), day, at))
+            stats.record(kind, time.perf_counter() - started, outcome)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=play, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{target_name}: {patients} patients, {threads} threads, fake model {model.latency * 1000:.0f} ms")
+    stats.report(elapsed)
+    problems = target.check()
+    print("  invariants: " + ("ok" if not problems else "FAILED\n    " + "\n    ".join(problems[:10])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["properties", "load"])
+    parser.add_argument("--target", default="all", choices=["all", *TARGETS])
+    parser.add_argument("--examples", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency in seconds")
+    args = parser.parse_args()
+    targets = list(TARGETS) if args.target == "all" else [args.target]
+
+    if args.mode == "properties":
+        ok = all([check_properties(name, args.examples, args.threads or 4, args.seed) for name in targets])
+        return 0 if ok else 1
+    model = FakeModel(args.latency, seed=args.seed)
+    install_fake_model(model)
+    for name in targets:
+        run_load(name, args.patients, args.seconds, args.threads or 8, model, args.seed)
+    print(f"fake model calls: {model.calls}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
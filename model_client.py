@@ -0,0 +1,354 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Optional, Sequence
+
+# Per-attempt deadline in seconds
+DEFAULT_DEADLINE = float(os.getenv("DENTAL_MODEL_DEADLINE", "30"))
+DEFAULT_RETRIES = 3
+BASE_DELAY = 0.5
+MAX_DELAY = 8.0
+
+# A duplicate request is sent when the first one is slower than this latency percentile
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+
+# Consecutive failures that open a model's circuit, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+RETRYABLE_STATUS = {408, 409, 429}
+# Names cover both the current openai client and the legacy openai.error module
+RETRYABLE_ERRORS = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "ServiceUnavailableError", "Timeout", "TryAgain", "TimeoutError",
+}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for rate limits, timeouts, connection problems and 5xx responses"""
+    status = getattr(exc, "status_code", None) or getattr(exc, "http_status", None)
+    if status is not None and (status in RETRYABLE_STATUS or status >= 500):
+        return True
+    return type(exc).__name__ in RETRYABLE_ERRORS
+
+
+def backoff_delay(attempt: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class ModelUnavailable(Exception):
+    """Raised when every model failed or had its circuit open and there is no degraded path"""
+
+
+class LatencyTracker:
+    """Rolling window of call latencies"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Stops calling a model after repeated failures, then lets one probe through"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_in_flight = False  # The one probe allowed while half-open has been handed out
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """True if the caller may call the model; while half-open only the first caller gets to probe"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self.half_open_in_flight:
+                return False
+            self.half_open_in_flight = True
+            return True
+
+    def release(self) -> None:
+        """The probe ended without telling us whether the model is up; let the next caller probe"""
+        with self._lock:
+            self.half_open_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.half_open_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure opened the circuit"""
+        with self._lock:
+            self.failures += 1
+            self.half_open_in_flight = False
+            if self.opened_at is not None:
+                # A failed half-open probe keeps the circuit open for another period
+                self.opened_at = time.monotonic()
+                return False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+@dataclass
+class CallMetrics:
+    calls: int = 0
+    successes: int = 0
+    retries: int = 0
+    timeouts: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    breaker_opens: int = 0
+    breaker_skips: int = 0
+    failovers: int = 0
+    degraded: int = 0
+    failures: int = 0
+
+
+class ResilientClient:
+    """
+    Shared model-call layer
+
+    `call` (threads) and `acall` (asyncio) take a function of the model name,
+    so the same policy wraps openai.ChatCompletion.create, client.responses.create
+    and Runner.run. Each model is retried with jittered backoff under a
+    per-attempt deadline, hedged once it is slower than its p95, and skipped
+    while its circuit is open; the next model in `models` is the failover and
+    `degraded` the last resort.
+    """
+
+    def __init__(self, name: str, retries: int = DEFAULT_RETRIES, deadline: float = DEFAULT_DEADLINE,
+                 hedge: bool = True, max_workers: int = 16):
+        self.name = name
+        self.retries = retries
+        self.deadline = deadline
+        self.hedge = hedge
+        self.metrics = CallMetrics()
+        self._lock = threading.Lock()  # Guards the metrics counters, which every calling thread updates
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-model")
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self.metrics, counter, getattr(self.metrics, counter) + 1)
+
+    def breaker(self, model) -> CircuitBreaker:
+        return self._breakers.setdefault(str(model), CircuitBreaker())
+
+    def latency(self, model) -> LatencyTracker:
+        return self._latency.setdefault(str(model), LatencyTracker())
+
+    def _hedge_after(self, model) -> Optional[float]:
+        return self.latency(model).percentile(HEDGE_PERCENTILE) if self.hedge else None
+
+    def _record_failure(self, model) -> None:
+        if self.breaker(model).record_failure():
+            self._count("breaker_opens")
+
+    def _record_success(self, model, started: float) -> None:
+        self.latency(model).add(time.perf_counter() - started)
+        self.breaker(model).record_success()
+        self._count("successes")
+
+    # Thread-based path, for the blocking OpenAI clients
+
+    def _attempt(self, fn: Callable, model):
+        started = time.perf_counter()
+        first = self._executor.submit(fn, model)
+        pending = {first}
+        hedge_after = self._hedge_after(model)
+        if hedge_after is not None and hedge_after < self.deadline:
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done:
+                self._count("hedges")
+                pending.add(self._executor.submit(fn, model))
+        error = None
+        while pending:
+            remaining = self.deadline - (time.perf_counter() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        self._count("hedge_wins")
+                    self._record_success(model, started)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        # Blocking requests cannot be interrupted; late ones finish in the background
+        for future in pending:
+            future.cancel()
+        if error is None:
+            self._count("timeouts")
+            error = TimeoutError(f"{self.name} call to {model} exceeded {self.deadline}s")
+        raise error
+
+    def call(self, fn: Callable, models: Sequence = (None,), degraded: Optional[Callable] = None):
+        """
+        Call fn(model) with retries, hedging and failover
+
+        Args:
+            fn: Function making one request with the given model name
+            models: Primary model followed by failover models
+            degraded: Called with no arguments when every model fails
+
+        Returns:
+            The first successful result, or the degraded answer
+
+        Raises:
+            ModelUnavailable: If every model failed and there is no degraded path
+            Exception: Non-retryable errors from fn are raised unchanged
+        """
+        self._count("calls")
+        last_error = None
+        for index, model in enumerate(models):
+            if not self.breaker(model).allow():
+                self._count("breaker_skips")
+                continue
+            if index:
+                self._count("failovers")
+            for attempt in range(self.retries + 1):
+                try:
+                    return self._attempt(fn, model)
+                except Exception as e:
+                    # Bad requests and tool errors are not an availability problem
+                    if not is_retryable(e):
+                        self.breaker(model).release()
+                        raise
+                    last_error = e
+                    self._record_failure(model)
+                    if attempt == self.retries or not self.breaker(model).allow():
+                        break
+                    self._count("retries")
+                    time.sleep(backoff_delay(attempt))
+        return self._give_up(last_error, degraded)
+
+    # asyncio path, for Runner.run
+
+    async def _aattempt(self, fn: Callable, model):
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(fn(model))]
+        try:
+            hedge_after = self._hedge_after(model)
+            if hedge_after is not None and hedge_after < self.deadline:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    self._count("hedges")
+                    tasks.append(asyncio.ensure_future(fn(model)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                remaining = self.deadline - (time.perf_counter() - started)
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self._count("hedge_wins")
+                        self._record_success(model, started)
+                        return task.result()
+                    error = task.exception()
+            if error is None:
+                self._count("timeouts")
+                error = TimeoutError(f"{self.name} call to {model} exceeded {self.deadline}s")
+            raise error
+        finally:
+            # The losing request is cancelled rather than left running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def acall(self, fn: Callable, models: Sequence = (None,), degraded: Optional[Callable] = None):
+        """Async version of `call`; fn(model) returns an awaitable"""
+        self._count("calls")
+        last_error = None
+        for index, model in enumerate(models):
+            if not self.breaker(model).allow():
+                self._count("breaker_skips")
+                continue
+            if index:
+                self._count("failovers")
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._aattempt(fn, model)
+                except asyncio.CancelledError:
+                    self.breaker(model).release()
+                    raise
+                except Exception as e:
+                    # Bad requests and tool errors are not an availability problem
+                    if not is_retryable(e):
+                        self.breaker(model).release()
+                        raise
+                    last_error = e
+                    self._record_failure(model)
+                    if attempt == self.retries or not self.breaker(model).allow():
+                        break
+                    self._count("retries")
+                    await asyncio.sleep(backoff_delay(attempt))
+        return self._give_up(last_error, degraded)
+
+    def _give_up(self, error: Optional[Exception], degraded: Optional[Callable]):
+        if degraded is not None:
+            self._count("degraded")
+            return degraded()
+        self._count("failures")
+        raise ModelUnavailable(f"{self.name}: no model available") from error
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return asdict(self.metrics)
+
+    def snapshot(self) -> Dict:
+        """Metrics plus breaker state and p95 latency per model"""
+        return {
+            **self.counters(),
+            "breakers": {model: breaker.state for model, breaker in self._breakers.items()},
+            "p95_seconds": {model: tracker.percentile(0.95) for model, tracker in self._latency.items()},
+        }
+
+
+def degraded_answer(user_input: str, faqs: Dict[str, str], phone: Optional[str] = None) -> str:
+    """Local answer used while no model is reachable"""
+    text = user_input.lower()
+    for topic, answer in faqs.items():
+        if topic in text:
+            return answer
+    contact = f"call us at {phone}" if phone else "call the clinic"
+    return (f"I'm sorry, our assistant is temporarily unavailable. "
+            f"Please try again in a few minutes or {contact}.")
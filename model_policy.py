@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+# All model choices live here. Override a tier with DENTAL_MODEL_SMALL / DENTAL_MODEL_LARGE.
+MODEL_TIERS = {
+    "small": os.getenv("DENTAL_MODEL_SMALL", "gpt-4o-mini"),
+    "large": os.getenv("DENTAL_MODEL_LARGE", "gpt-4o"),
+}
+
+# Model used when the chosen one keeps failing; defaults to the other tier
+FALLBACK_MODEL = os.getenv("DENTAL_MODEL_FALLBACK")
+
+# Default tier for each agent or assistant call site
+AGENT_TIERS = {
+    # agentSDK_multiAgent.py
+    "Dental Assistant": "small",
+    "FAQ Agent": "small",
+    "Registration Agent": "small",
+    "Cancellation Agent": "small",
+    "Booking Agent": "large",
+    "Rescheduling Agent": "large",
+    # dental_assistant.py
+    "Front Desk Chat": "small",
+    # dental_assistant_responsesApi.py
+    "Responses Assistant": "small",
+    "Responses Follow-up": "small",
+    # batch_jobs.py
+    "Batch Jobs": "small",
+}
+
+# Below this confidence a turn is escalated to the large tier
+ESCALATION_CONFIDENCE = 0.6
+
+# JSON lines log of every choice and call, for offline cost/latency analysis
+MODEL_LOG_PATH = os.getenv("DENTAL_MODEL_LOG")
+
+
+@dataclass
+class ModelChoice:
+    agent: str
+    tier: str
+    model: str
+    reason: str
+    escalated: bool = False  # Moved up from the agent's default tier for this call
+
+
+class ModelPolicy:
+    """Picks the model for each agent and turn, escalating when a small model struggles."""
+
+    def __init__(self, tiers: Dict[str, str] = MODEL_TIERS, agent_tiers: Dict[str, str] = AGENT_TIERS,
+                 log_path: Optional[str] = MODEL_LOG_PATH):
+        self.tiers = dict(tiers)
+        self.agent_tiers = dict(agent_tiers)
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def select(self, agent: str, confidence: Optional[float] = None, escalate: bool = False,
+               reason: str = "") -> ModelChoice:
+        """
+        Choose the model for one call
+
+        Args:
+            agent: Agent or call-site name, a key of AGENT_TIERS
+            confidence: Optional confidence in the cheap path, 0..1
+            escalate: Force the large tier, e.g. after invalid tool arguments
+            reason: Why the caller escalated, recorded in the log
+        """
+        default = tier = self.agent_tiers.get(agent, "large")
+        if escalate:
+            tier, reason = "large", reason or "escalated"
+        elif confidence is not None and confidence < ESCALATION_CONFIDENCE:
+            tier, reason = "large", f"low confidence {confidence:.2f}"
+        choice = ModelChoice(agent, tier, self.tiers[tier], reason or "default", tier != default)
+        self.log("select", **asdict(choice))
+        return choice
+
+    def fallback_model(self, choice: Optional[ModelChoice] = None) -> str:
+        """Failover model for a choice, or for agent runs that mix tiers"""
+        if FALLBACK_MODEL:
+            return FALLBACK_MODEL
+        if choice is None:
+            return self.tiers["small"]
+        return self.tiers["small" if choice.tier == "large" else "large"]
+
+    def record_call(self, choice: ModelChoice, started: float, usage=None, ok: bool = True) -> None:
+        """Log latency and token usage of a finished call"""
+        self.log(
+            "call", **asdict(choice), ok=ok,
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            input_tokens=getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None),
+            output_tokens=getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", None),
+        )
+
+    def log(self, event: str, **fields) -> None:
+        if not self.log_path:
+            return
+        line = json.dumps({"ts": time.time(), "event": event, **fields}, default=str)
+        with self._lock, open(self.log_path, "a") as f:
+            f.write(line + "\n")
+
+
+# Shared by all three assistants
+model_policy = ModelPolicy()
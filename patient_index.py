@@ -0,0 +1,333 @@
+"""
+Fuzzy patient identity index
+
+Finds registered patients from a possibly misspelt name ("Jon Smith" for
+"John Smith", "Smith, John"), a phone number in any format and a date of
+birth. Candidates come from three small indexes instead of a scan:
+
+    trigrams   character trigrams of the normalized name, rarest first
+    phonetic   Soundex code of every name token, order-independent
+    phone/dob  exact normalized values
+
+and only the best few dozen candidates are scored with edit distance, so a
+lookup over 100k patients takes a few milliseconds. Run this module to measure it:
+
+    python patient_index.py [patients]
+"""
+import re
+import sys
+import time
+import random
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Set
+
+from profiling import profiled
+
+# Score weights of the fields given in a query
+NAME_WEIGHT = 0.6
+PHONE_WEIGHT = 0.25
+DOB_WEIGHT = 0.15
+
+# Names at least this similar are the same person when the phone or date of birth agrees
+SAME_PERSON_NAME = 0.8
+# Close names offered for the patient to confirm when a name resolves to nobody
+CANDIDATE_NAME = 0.7
+
+# Only the names sharing the most trigrams with the query are scored
+TRIGRAM_CANDIDATES = 50
+# Trigrams in more than this share of names ("jo", "an") are skipped once
+# MIN_TRIGRAMS rarer ones have been counted; they pick out nobody
+COMMON_TRIGRAM = 0.02
+MIN_TRIGRAMS = 3
+# Counted as this many shared trigrams when the phonetic keys agree
+PHONETIC_BONUS = 2
+
+TITLES = {"mr", "mrs", "ms", "miss", "dr", "prof"}
+_SOUNDEX = {letter: digit for digit, letters in
+            {"1": "bfpv", "2": "cgjkqsxz", "3": "dt", "4": "l", "5": "mn", "6": "r"}.items()
+            for letter in letters}
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, without punctuation, titles or repeated spaces; "Smith, John" stays word-swapped"""
+    tokens = re.sub(r"[^a-z\s]", " ", name.lower().replace("'", "")).split()
+    return " ".join(token for token in tokens if token not in TITLES)
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """The last ten digits, so "+1 (555) 123-4567" and "5551234567" agree"""
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:] or None
+
+
+def normalize_dob(dob: Optional[str]) -> Optional[str]:
+    """ISO date from DD/MM/YYYY or YYYY-MM-DD; anything else is kept as given"""
+    if not dob:
+        return None
+    for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(dob.strip(), fmt).date().isoformat()
+        except ValueError:
+            pass
+    return dob.strip()
+
+
+def soundex(word: str) -> str:
+    """American Soundex code of one word: "Jon" and "John" are both J500"""
+    word = re.sub(r"[^a-z]", "", word.lower())
+    if not word:
+        return ""
+    code, last = word[0].upper(), _SOUNDEX.get(word[0])
+    for letter in word[1:]:
+        digit = _SOUNDEX.get(letter)
+        if digit and digit != last:
+            code += digit
+        if letter not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def phonetic_key(normalized: str) -> str:
+    return " ".join(sorted(soundex(token) for token in normalized.split()))
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance, bit-parallel (Myers/Hyyro): one pass of integer operations per character of b"""
+    if not a:
+        return len(b)
+    mask, high = (1 << len(a)) - 1, 1 << (len(a) - 1)
+    peq: Dict[str, int] = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    pv, mv, distance = mask, 0, len(a)
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            distance += 1
+        elif mh & high:
+            distance -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return distance
+
+
+def name_similarity(a: str, b: str) -> float:
+    """1.0 for the same normalized name, in any word order; 0.0 for nothing in common"""
+    if a == b:
+        return 1.0
+    longest = max(len(a), len(b)) or 1
+    similarity = 1 - edit_distance(a, b) / longest
+    sorted_a, sorted_b = " ".join(sorted(a.split())), " ".join(sorted(b.split()))
+    if (sorted_a, sorted_b) != (a, b):
+        similarity = max(similarity, 1 - edit_distance(sorted_a, sorted_b) / longest)
+    return similarity
+
+
+@dataclass
+class Match:
+    patient_id: Hashable
+    score: float
+    name_similarity: float
+    phone_match: Optional[bool]  # None when the query or the patient has no phone to compare
+    dob_match: Optional[bool]
+
+
+@dataclass
+class _Entry:
+    name: str
+    phone: Optional[str]
+    dob: Optional[str]
+
+
+class PatientIndex:
+    """
+    Name, phone and date-of-birth index over one practice's patients
+
+    Not thread-safe on its own; callers update it under the same lock as the
+    patient records it mirrors.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._phonetic: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._trigrams: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._phones: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._dobs: Dict[str, Set[Hashable]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, patient_id) -> bool:
+        return patient_id in self._entries
+
+    def add(self, patient_id: Hashable, name: str, phone: Optional[str] = None, dob: Optional[str] = None) -> None:
+        """Index a patient, replacing what was indexed under the same id"""
+        self.remove(patient_id)
+        entry = _Entry(normalize_name(name), normalize_phone(phone), normalize_dob(dob))
+        self._entries[patient_id] = entry
+        self._phonetic[phonetic_key(entry.name)].add(patient_id)
+        for gram in trigrams(entry.name):
+            self._trigrams[gram].add(patient_id)
+        if entry.phone:
+            self._phones[entry.phone].add(patient_id)
+        if entry.dob:
+            self._dobs[entry.dob].add(patient_id)
+
+    def remove(self, patient_id: Hashable) -> None:
+        entry = self._entries.pop(patient_id, None)
+        if entry is None:
+            return
+        self._phonetic[phonetic_key(entry.name)].discard(patient_id)
+        for gram in trigrams(entry.name):
+            self._trigrams[gram].discard(patient_id)
+        if entry.phone:
+            self._phones[entry.phone].discard(patient_id)
+        if entry.dob:
+            self._dobs[entry.dob].discard(patient_id)
+
+    def by_phone(self, phone: str) -> List[Hashable]:
+        """Patients registered with exactly this phone number"""
+        phone = normalize_phone(phone)
+        return sorted(self._phones.get(phone, ()), key=str) if phone else []
+
+    def _candidates(self, name: Optional[str], phone: Optional[str], dob: Optional[str]) -> Set[Hashable]:
+        candidates = set()
+        if phone:
+            candidates |= self._phones.get(phone, set())
+        if dob:
+            candidates |= self._dobs.get(dob, set())
+        if name:
+            shared = Counter()
+            common = max(100, int(len(self._entries) * COMMON_TRIGRAM))
+            postings = sorted((self._trigrams[gram] for gram in trigrams(name) if self._trigrams.get(gram)), key=len)
+            for counted, posting in enumerate(postings):
+                if len(posting) > common and counted >= MIN_TRIGRAMS:
+                    break
+                shared.update(posting)
+            for patient_id in self._phonetic.get(phonetic_key(name), ()):
+                shared[patient_id] += PHONETIC_BONUS
+            candidates.update(patient_id for patient_id, _ in shared.most_common(TRIGRAM_CANDIDATES))
+        return candidates
+
+    @profiled("patient_index.search")
+    def search(self, name: Optional[str] = None, phone: Optional[str] = None, dob: Optional[str] = None,
+               limit: int = 5) -> List[Match]:
+        """Best-scoring patients for whatever details are known, best first"""
+        name, phone, dob = normalize_name(name) if name else None, normalize_phone(phone), normalize_dob(dob)
+        matches = []
+        for patient_id in self._candidates(name, phone, dob):
+            entry = self._entries[patient_id]
+            similarity = name_similarity(name, entry.name) if name else 0.0
+            phone_match = (phone == entry.phone) if phone and entry.phone else None
+            dob_match = (dob == entry.dob) if dob and entry.dob else None
+            score, weight = 0.0, 0.0
+            for given, matched, field_weight in ((name, similarity, NAME_WEIGHT),
+                                                 (phone_match is not None, phone_match, PHONE_WEIGHT),
+                                                 (dob_match is not None, dob_match, DOB_WEIGHT)):
+                if given:
+                    score += field_weight * float(matched)
+                    weight += field_weight
+            matches.append(Match(patient_id, score / weight if weight else 0.0, similarity, phone_match, dob_match))
+        matches.sort(key=lambda match: (-match.score, -match.name_similarity, str(match.patient_id)))
+        return matches[:limit]
+
+    def find_duplicate(self, name: str, phone: Optional[str] = None, dob: Optional[str] = None) -> Optional[Match]:
+        """
+        The registered patient these details most likely belong to
+
+        A similar name counts only when the phone or date of birth agrees;
+        the exact same name counts unless the phone or date of birth differs.
+        """
+        for match in self.search(name, phone, dob):
+            if match.phone_match is False and match.dob_match is not True:
+                continue
+            if match.name_similarity >= SAME_PERSON_NAME and (match.phone_match or match.dob_match):
+                return match
+            if match.name_similarity == 1.0 and match.dob_match is not False:
+                return match
+        return None
+
+    def resolve(self, name: str, phone: Optional[str] = None, dob: Optional[str] = None) -> Optional[Hashable]:
+        """
+        The one patient these details refer to, or None
+
+        The exact name (in any word order) resolves when nobody else has it;
+        a misspelt one only when the phone number or date of birth agrees,
+        so "Joan Smith" is never taken for "John Smith". candidates() lists
+        the close names for the patient to confirm instead.
+        """
+        matches = [match for match in self.search(name, phone, dob)
+                   if match.phone_match is not False and match.dob_match is not False]
+        confirmed = [match for match in matches
+                     if match.name_similarity >= SAME_PERSON_NAME and (match.phone_match or match.dob_match)]
+        exact = [match for match in (confirmed or matches) if match.name_similarity == 1.0]
+        if len(confirmed) == 1:
+            return confirmed[0].patient_id
+        # Two "John Smith"s: only one of them can be the exact name plus a matching phone
+        return exact[0].patient_id if len(exact) == 1 else None
+
+    def candidates(self, name: str, limit: int = 3) -> List[Hashable]:
+        """Patients whose names are close to this one, best first, for the patient to pick from"""
+        return [match.patient_id for match in self.search(name, limit=limit) if match.name_similarity >= CANDIDATE_NAME]
+
+
+# Benchmark over generated patients
+
+FIRST = ["John", "Jane", "Michael", "Sarah", "David", "Emily", "Robert", "Maria", "James", "Linda", "Ahmed",
+         "Priya", "Wei", "Olga", "Carlos", "Fatima", "Noah", "Grace", "Liam", "Chloe"]
+LAST = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+        "Nguyen", "Patel", "Kowalski", "Schmidt", "Okafor", "Tanaka", "Rossi", "Novak", "Dubois", "Larsen"]
+
+
+def _typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(1, len(name))
+    return name[:i] + name[i + 1:] if rng.random() < 0.5 else name[:i] + name[i - 1] + name[i:]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(42)
+    index = PatientIndex()
+    people = []
+    started = time.perf_counter()
+    for i in range(count):
+        # A numeric-free suffix keeps names distinct the way real surnames are
+        name = f"{rng.choice(FIRST)} {rng.choice(LAST)}{''.join(rng.choice('aeiourstln') for _ in range(3))}"
+        phone = f"555{i:07d}"
+        dob = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1940, 2015)}"
+        index.add(i, name, phone, dob)
+        people.append((name, phone, dob))
+    print(f"Indexed {count} patients in {time.perf_counter() - started:.2f} s")
+
+    for label, query in (("typo in name", lambda n, p, d: dict(name=_typo(n, rng))),
+                         ("typo + phone", lambda n, p, d: dict(name=_typo(n, rng), phone=p)),
+                         ("typo + dob", lambda n, p, d: dict(name=_typo(n, rng), dob=d))):
+        timings, hits, listed = [], 0, 0
+        for _ in range(200):
+            patient_id = rng.randrange(count)
+            started = time.perf_counter()
+            matches = index.search(**query(*people[patient_id]))
+            timings.append((time.perf_counter() - started) * 1000)
+            hits += bool(matches) and matches[0].patient_id == patient_id
+            listed += any(match.patient_id == patient_id for match in matches)
+        timings.sort()
+        print(f"{label:14s} p50 {timings[len(timings) // 2]:6.2f} ms  p99 {timings[int(len(timings) * 0.99)]:6.2f} ms  "
+              f"top-1 {hits / len(timings):.0%}  top-5 {listed / len(timings):.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,498 @@
+"""
+Retrieval over clinic policy documents
+
+    python policy_index.py index [docs_dir]
+    python policy_index.py search "can I cancel the day before?" [-k 3]
+
+Markdown, text and PDF files under POLICY_DOCS are split along headings and
+paragraphs into chunks of about CHUNK_WORDS words, each keeping its heading
+path ("cancellations.md > Late cancellations"). Every document becomes one
+segment file in the index directory:
+
+    header    JSON: source, chunk headings and lengths, term -> (first posting, count)
+    postings  uint32 (chunk, term frequency) pairs, grouped by term
+    text      UTF-8 chunk texts
+
+Segments are memory-mapped. Only the headers are read into memory; postings
+and texts are paged in when a query touches them. refresh() re-indexes only
+the files whose size or mtime, and then content hash, changed, and drops
+the segments of deleted files; search() calls it at most every
+REFRESH_SECONDS, so edited documents are picked up without a restart.
+
+Chunks are ranked with BM25. With DENTAL_POLICY_EMBED_MODEL set (pip install
+sentence-transformers) chunks are also embedded on the CPU, the vectors are
+memory-mapped beside each segment, and the BM25 and embedding rankings are
+merged by reciprocal rank fusion. Assistants put the top TOP_K chunks for
+the patient's message into the prompt, at most MAX_CONTEXT_CHARS of them, so
+the prompt stays the same size however many documents the clinic has.
+"""
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import heapq
+import struct
+import hashlib
+import argparse
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from profiling import profiled
+
+POLICY_DOCS = os.getenv("DENTAL_POLICY_DOCS", "policies")
+POLICY_INDEX = os.getenv("DENTAL_POLICY_INDEX", ".policy_index")
+EMBED_MODEL = os.getenv("DENTAL_POLICY_EMBED_MODEL")  # e.g. "sentence-transformers/all-MiniLM-L6-v2"; unset for BM25 only
+TOP_K = int(os.getenv("DENTAL_POLICY_TOP_K", "3"))
+MAX_CONTEXT_CHARS = int(os.getenv("DENTAL_POLICY_MAX_CHARS", "2400"))  # Excerpt text per prompt, ~600 tokens
+REFRESH_SECONDS = float(os.getenv("DENTAL_POLICY_REFRESH", "30"))  # How often search() looks for changed files
+
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30  # Words repeated between pieces of one long paragraph
+DOCUMENT_TYPES = (".md", ".markdown", ".txt", ".pdf")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Reciprocal rank fusion constant, and how similar a chunk must be to count as an embedding match
+RRF_K = 60
+MIN_SIMILARITY = 0.3
+
+SEGMENT_MAGIC = b"DPI1"
+INDEX_VERSION = 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "have", "how", "i",
+    "if", "in", "is", "it", "me", "my", "of", "on", "or", "our", "so", "that", "the", "their", "there", "this",
+    "to", "us", "was", "we", "what", "when", "where", "which", "will", "with", "you", "your",
+}
+
+
+def stem(word: str) -> str:
+    """Crude suffix folding, so "cancelled" and "cancel", or "policies" and "policy", are one term"""
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeious":
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(word) for word in TOKEN_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+@dataclass
+class Chunk:
+    heading: str  # "file.md > Section > Subsection"
+    text: str
+
+
+@dataclass
+class Hit:
+    source: str
+    heading: str
+    text: str
+    score: float
+
+
+def read_document(path: str) -> Optional[str]:
+    """The text of a policy document; None for a PDF when pypdf is not installed"""
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print(f"Skipping {path}: indexing PDFs needs pypdf (pip install pypdf)", file=sys.stderr)
+            return None
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def _pieces(paragraph: str) -> Iterator[str]:
+    """A paragraph, or overlapping windows of it when it is much longer than a chunk"""
+    words = paragraph.split()
+    if len(words) <= CHUNK_WORDS * 3 // 2:
+        yield " ".join(words)
+        return
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    for start in range(0, len(words) - CHUNK_OVERLAP, step):
+        yield " ".join(words[start:start + CHUNK_WORDS])
+
+
+def chunk_document(source: str, text: str) -> List[Chunk]:
+    """Split a document into chunks that never cross a heading and hold whole paragraphs where possible"""
+    chunks: List[Chunk] = []
+    headings: List[Tuple[int, str]] = []
+    buffer: List[str] = []
+
+    def flush():
+        if buffer:
+            path = " > ".join([source] + [title for _, title in headings])
+            chunks.append(Chunk(path, "\n".join(buffer)))
+            buffer.clear()
+
+    paragraph: List[str] = []
+    for line in text.splitlines() + [""]:
+        heading = HEADING_RE.match(line)
+        if heading or not line.strip():
+            if paragraph:
+                for piece in _pieces(" ".join(paragraph)):
+                    if buffer and len(" ".join(buffer + [piece]).split()) > CHUNK_WORDS:
+                        flush()
+                    buffer.append(piece)
+                paragraph = []
+            if heading:
+                flush()
+                level = len(heading.group(1))
+                headings = [(depth, title) for depth, title in headings if depth < level] + [(level, heading.group(2))]
+            continue
+        paragraph.append(line.strip())
+    flush()
+    return chunks
+
+
+def _align(offset: int) -> int:
+    return (offset + 3) & ~3
+
+
+def write_segment(path: str, source: str, digest: str, chunks: List[Chunk], embed_model: Optional[str] = None) -> None:
+    """Write one document's chunks, term postings and texts as a segment file"""
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    lengths = []
+    for number, chunk in enumerate(chunks):
+        counts = Counter(tokenize(chunk.heading + " " + chunk.text))
+        lengths.append(sum(counts.values()))
+        for term, frequency in counts.items():
+            postings[term].append((number, frequency))
+    flat = array("I")
+    terms = {}
+    for term in sorted(postings):
+        terms[term] = (len(flat) // 2, len(postings[term]))
+        for pair in postings[term]:
+            flat.extend(pair)
+    texts = [chunk.text.encode("utf-8") for chunk in chunks]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    header = json.dumps({
+        "source": source, "sha1": digest, "embed_model": embed_model,
+        "headings": [chunk.heading for chunk in chunks], "lengths": lengths, "text_offsets": offsets,
+        "postings": len(flat), "terms": terms,
+    }, separators=(",", ":")).encode("utf-8")
+    preamble = SEGMENT_MAGIC + struct.pack("<I", len(header)) + header
+    with open(path + ".tmp", "wb") as f:
+        f.write(preamble + bytes(_align(len(preamble)) - len(preamble)))
+        f.write(flat.tobytes())
+        f.write(b"".join(texts))
+    os.replace(path + ".tmp", path)
+
+
+class Segment:
+    """A memory-mapped segment; postings and texts stay on disk until read"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = struct.unpack_from("<4sI", self._map, 0)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a policy index segment")
+        header = json.loads(self._map[8:8 + header_length])
+        self.source = header["source"]
+        self.sha1 = header["sha1"]
+        self.embed_model = header["embed_model"]
+        self.headings = header["headings"]
+        self.lengths = header["lengths"]
+        self.terms = header["terms"]
+        self._text_offsets = header["text_offsets"]
+        start = _align(8 + header_length)
+        self.postings = memoryview(self._map)[start:start + 4 * header["postings"]].cast("I")
+        self._text_start = start + 4 * header["postings"]
+        self.vectors = None  # (chunks, dimensions) float32, when embedded
+
+    def __len__(self) -> int:
+        return len(self.headings)
+
+    def text(self, chunk: int) -> str:
+        start, end = self._text_offsets[chunk], self._text_offsets[chunk + 1]
+        return self._map[self._text_start + start:self._text_start + end].decode("utf-8")
+
+
+class Embedder:
+    """Sentence embeddings on the CPU, normalized so a dot product is the cosine similarity"""
+
+    def __init__(self, model_name: str):
+        try:
+            import numpy as np
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("Policy embeddings need sentence-transformers: pip install sentence-transformers") from None
+        self.np = np
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts: List[str]):
+        vectors = self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        return self.np.asarray(vectors, dtype="float32")
+
+
+@dataclass
+class _State:
+    """Everything a search reads; replaced whole on refresh so searches never take a lock"""
+    segments: List[Segment]
+    document_frequency: Dict[str, int]
+    where: Dict[str, List[int]]  # term -> segments containing it
+    chunks: int
+    average_length: float
+
+
+class PolicyIndex:
+    """BM25 (and optionally embedding) search over the chunks of a directory of policy documents"""
+
+    def __init__(self, docs_dir: str = POLICY_DOCS, index_dir: str = POLICY_INDEX,
+                 embed_model: Optional[str] = EMBED_MODEL):
+        self.docs_dir = docs_dir
+        self.index_dir = index_dir
+        self.embed_model = embed_model
+        self._embedder: Optional[Embedder] = None
+        self._refresh_lock = threading.Lock()
+        self._state = _State([], {}, {}, 0, 0.0)
+        self._checked = float("-inf")
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    def embedder(self) -> Optional[Embedder]:
+        """The embedding model, loaded on first use; None when not configured or not installed"""
+        if self.embed_model and self._embedder is None:
+            try:
+                self._embedder = Embedder(self.embed_model)
+            except RuntimeError as e:
+                # BM25 still answers; embeddings come back once the package is installed
+                print(f"{e}; searching policies with BM25 only", file=sys.stderr)
+                self.embed_model = None
+        return self._embedder
+
+    def _documents(self) -> Iterator[Tuple[str, str]]:
+        for root, dirs, files in os.walk(self.docs_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(files):
+                if name.lower().endswith(DOCUMENT_TYPES):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, self.docs_dir).replace(os.sep, "/"), path
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {"version": INDEX_VERSION, "files": {}}
+        return manifest if manifest.get("version") == INDEX_VERSION else {"version": INDEX_VERSION, "files": {}}
+
+    def refresh(self) -> Dict[str, int]:
+        """Bring the index up to date with the documents; returns how many were added, updated, removed and kept"""
+        with self._refresh_lock:
+            self._checked = time.monotonic()
+            counts = Counter(added=0, updated=0, removed=0, kept=0)
+            if not os.path.isdir(self.docs_dir) and not os.path.exists(self.manifest_path):
+                return dict(counts)
+            os.makedirs(os.path.join(self.index_dir, "segments"), exist_ok=True)
+            manifest = self._load_manifest()
+            loaded = {segment.source: segment for segment in self._state.segments}
+            embedder = self.embedder()
+            embed_model = embedder.model_name if embedder else None
+            files, segments = {}, []
+            for source, path in (self._documents() if os.path.isdir(self.docs_dir) else ()):
+                stat = os.stat(path)
+                entry = manifest["files"].get(source)
+                segment_path = os.path.join(self.index_dir, "segments",
+                                            hashlib.sha1(source.encode()).hexdigest()[:16] + ".seg")
+                unchanged = (entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                             and entry.get("embed_model") == embed_model and os.path.exists(segment_path))
+                if not unchanged:
+                    with open(path, "rb") as f:
+                        digest = hashlib.sha1(f.read()).hexdigest()
+                    # A touched but unedited file keeps its segment
+                    unchanged = (entry is not None and entry["sha1"] == digest
+                                 and entry.get("embed_model") == embed_model and os.path.exists(segment_path))
+                    if not unchanged:
+                        text = read_document(path)
+                        if text is None:
+                            continue
+                        chunks = chunk_document(source, text)
+                        write_segment(segment_path, source, digest, chunks, embed_model)
+                        if embedder is not None:
+                            vectors = embedder.encode([f"{chunk.heading}\n{chunk.text}" for chunk in chunks])
+                            vectors.tofile(segment_path + ".vec.tmp")
+                            os.replace(segment_path + ".vec.tmp", segment_path + ".vec")
+                        counts["updated" if entry else "added"] += 1
+                        loaded.pop(source, None)
+                    entry = dict(entry or {}, sha1=digest)
+                else:
+                    counts["kept"] += 1
+                files[source] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns, embed_model=embed_model,
+                                     segment=os.path.basename(segment_path))
+                segment = loaded.get(source) or self._open_segment(segment_path, embedder)
+                segments.append(segment)
+            for source, entry in manifest["files"].items():
+                if source not in files:
+                    counts["removed"] += 1
+                    for suffix in ("", ".vec"):
+                        try:
+                            os.remove(os.path.join(self.index_dir, "segments", entry["segment"] + suffix))
+                        except FileNotFoundError:
+                            pass
+            with open(self.manifest_path + ".tmp", "w") as f:
+                json.dump({"version": INDEX_VERSION, "files": files}, f, indent=1)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+            self._state = self._build_state(segments)
+            return dict(counts)
+
+    def _open_segment(self, path: str, embedder: Optional[Embedder]) -> Segment:
+        segment = Segment(path)
+        if embedder is not None and len(segment) and os.path.exists(path + ".vec"):
+            segment.vectors = embedder.np.memmap(path + ".vec", dtype="float32", mode="r").reshape(len(segment), -1)
+        return segment
+
+    @staticmethod
+    def _build_state(segments: List[Segment]) -> _State:
+        document_frequency: Dict[str, int] = Counter()
+        where: Dict[str, List[int]] = defaultdict(list)
+        for number, segment in enumerate(segments):
+            for term, (_, count) in segment.terms.items():
+                document_frequency[term] += count
+                where[term].append(number)
+        chunks = sum(len(segment) for segment in segments)
+        total_length = sum(sum(segment.lengths) for segment in segments)
+        return _State(segments, dict(document_frequency), dict(where), chunks, total_length / chunks if chunks else 0.0)
+
+    def _bm25(self, state: _State, terms: List[str], limit: int) -> List[Tuple[Tuple[int, int], float]]:
+        scores: Dict[Tuple[int, int], float] = defaultdict(float)
+        for term in set(terms):
+            frequency = state.document_frequency.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (state.chunks - frequency + 0.5) / (frequency + 0.5))
+            for number in state.where[term]:
+                segment = state.segments[number]
+                first, count = segment.terms[term]
+                postings = segment.postings
+                for i in range(2 * first, 2 * (first + count), 2):
+                    chunk, tf = postings[i], postings[i + 1]
+                    norm = K1 * (1 - B + B * segment.lengths[chunk] / state.average_length)
+                    scores[(number, chunk)] += idf * tf * (K1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _dense(self, state: _State, query: str, limit: int) -> List[Tuple[Tuple[int, int], float]]:
+        embedder = self.embedder()
+        if embedder is None:
+            return []
+        vector = embedder.encode([query])[0]
+        ranked = []
+        for number, segment in enumerate(state.segments):
+            if segment.vectors is None:
+                continue
+            similarities = segment.vectors @ vector
+            for chunk in embedder.np.argsort(-similarities)[:limit]:
+                if similarities[chunk] >= MIN_SIMILARITY:
+                    ranked.append(((number, int(chunk)), float(similarities[chunk])))
+        return heapq.nlargest(limit, ranked, key=lambda item: item[1])
+
+    @profiled("policy_index.search")
+    def search(self, query: str, k: int = TOP_K) -> List[Hit]:
+        """The k chunks most relevant to the query, best first"""
+        if time.monotonic() - self._checked > REFRESH_SECONDS:
+            self.refresh()
+        state = self._state
+        if not state.chunks:
+            return []
+        rankings = [self._bm25(state, tokenize(query), 4 * k)]
+        dense = self._dense(state, query, 4 * k)
+        if dense:
+            rankings.append(dense)
+        if len(rankings) == 1:
+            fused = rankings[0]
+        else:
+            fused_scores: Dict[Tuple[int, int], float] = defaultdict(float)
+            for ranking in rankings:
+                for rank, (key, _) in enumerate(ranking):
+                    fused_scores[key] += 1 / (RRF_K + rank + 1)
+            fused = heapq.nlargest(4 * k, fused_scores.items(), key=lambda item: item[1])
+        hits = []
+        for (number, chunk), score in fused[:k]:
+            segment = state.segments[number]
+            hits.append(Hit(segment.source, segment.headings[chunk], segment.text(chunk), round(score, 4)))
+        return hits
+
+    def context_message(self, query: str, k: int = TOP_K, max_chars: int = MAX_CONTEXT_CHARS) -> Optional[Dict]:
+        """A system message with the policy excerpts for a patient's message, or None when nothing matches"""
+        excerpts, used = [], 0
+        for hit in self.search(query, k):
+            excerpt = f"[{hit.heading}]\n{hit.text}"
+            if used + len(excerpt) > max_chars:
+                if excerpts:
+                    break
+                excerpt = excerpt[:max_chars]
+            excerpts.append(excerpt)
+            used += len(excerpt)
+        if not excerpts:
+            return None
+        return {"role": "system", "content": "Clinic policy excerpts for this question. Base policy answers on them, "
+                                             "and say so if they don't cover it:\n\n" + "\n\n".join(excerpts)}
+
+    def stats(self) -> Dict:
+        state = self._state
+        return {"documents": len(state.segments), "chunks": state.chunks, "terms": len(state.document_frequency),
+                "embeddings": any(segment.vectors is not None for segment in state.segments)}
+
+
+# Shared by every assistant without clinic-specific documents
+policy_index = PolicyIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and search clinic policy documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index = commands.add_parser("index", help="Index new and changed documents")
+    index.add_argument("docs", nargs="?", default=POLICY_DOCS)
+    index.add_argument("--index", default=POLICY_INDEX)
+    search = commands.add_parser("search", help="Show the chunks a question would put in the prompt")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=TOP_K)
+    search.add_argument("--docs", default=POLICY_DOCS)
+    search.add_argument("--index", default=POLICY_INDEX)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    policies = PolicyIndex(args.docs, args.index)
+    counts = policies.refresh()
+    if args.command == "index":
+        print(f"{counts['added']} added, {counts['updated']} updated, {counts['removed']} removed, "
+              f"{counts['kept']} unchanged in {time.perf_counter() - started:.2f}s")
+        print(json.dumps(policies.stats()))
+        return
+    started = time.perf_counter()
+    hits = policies.search(args.query, args.k)
+    print(f"{len(hits)} chunks in {(time.perf_counter() - started) * 1000:.1f} ms")
+    for hit in hits:
+        print(f"\n{hit.score:.3f}  {hit.heading}\n{hit.text}")
+
+
+if __name__ == "__main__":
+    main()
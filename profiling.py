@@ -0,0 +1,358 @@
+"""
+Opt-in profiling of conversation turns
+
+    DENTAL_PROFILE=1 python dental_assistant.py
+    kill -USR2 <pid>                      toggle profiling in a running process
+    python profiling.py report [profiles]
+
+While enabled, every turn (generate_response, handle_turn) records spans for
+prompt building, model I/O, function-argument parsing, tool dispatch and each
+storage operation, written as one JSON line per turn to
+<DENTAL_PROFILE_DIR>/<session>/turns.jsonl. A sampled fraction of turns is
+also captured whole:
+
+    DENTAL_PROFILE_MODE=sampler    stack samples of the turn's thread every
+                                   DENTAL_PROFILE_INTERVAL seconds, written as
+                                   speedscope JSON (open in speedscope.app) or,
+                                   with DENTAL_PROFILE_FORMAT=collapsed, as
+                                   collapsed stacks for flamegraph.pl
+    DENTAL_PROFILE_MODE=cprofile   deterministic cProfile, written as .pstats
+
+Disabled, a span costs one attribute check.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import functools
+import inspect
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.getenv("DENTAL_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE = float(os.getenv("DENTAL_PROFILE_SAMPLE", "0.1"))  # Fraction of turns captured whole
+PROFILE_MODE = os.getenv("DENTAL_PROFILE_MODE", "sampler")
+PROFILE_FORMAT = os.getenv("DENTAL_PROFILE_FORMAT", "speedscope")
+SAMPLE_INTERVAL = float(os.getenv("DENTAL_PROFILE_INTERVAL", "0.005"))
+TOGGLE_SIGNAL = getattr(signal, "SIGUSR2", None)  # Not available on Windows
+
+
+class Turn:
+    """Spans of one turn, as (name, start_ms, duration_ms, depth) relative to the turn's start"""
+
+    def __init__(self, name: str, session_id: Optional[str]):
+        self.name = name
+        self.session_id = session_id or "no-session"
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, float, int]] = []
+        self.depth = 0
+
+    def elapsed_ms(self, since: Optional[float] = None) -> float:
+        return (time.perf_counter() - (since if since is not None else self.started)) * 1000
+
+
+# The running turn, per thread and per asyncio task
+_current_turn: contextvars.ContextVar[Optional[Turn]] = contextvars.ContextVar("profiling_turn", default=None)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()  # Root-first tuples of (function, file, line)
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+class Profiler:
+    """Span timings for every turn while enabled, and whole-turn captures for a sample of them"""
+
+    def __init__(self, enabled: bool = False, directory: str = PROFILE_DIR, sample: float = PROFILE_SAMPLE,
+                 mode: str = PROFILE_MODE, fmt: str = PROFILE_FORMAT, interval: float = SAMPLE_INTERVAL):
+        self.enabled = enabled
+        self.directory = directory
+        self.sample = sample
+        self.mode = mode
+        self.fmt = fmt
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._capture_lock = threading.Lock()  # cProfile allows one active profiler per process on 3.12+
+        self.totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total_ms, max_ms]
+
+    def toggle(self, enabled: Optional[bool] = None) -> bool:
+        self.enabled = not self.enabled if enabled is None else enabled
+        return self.enabled
+
+    @contextmanager
+    def span(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        turn = _current_turn.get()
+        started = time.perf_counter()
+        if turn is not None:
+            turn.depth += 1
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if turn is not None:
+                turn.depth -= 1
+                turn.spans.append((name, round((started - turn.started) * 1000, 3), round(duration, 3), turn.depth))
+            with self._lock:
+                total = self.totals[name]
+                total[0] += 1
+                total[1] += duration
+                total[2] = max(total[2], duration)
+
+    @contextmanager
+    def turn(self, name: str, session_id: Optional[str] = None):
+        """Record one turn; nested turns (a flow inside generate_response) become spans"""
+        if not self.enabled or _current_turn.get() is not None:
+            with self.span(name):
+                yield
+            return
+        turn = Turn(name, session_id)
+        token = _current_turn.set(turn)
+        # A cProfile capture is skipped while another turn holds the profiler
+        capture = random.random() < self.sample and (self.mode != "cprofile" or self._capture_lock.acquire(blocking=False))
+        collector = self._start_capture() if capture else None
+        try:
+            with self.span(name):
+                yield
+        finally:
+            _current_turn.reset(token)
+            path = None
+            if capture:
+                try:
+                    path = self._finish_capture(collector, turn)
+                finally:
+                    if self.mode == "cprofile":
+                        self._capture_lock.release()
+            self._write_turn(turn, path)
+
+    def _start_capture(self):
+        if self.mode == "cprofile":
+            import cProfile
+            collector = cProfile.Profile()
+            collector.enable()
+            return collector
+        collector = StackSampler(threading.get_ident(), self.interval)
+        collector.start()
+        return collector
+
+    def _finish_capture(self, collector, turn: Turn) -> str:
+        directory = self.session_directory(turn.session_id)
+        now = time.time()
+        stem = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}-{turn.name}")
+        if self.mode == "cprofile":
+            collector.disable()
+            collector.dump_stats(stem + ".pstats")
+            return stem + ".pstats"
+        stacks = collector.stop()
+        if self.fmt == "collapsed":
+            with open(stem + ".collapsed", "w") as f:
+                f.write(collapsed_stacks(stacks))
+            return stem + ".collapsed"
+        with open(stem + ".speedscope.json", "w") as f:
+            json.dump(speedscope(stacks, self.interval * 1000, turn), f, separators=(",", ":"))
+        return stem + ".speedscope.json"
+
+    def session_directory(self, session_id: str) -> str:
+        directory = os.path.join(self.directory, "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _write_turn(self, turn: Turn, profile_path: Optional[str]) -> None:
+        line = json.dumps({"ts": time.time(), "turn": turn.name, "session_id": turn.session_id,
+                           "total_ms": round(turn.elapsed_ms(), 3), "profile": profile_path,
+                           "spans": [{"name": name, "start_ms": start, "ms": ms, "depth": depth}
+                                     for name, start, ms, depth in turn.spans]})
+        with self._lock, open(os.path.join(self.session_directory(turn.session_id), "turns.jsonl"), "a") as f:
+            f.write(line + "\n")
+
+    def summary(self) -> str:
+        with self._lock:
+            rows = sorted(self.totals.items(), key=lambda item: -item[1][1])
+            lines = [f"{'span':40} {'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+            lines += [f"{name[:40]:40} {count:>7} {total:>10.1f} {total / count:>9.2f} {longest:>9.2f}"
+                      for name, (count, total, longest) in rows]
+        return "\n".join(lines)
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """Brendan Gregg's folded format: "root;caller;leaf count" per line"""
+    return "".join(";".join(f"{name} ({os.path.basename(path)}:{line})" for name, path, line in stack) + f" {count}\n"
+                   for stack, count in stacks.most_common())
+
+
+def speedscope(stacks: Counter, interval_ms: float, turn: Turn) -> Dict:
+    """Speedscope file with the sampled stacks and the turn's spans as an evented profile"""
+    frames, frame_ids = [], {}
+
+    def frame_id(name, path=None, line=None):
+        key = (name, path, line)
+        if key not in frame_ids:
+            frame_ids[key] = len(frames)
+            frames.append({"name": name, "file": path, "line": line} if path else {"name": name})
+        return frame_ids[key]
+
+    samples, weights = [], []
+    for stack, count in stacks.items():
+        samples.append([frame_id(*frame) for frame in stack])
+        weights.append(count * interval_ms)
+    total_ms = turn.elapsed_ms()
+
+    # Spans are appended as they close; open/close events must come in nesting order
+    events, open_spans = [], []
+    for name, start, ms, _ in sorted(turn.spans, key=lambda span: (span[1], -span[2])):
+        while open_spans and open_spans[-1][1] <= start:
+            events.append({"type": "C", "frame": open_spans[-1][0], "at": open_spans.pop()[1]})
+        events.append({"type": "O", "frame": frame_id(name), "at": start})
+        open_spans.append((frame_id(name), start + ms))
+    while open_spans:
+        events.append({"type": "C", "frame": open_spans[-1][0], "at": open_spans.pop()[1]})
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"{turn.name} {turn.session_id}",
+        "exporter": "dental profiling",
+        "shared": {"frames": frames},
+        "profiles": [
+            {"type": "sampled", "name": "samples", "unit": "milliseconds", "startValue": 0,
+             "endValue": total_ms, "samples": samples, "weights": weights},
+            {"type": "evented", "name": "spans", "unit": "milliseconds", "startValue": 0,
+             "endValue": max([total_ms] + [event["at"] for event in events]), "events": events},
+        ],
+    }
+
+
+def _session_of(fn):
+    """How to find the session id among a function's arguments: self.session_id or a session_id parameter"""
+    parameters = list(inspect.signature(fn).parameters)
+    if parameters and parameters[0] == "self":
+        return lambda args, kwargs: getattr(args[0], "session_id", None)
+    if "session_id" in parameters:
+        position = parameters.index("session_id")
+        return lambda args, kwargs: kwargs.get("session_id", args[position] if len(args) > position else None)
+    return lambda args, kwargs: None
+
+
+def profiled_turn(name: str):
+    """Decorator: run a sync, async or generator function as a profiled turn"""
+    def decorate(fn):
+        session_of = _session_of(fn)
+        if inspect.isgeneratorfunction(fn):
+            # The turn lasts until the stream is exhausted or closed, not until the first yield
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return (yield from fn(*args, **kwargs))
+                with profiler.turn(name, session_of(args, kwargs)):
+                    return (yield from fn(*args, **kwargs))
+            return generator_wrapper
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not profiler.enabled:
+                    return await fn(*args, **kwargs)
+                with profiler.turn(name, session_of(args, kwargs)):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with profiler.turn(name, session_of(args, kwargs)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def profiled(name: str):
+    """Decorator: time every call as a span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with profiler.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def install_signal_toggle(signum=TOGGLE_SIGNAL) -> bool:
+    """Toggle profiling on `signum`; only possible from the main thread"""
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def toggle(received, frame):
+        if profiler.toggle():
+            print(f"Profiling on, writing to {os.path.abspath(profiler.directory)}", flush=True)
+        else:
+            print(f"Profiling off\n{profiler.summary()}", flush=True)
+    signal.signal(signum, toggle)
+    return True
+
+
+def report(directory: str = PROFILE_DIR) -> None:
+    """Span latencies over every turns.jsonl under `directory`"""
+    durations: Dict[str, List[float]] = defaultdict(list)
+    turns = 0
+    for root, _, files in os.walk(directory):
+        if "turns.jsonl" not in files:
+            continue
+        with open(os.path.join(root, "turns.jsonl")) as f:
+            for line in f:
+                turn = json.loads(line)
+                turns += 1
+                for span in turn["spans"]:
+                    durations[span["name"]].append(span["ms"])
+    print(f"{turns} turns under {directory}")
+    print(f"{'span':40} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'total ms':>10}")
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        p50, p99 = values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))]
+        print(f"{name[:40]:40} {len(values):>7} {p50:>9.2f} {p99:>9.2f} {sum(values):>10.1f}")
+
+
+# Shared by all three assistants and the stores
+profiler = Profiler(enabled=os.getenv("DENTAL_PROFILE") == "1")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize profiled turns")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("directory", nargs="?", default=PROFILE_DIR)
+    args = parser.parse_args()
+    report(args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import hashlib
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+from model_client import ModelUnavailable
+
+# Account quota; keep slightly under the provider's limits
+REQUESTS_PER_MINUTE = int(os.getenv("DENTAL_RPM_LIMIT", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("DENTAL_TPM_LIMIT", "200000"))
+
+# Priority lanes, lower goes first
+PRIORITY_BOOKING = 0   # A patient is in the middle of booking, rescheduling or cancelling
+PRIORITY_DEFAULT = 1
+PRIORITY_FAQ = 2       # General questions can wait a little
+
+# Longest a waiter sleeps before re-checking, so async waiters notice a new head of queue
+ASYNC_POLL_SECONDS = 0.05
+
+
+class QuotaTimeout(ModelUnavailable):
+    """No quota freed up before the caller's deadline"""
+
+
+def estimate_tokens(payload, max_output_tokens: int = 500) -> int:
+    """Rough token count of a request: ~4 characters per token plus the output allowance"""
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    return len(text) // 4 + max_output_tokens
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most one minute of quota"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available; 0 if it is available now"""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+
+class RateLimiter:
+    """
+    Client-side limiter on requests/min and tokens/min with priority lanes
+
+    Waiters queue in priority order and only the head of the queue may take
+    quota, so FAQ traffic never starves an active booking. Token estimates are
+    corrected with `settle` once the real usage is known, which keeps
+    throughput at the quota ceiling instead of oscillating around it.
+
+    Quota is taken once per logical call (`call`/`acall`), before any model
+    request is made; its retries and hedges run under the same reservation.
+    """
+
+    def __init__(self, requests_per_minute: int = REQUESTS_PER_MINUTE, tokens_per_minute: int = TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._waiters = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _try_take(self, ticket, tokens: int) -> float:
+        """Take quota if `ticket` is at the head of the queue; return seconds to wait otherwise"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._waiters[0] != ticket:
+            return ASYNC_POLL_SECONDS
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if wait > 0:
+            return wait
+        self.requests.level -= 1
+        self.tokens.level -= min(tokens, self.tokens.capacity)
+        heapq.heappop(self._waiters)
+        self._cond.notify_all()
+        return 0.0
+
+    def _leave(self, ticket) -> None:
+        if ticket in self._waiters:
+            self._waiters.remove(ticket)
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None) -> None:
+        """Block until one request and `tokens` tokens may be spent; QuotaTimeout after `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait = self._try_take(ticket, tokens)
+                    if wait == 0:
+                        return
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise QuotaTimeout(f"no quota for {tokens} tokens within {timeout}s")
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                self._leave(ticket)
+                raise
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None) -> None:
+        """Async version of `acquire`; a cancelled waiter gives up its place in the queue"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                if wait == 0:
+                    return
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise QuotaTimeout(f"no quota for {tokens} tokens within {timeout}s")
+                await asyncio.sleep(min(wait, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                self._leave(ticket)
+            raise
+
+    def settle(self, estimated: int, actual: Optional[int]) -> None:
+        """Refund or charge the difference between estimated and actual token usage"""
+        if actual is None:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every request, e.g. after a 429 with a Retry-After header"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def backoff_on_429(self, exc: BaseException) -> None:
+        """Pause everyone when the provider says we are over quota anyway"""
+        if getattr(exc, "status_code", None) != 429:
+            return
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        try:
+            self.pause(float(headers.get("retry-after", 1)))
+        except ValueError:
+            self.pause(1)
+
+    def call(self, fn: Callable, tokens: int, priority: int = PRIORITY_DEFAULT,
+             usage: Optional[Callable] = None, timeout: Optional[float] = None):
+        """
+        Run one logical model call, fn(), under a single reservation of quota
+
+        Args:
+            fn: The whole call, retries, hedges and failover included
+            tokens: Estimated tokens, settled against usage(result) when given
+            timeout: Longest to wait for quota, normally the call's deadline
+        """
+        self.acquire(tokens, priority, timeout)
+        result = fn()
+        self.settle(tokens, usage(result) if usage else None)
+        return result
+
+    async def acall(self, fn: Callable, tokens: int, priority: int = PRIORITY_DEFAULT,
+                    usage: Optional[Callable] = None, timeout: Optional[float] = None):
+        """Async version of `call`; fn() returns an awaitable"""
+        await self.aacquire(tokens, priority, timeout)
+        result = await fn()
+        self.settle(tokens, usage(result) if usage else None)
+        return result
+
+    def pausing(self, fn: Callable) -> Callable:
+        """Wrap fn(model) so a 429 on any attempt pauses every caller"""
+        def attempt(model):
+            try:
+                return fn(model)
+            except Exception as e:
+                self.backoff_on_429(e)
+                raise
+        return attempt
+
+    def apausing(self, fn: Callable) -> Callable:
+        """Async version of `pausing`"""
+        async def attempt(model):
+            try:
+                return await fn(model)
+            except Exception as e:
+                self.backoff_on_429(e)
+                raise
+        return attempt
+
+
+def request_key(*parts) -> str:
+    """Stable key of a request, used to coalesce identical in-flight calls"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Coalescer:
+    """
+    Shares one in-flight call between identical requests
+
+    While a request with the same key is running, later callers wait for its
+    result instead of sending their own, e.g. many patients asking the same
+    FAQ at once. Nothing is cached after the call completes.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def call(self, key: str, fn: Callable):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def acall(self, key: str, fn: Callable):
+        """Async version of `call`; fn() returns an awaitable"""
+        future = self._ainflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = self._ainflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Followers re-raise it; mark it retrieved so asyncio doesn't warn if there are none
+            future.exception()
+            raise
+        finally:
+            del self._ainflight[key]
+
+
+# One limiter and coalescer per process, shared by all assistants
+rate_limiter = RateLimiter()
+coalescer = Coalescer()
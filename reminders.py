@@ -0,0 +1,301 @@
+import os
+import json
+import heapq
+import time
+import sqlite3
+import itertools
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from session_store import DEFAULT_DB_PATH
+from profiling import profiled
+
+# Reminders live in the same database as the session store
+REMINDER_DB_PATH = os.getenv("DENTAL_REMINDER_DB", DEFAULT_DB_PATH)
+
+# How long before an appointment each reminder goes out
+REMINDER_OFFSETS = {"48h": timedelta(hours=48), "2h": timedelta(hours=2)}
+
+BATCH_SIZE = 500
+
+# A reminder whose send fails is retried after RETRY_DELAY seconds, doubling
+# each time up to MAX_RETRY_DELAY, and dropped after MAX_ATTEMPTS tries
+RETRY_DELAY = 60.0
+MAX_RETRY_DELAY = 3600.0
+MAX_ATTEMPTS = 5
+
+# Rebuild the heap once more than this share of its entries belong to cancelled jobs
+COMPACT_RATIO = 0.5
+
+
+class ReminderQueue:
+    """
+    Heap-ordered queue of pending reminders, persisted to SQLite
+
+    Jobs are indexed by appointment key, so scheduling, rescheduling and
+    cancelling touch only that appointment's jobs: O(log n) per job with
+    lazy deletion from the heap. Due jobs are popped from the top of the
+    heap without scanning the appointments.
+    """
+
+    def __init__(self, path: str = REMINDER_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "job_id TEXT PRIMARY KEY, appointment_key TEXT NOT NULL, "
+            "due REAL NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS reminders_by_appointment ON reminders (appointment_key)")
+        self._conn.commit()
+        self._seq = itertools.count()
+        self._heap = []  # (due, seq, job_id)
+        self._jobs: Dict[str, dict] = {}
+        self._by_appointment: Dict[str, set] = {}
+        self._in_flight: Dict[str, dict] = {}  # Popped by pop_due, not yet marked sent or retried
+        self._load()
+
+    def _load(self) -> None:
+        for job_id, key, due, payload in self._conn.execute(
+                "SELECT job_id, appointment_key, due, payload FROM reminders"):
+            self._jobs[job_id] = dict(json.loads(payload), job_id=job_id, appointment_key=key, due=due)
+            self._by_appointment.setdefault(key, set()).add(job_id)
+            self._heap.append((due, next(self._seq), job_id))
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @profiled("reminders.schedule")
+    def schedule(self, appointment_key: str, when: datetime, contact: Dict, message: str, now: Optional[datetime] = None) -> List[str]:
+        """
+        Queue the reminders for one appointment, replacing any already queued
+
+        Args:
+            appointment_key: Unique key of the appointment
+            when: Appointment start
+            contact: Patient name, phone and email
+            message: Reminder text
+            now: Current time; reminders whose time has passed are skipped
+
+        Returns:
+            list: Ids of the queued jobs
+        """
+        now = now or datetime.now()
+        with self._lock:
+            self._remove(appointment_key)
+            rows = []
+            for kind, offset in REMINDER_OFFSETS.items():
+                due_at = when - offset
+                if due_at <= now:
+                    continue
+                job_id = f"{appointment_key}#{kind}"
+                due = due_at.timestamp()
+                job = {"kind": kind, "contact": contact, "message": message, "appointment_at": when.isoformat()}
+                self._jobs[job_id] = dict(job, job_id=job_id, appointment_key=appointment_key, due=due)
+                self._by_appointment.setdefault(appointment_key, set()).add(job_id)
+                heapq.heappush(self._heap, (due, next(self._seq), job_id))
+                rows.append((job_id, appointment_key, due, json.dumps(job)))
+            self._conn.executemany("INSERT OR REPLACE INTO reminders VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            return [row[0] for row in rows]
+
+    @profiled("reminders.cancel")
+    def cancel(self, appointment_key: str) -> int:
+        """Drop every queued reminder of an appointment; returns how many were dropped"""
+        with self._lock:
+            removed = self._remove(appointment_key)
+            self._conn.commit()
+            return removed
+
+    @profiled("reminders.reschedule")
+    def reschedule(self, old_key: str, new_key: str, when: datetime, contact: Dict, message: str) -> List[str]:
+        """Move an appointment's reminders, e.g. when its key changes with the new time"""
+        if old_key != new_key:
+            self.cancel(old_key)
+        return self.schedule(new_key, when, contact, message)
+
+    def _remove(self, appointment_key: str) -> int:
+        # Heap entries of removed jobs stay behind and are skipped when popped
+        job_ids = self._by_appointment.pop(appointment_key, set())
+        for job_id in job_ids:
+            self._jobs.pop(job_id, None)
+        # Jobs being sent right now are not retried if their send fails
+        for job_id in [job_id for job_id, job in self._in_flight.items() if job["appointment_key"] == appointment_key]:
+            del self._in_flight[job_id]
+        if job_ids:
+            self._conn.execute("DELETE FROM reminders WHERE appointment_key = ?", (appointment_key,))
+        if len(self._heap) > 64 and len(self._jobs) < len(self._heap) * COMPACT_RATIO:
+            self._heap = [entry for entry in self._heap if entry[2] in self._jobs]
+            heapq.heapify(self._heap)
+        return len(job_ids)
+
+    def pop_due(self, now: Optional[float] = None, limit: int = BATCH_SIZE) -> List[dict]:
+        """Remove and return up to `limit` jobs that are due, earliest first"""
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and len(due) < limit and self._heap[0][0] <= now:
+                entry_due, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is None or job["due"] != entry_due:
+                    # Cancelled, or a stale entry left behind by a reschedule
+                    continue
+                del self._jobs[job_id]
+                key = job["appointment_key"]
+                self._by_appointment.get(key, set()).discard(job_id)
+                if not self._by_appointment.get(key):
+                    self._by_appointment.pop(key, None)
+                self._in_flight[job_id] = job
+                due.append(job)
+            return due
+
+    def mark_sent(self, jobs: List[dict]) -> None:
+        with self._lock:
+            # A job cancelled or replaced while in flight has had its row removed already
+            sent = [job["job_id"] for job in jobs if self._in_flight.pop(job["job_id"], None) is job]
+            self._conn.executemany("DELETE FROM reminders WHERE job_id = ?", [(job_id,) for job_id in sent])
+            self._conn.commit()
+
+    def retry(self, jobs: List[dict], now: Optional[float] = None) -> List[dict]:
+        """
+        Queue jobs whose send failed again, with exponential backoff
+
+        Jobs cancelled while in flight are not queued again.
+
+        Returns:
+            list: Jobs dropped after MAX_ATTEMPTS tries
+        """
+        now = time.time() if now is None else now
+        dropped = []
+        with self._lock:
+            for job in jobs:
+                if self._in_flight.pop(job["job_id"], None) is not job:
+                    continue
+                attempts = job.get("attempts", 0) + 1
+                if attempts >= MAX_ATTEMPTS:
+                    self._conn.execute("DELETE FROM reminders WHERE job_id = ?", (job["job_id"],))
+                    dropped.append(job)
+                    continue
+                job = dict(job, attempts=attempts, due=now + min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (attempts - 1)))
+                self._jobs[job["job_id"]] = job
+                self._by_appointment.setdefault(job["appointment_key"], set()).add(job["job_id"])
+                heapq.heappush(self._heap, (job["due"], next(self._seq), job["job_id"]))
+                payload = {name: value for name, value in job.items() if name not in ("job_id", "appointment_key", "due")}
+                self._conn.execute("UPDATE reminders SET due = ?, payload = ? WHERE job_id = ?",
+                                   (job["due"], json.dumps(payload), job["job_id"]))
+            self._conn.commit()
+        return dropped
+
+
+class FileSender:
+    """Appends reminders to a JSON lines outbox; stands in for SMS/email in testing"""
+
+    def __init__(self, path: str = "reminders_outbox.jsonl"):
+        self.path = path
+
+    def send_batch(self, jobs: List[dict]) -> List[str]:
+        with open(self.path, "a") as f:
+            for job in jobs:
+                f.write(json.dumps({"sent_at": time.time(), **job}) + "\n")
+        return []
+
+
+class SMTPSender:
+    """
+    Emails reminders over one SMTP connection per batch
+
+    Point it at a local debugging server (e.g. `python -m aiosmtpd -n -l localhost:1025`)
+    for testing. Patients without an email address are skipped. A refused
+    message fails only its own job; a dropped connection fails the rest.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 1025, sender: str = "reminders@smilebright.example"):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send_batch(self, jobs: List[dict]) -> List[str]:
+        import smtplib
+        from email.message import EmailMessage
+        failed = []
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            for i, job in enumerate(jobs):
+                email = job["contact"].get("email")
+                if not email:
+                    continue
+                msg = EmailMessage()
+                msg["From"] = self.sender
+                msg["To"] = email
+                msg["Subject"] = "Appointment reminder"
+                msg.set_content(job["message"])
+                try:
+                    smtp.send_message(msg)
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    failed += [unsent["job_id"] for unsent in jobs[i:]]
+                    break
+                except smtplib.SMTPException:
+                    # Refused recipient or message; the rest of the batch still goes out
+                    failed.append(job["job_id"])
+        return failed
+
+
+class ReminderDispatcher:
+    """
+    Sends due reminders in batches through a pluggable sender
+
+    A sender's send_batch(jobs) returns the ids of the jobs it could not
+    send, or raises if it sent none. Only those jobs are retried.
+    """
+
+    def __init__(self, queue: ReminderQueue, sender, batch_size: int = BATCH_SIZE):
+        self.queue = queue
+        self.sender = sender
+        self.batch_size = batch_size
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._stop = threading.Event()
+
+    def dispatch_due(self, now: Optional[float] = None) -> int:
+        """Send everything that is due; returns the number of reminders sent"""
+        sent = 0
+        while True:
+            batch = self.queue.pop_due(now, self.batch_size)
+            if not batch:
+                return sent
+            try:
+                failed_ids = set(self.sender.send_batch(batch) or ())
+            except Exception:
+                # Nothing went out, e.g. the server is down; try the rest later
+                self.failed += len(batch)
+                self.dropped += len(self.queue.retry(batch, now))
+                return sent
+            failed = [job for job in batch if job["job_id"] in failed_ids]
+            delivered = [job for job in batch if job["job_id"] not in failed_ids]
+            self.queue.mark_sent(delivered)
+            self.dropped += len(self.queue.retry(failed, now))
+            self.failed += len(failed)
+            sent += len(delivered)
+            self.sent += len(delivered)
+
+    def start(self, interval: float = 30.0) -> threading.Thread:
+        """Dispatch in a background thread every `interval` seconds"""
+        def loop():
+            while not self._stop.wait(interval):
+                self.dispatch_due()
+        thread = threading.Thread(target=loop, name="reminder-dispatcher", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def reminder_sender_from_env():
+    """DENTAL_REMINDER_SENDER=smtp uses SMTPSender, anything else the file outbox"""
+    if os.getenv("DENTAL_REMINDER_SENDER") == "smtp":
+        return SMTPSender(os.getenv("DENTAL_SMTP_HOST", "localhost"), int(os.getenv("DENTAL_SMTP_PORT", "1025")))
+    return FileSender(os.getenv("DENTAL_REMINDER_OUTBOX", "reminders_outbox.jsonl"))
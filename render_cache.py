@@ -0,0 +1,72 @@
+"""
+Cached renderings of appointment lists
+
+History and schedule views are rebuilt only when one of the patient's
+appointments changes: every mutation bumps that patient's version, and a
+rendering is reused while its (patient, version) key is current. Views given
+to the model use render_table, which names the columns once instead of
+spelling out "on ... at ...: ..." for every appointment.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Sequence, Tuple
+
+RENDER_CACHE_SIZE = int(os.getenv("DENTAL_RENDER_CACHE", "1024"))  # Renderings kept, least recently used dropped first
+
+
+class RenderCache:
+    """Renderings keyed by (patient, view) and tagged with the patient's version when rendered"""
+
+    def __init__(self, capacity: int = RENDER_CACHE_SIZE):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._versions: Dict[Hashable, int] = {}
+        self._entries: "OrderedDict[Tuple[Hashable, str], Tuple[int, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, patient: Hashable) -> int:
+        with self._lock:
+            return self._versions.get(patient, 0)
+
+    def invalidate(self, patient: Hashable) -> None:
+        """Call on every change to one of the patient's appointments"""
+        with self._lock:
+            self._versions[patient] = self._versions.get(patient, 0) + 1
+
+    def get(self, patient: Hashable, view: str, render: Callable[[], Any]) -> Any:
+        """The cached `view` of a patient's appointments, calling render() when it is missing or stale"""
+        key = (patient, view)
+        with self._lock:
+            version = self._versions.get(patient, 0)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Rendered outside the lock; a change meanwhile bumps the version, so this entry is born stale
+        value = render()
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def render_table(title: str, columns: Sequence[str], rows: Iterable[Sequence]) -> str:
+    """
+    Compact table for model inputs
+
+        Appointments for Ann Lee (date|time|service|status):
+        2026-10-22|10:00|Cleaning|confirmed
+    """
+    lines = [f"{title} ({'|'.join(columns)}):"]
+    lines += ["|".join(str(value) for value in row) for row in rows]
+    return "\n".join(lines)
@@ -0,0 +1,226 @@
+import os
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Optional, Tuple
+
+from change_events import ChangeEvent, ChangeLog, change_log, subscribe_from_env
+from patient_index import PatientIndex
+from profiling import profiled
+from render_cache import RenderCache, render_table
+
+# Where worker processes reach the single-writer store; see server.py
+STORE_ADDRESS = ("127.0.0.1", int(os.getenv("DENTAL_STORE_PORT", "50055")))
+# The store speaks pickle, so anyone holding the key can run code in it: there is
+# no default. Unset, server.serve() makes a random key per run for its workers
+STORE_AUTHKEY = os.getenv("DENTAL_STORE_AUTHKEY", "").encode() or None
+
+
+@dataclass
+class Patient:
+    name: str
+    phone: str
+    email: str
+    is_new_patient: bool
+
+
+@dataclass
+class Appointment:
+    patient_name: str
+    datetime: datetime
+    duration: timedelta = timedelta(minutes=30)
+    type: str = "regular_checkup"
+
+
+def appointment_key(name: str, dt: datetime) -> str:
+    """Key of one appointment in change events and the reminder queue"""
+    return f"{name}|{dt.isoformat()}"
+
+
+class SchedulingStore:
+    """
+    Patients and appointments of the multi-agent assistant
+
+    Every change goes through one method call, so the same class works
+    in-process and behind a manager proxy, where a single server process is
+    the only writer. Reads return copies; callers never mutate shared records.
+    Each change is published to the change log under the store lock, so
+    events are in mutation order and their seq is one sequence for all workers.
+    """
+
+    def __init__(self, changes: Optional[ChangeLog] = None, source: str = "multi_agent"):
+        self._changes = changes or change_log
+        self._source = source
+        self._lock = threading.Lock()
+        self._patients: Dict[str, Patient] = {}
+        self._appointments: Dict[str, List[Appointment]] = {}
+        self._index = PatientIndex()  # Patients by name similarity and phone, keyed by registered name
+        self._views = RenderCache()  # Rendered appointment tables, invalidated by every booking change
+
+    def _publish(self, entity: str, action: str, key: str, before=None, after=None,
+                 session_id: Optional[str] = None) -> None:
+        # Callers hold self._lock
+        self._changes.publish(self._source, entity, action, key, before, after, session_id=session_id)
+
+    def changes_since(self, seq: int) -> Tuple[List[ChangeEvent], int]:
+        """Change events after `seq`, as ChangeLog.events_since; reachable through the proxy"""
+        return self._changes.events_since(seq)
+
+    @profiled("scheduling_store.get_patient")
+    def get_patient(self, name: str) -> Optional[Patient]:
+        with self._lock:
+            patient = self._patients.get(name)
+            return replace(patient) if patient else None
+
+    @profiled("scheduling_store.add_patient")
+    def add_patient(self, patient: Patient, session_id: Optional[str] = None) -> Optional[str]:
+        """
+        Register a patient unless they already are
+
+        Returns None when the patient was added, otherwise the name the
+        existing record is kept under: the same name, or a close spelling of
+        it ("Jon Smith" for "John Smith") with the same phone number.
+        """
+        with self._lock:
+            if patient.name in self._patients:
+                return patient.name
+            duplicate = self._index.find_duplicate(patient.name, patient.phone)
+            if duplicate is not None:
+                return duplicate.patient_id
+            self._patients[patient.name] = replace(patient)
+            self._index.add(patient.name, patient.name, patient.phone)
+            self._publish("patient", "registered", patient.name, after=patient, session_id=session_id)
+            return None
+
+    @profiled("scheduling_store.resolve_name")
+    def resolve_name(self, name: str, phone: Optional[str] = None) -> Optional[str]:
+        """
+        The registered name a patient means, or None if unknown or ambiguous
+
+        A misspelt name only resolves together with the patient's phone
+        number; name_candidates() lists the names to ask them about.
+        """
+        with self._lock:
+            if name in self._patients:
+                return name
+            return self._index.resolve(name, phone)
+
+    def name_candidates(self, name: str) -> List[str]:
+        """Registered names close to one that did not resolve, best first"""
+        with self._lock:
+            return self._index.candidates(name)
+
+    @profiled("scheduling_store.get_appointments")
+    def get_appointments(self, name: str) -> List[Appointment]:
+        with self._lock:
+            return [replace(appt) for appt in self._appointments.get(name, [])]
+
+    @profiled("scheduling_store.add_appointment")
+    def add_appointment(self, appointment: Appointment, session_id: Optional[str] = None) -> bool:
+        """
+        Book an appointment and mark the patient as no longer new
+
+        Returns False, booking nothing, when the patient already has an
+        appointment at that time, so a retried run cannot double-book.
+        """
+        with self._lock:
+            booked = self._appointments.setdefault(appointment.patient_name, [])
+            if any(appt.datetime == appointment.datetime for appt in booked):
+                return False
+            booked.append(replace(appointment))
+            self._views.invalidate(appointment.patient_name)
+            if appointment.patient_name in self._patients:
+                self._patients[appointment.patient_name].is_new_patient = False
+            self._publish("appointment", "booked", appointment_key(appointment.patient_name, appointment.datetime),
+                          after=appointment, session_id=session_id)
+            return True
+
+    @profiled("scheduling_store.cancel_appointment")
+    def cancel_appointment(self, name: str, dt: datetime, session_id: Optional[str] = None) -> Optional[Appointment]:
+        """Remove one appointment and return it, or None if the patient has none at that time"""
+        with self._lock:
+            booked = self._appointments.get(name, [])
+            for i, appt in enumerate(booked):
+                if appt.datetime == dt:
+                    self._views.invalidate(name)
+                    self._publish("appointment", "cancelled", appointment_key(name, dt), before=appt,
+                                  session_id=session_id)
+                    return booked.pop(i)
+            return None
+
+    @profiled("scheduling_store.move_appointment")
+    def move_appointment(self, name: str, old_dt: datetime, new_dt: datetime,
+                         session_id: Optional[str] = None) -> bool:
+        """Move one appointment; False if there is none at old_dt or one already at new_dt"""
+        with self._lock:
+            booked = self._appointments.get(name, [])
+            if new_dt != old_dt and any(appt.datetime == new_dt for appt in booked):
+                return False
+            for appt in booked:
+                if appt.datetime == old_dt:
+                    before = replace(appt)
+                    appt.datetime = new_dt
+                    self._views.invalidate(name)
+                    self._publish("appointment", "rescheduled", appointment_key(name, new_dt), before=before,
+                                  after=appt, session_id=session_id)
+                    return True
+            return False
+
+    @profiled("scheduling_store.appointments_table")
+    def appointments_table(self, name: str) -> Optional[str]:
+        """A patient's appointments as a compact table, rendered once per change; None if they have none"""
+        return self._views.get(name, "appointments", lambda: self._render_appointments(name))
+
+    def _render_appointments(self, name: str) -> Optional[str]:
+        with self._lock:
+            booked = sorted(self._appointments.get(name, []), key=lambda appt: appt.datetime)
+            if not booked:
+                return None
+            return render_table(f"Appointments for {name}", ["date", "time"],
+                                [(f"{appt.datetime:%Y-%m-%d}", f"{appt.datetime:%H:%M}") for appt in booked])
+
+    def counts(self) -> Tuple[int, int]:
+        """Number of patients and of booked appointments"""
+        with self._lock:
+            return len(self._patients), sum(len(appts) for appts in self._appointments.values())
+
+
+class StoreManager(BaseManager):
+    pass
+
+
+_store = None
+
+
+def _shared_store() -> SchedulingStore:
+    global _store
+    if _store is None:
+        _store = SchedulingStore()
+    return _store
+
+
+StoreManager.register("store", callable=_shared_store)
+
+
+def _require_authkey(authkey: Optional[bytes]) -> bytes:
+    if not authkey:
+        raise ValueError("The store needs an authkey; set DENTAL_STORE_AUTHKEY or pass one")
+    return authkey
+
+
+def start_store_server(address=STORE_ADDRESS, authkey: Optional[bytes] = STORE_AUTHKEY) -> StoreManager:
+    """Start the single-writer store in its own process; shut it down with .shutdown()"""
+    authkey = _require_authkey(authkey)
+    manager = StoreManager(address=address, authkey=authkey)
+    # Changes are published in the store process, so the configured sinks are fed from there
+    manager.start(initializer=subscribe_from_env)
+    return manager
+
+
+def connect_store(address=STORE_ADDRESS, authkey: Optional[bytes] = STORE_AUTHKEY):
+    """Proxy to the shared store, for use in a worker process"""
+    authkey = _require_authkey(authkey)
+    manager = StoreManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.store()
@@ -0,0 +1,234 @@
+"""
+Pre-fork HTTP server for the multi-agent assistant
+
+    python server.py [--workers N] [--host 127.0.0.1] [--port 8080]
+    python server.py --bench [--requests 400]
+
+POST /chat with {"session_id": "...", "message": "..."} returns
+{"session_id": "...", "reply": "...", "worker": pid}.
+
+Prompts, tool schemas, agents and the slot-filling patterns are loaded once
+in the parent and the heap is frozen before forking, so workers share those
+pages copy-on-write. Patients and appointments live in one single-writer
+store process that workers reach over IPC; conversations are kept in the
+shared session database, so any worker can serve any turn. Change events are
+published by the store process, which also feeds the DENTAL_CHANGES_* sinks.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import uuid
+import signal
+import socket
+import tempfile
+import asyncio
+import argparse
+import http.client
+import multiprocessing
+from datetime import date, timedelta
+from multiprocessing.connection import wait
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import agentSDK_multiAgent as assistant
+from session_store import SessionStore, DEFAULT_DB_PATH
+from slot_filling import SlotTracker
+from scheduling_store import STORE_ADDRESS, STORE_AUTHKEY, start_store_server, connect_store
+from profiling import TOGGLE_SIGNAL, install_signal_toggle
+from policy_index import policy_index
+
+DEFAULT_PORT = int(os.getenv("DENTAL_SERVER_PORT", "8080"))
+DEFAULT_WORKERS = int(os.getenv("DENTAL_WORKERS", str(os.cpu_count() or 1)))
+
+
+def preload() -> None:
+    """Build everything read-only before forking so workers share it"""
+    try:
+        assistant.get_agents()
+    except ImportError:
+        # Without the agents SDK only the local booking path can answer
+        pass
+    # Index headers are read once here and shared; the segments themselves are mapped from the page cache
+    policy_index.refresh()
+    # Objects that survive until now are never collected; freezing them keeps the
+    # collector from writing to their pages in the workers and un-sharing them
+    gc.collect()
+    gc.freeze()
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/chat":
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            message = body["message"]
+        except (ValueError, KeyError):
+            self.send_error(400, "Expected a JSON body with a message")
+            return
+        session_id = body.get("session_id") or uuid.uuid4().hex
+        try:
+            reply = self.server.worker.turn(session_id, message)
+        except Exception as e:
+            reply = f"Error: {e}"
+        payload = json.dumps({"session_id": session_id, "reply": reply, "worker": os.getpid()}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Worker:
+    """One forked process; handles one turn at a time"""
+
+    def __init__(self, store_address, store_authkey: bytes, session_db: str = DEFAULT_DB_PATH):
+        # Connections must not be shared across fork, so each worker opens its own
+        assistant.use_store(connect_store(store_address, store_authkey))
+        self.sessions = SessionStore(session_db)
+        self.loop = asyncio.new_event_loop()
+        # DENTAL_PROFILE=1 profiles turns from the start; SIGUSR2 toggles it
+        install_signal_toggle()
+
+    def turn(self, session_id: str, message: str) -> str:
+        conversation = assistant.restore(self.sessions, session_id) or []
+        tracker = SlotTracker(slots=assistant.conversation_state.slots)
+        reply, _ = self.loop.run_until_complete(assistant.handle_turn(
+            message, conversation, tracker, session_store=self.sessions, session_id=session_id
+        ))
+        return reply
+
+
+def worker_main(listener: socket.socket, store_address, store_authkey: bytes, session_db: str) -> None:
+    server = HTTPServer(listener.getsockname(), ChatHandler, bind_and_activate=False)
+    server.socket = listener  # Inherited from the parent; workers take turns accepting
+    server.worker = Worker(store_address, store_authkey, session_db)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(workers: int = DEFAULT_WORKERS, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+          store_address=STORE_ADDRESS, session_db: str = DEFAULT_DB_PATH, ready=None) -> None:
+    """Start the store, pre-fork `workers` processes and restart any that die"""
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    # Workers are forked, so a key made here reaches them without leaving the process tree
+    store_authkey = STORE_AUTHKEY or os.urandom(32)
+    manager = start_store_server(store_address, store_authkey)
+    listener = socket.create_server((host, port), backlog=1024)
+    preload()
+    context = multiprocessing.get_context("fork")
+
+    def spawn():
+        process = context.Process(target=worker_main, args=(listener, store_address, store_authkey, session_db),
+                                  daemon=True)
+        process.start()
+        return process
+
+    processes = [spawn() for _ in range(workers)]
+
+    def forward(signum, frame):
+        # One signal to the parent toggles profiling in every worker
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+    if TOGGLE_SIGNAL is not None:
+        signal.signal(TOGGLE_SIGNAL, forward)
+    print(f"Serving on http://{host}:{port}/chat with {workers} workers", flush=True)
+    if ready is not None:
+        ready.set()
+    try:
+        while True:
+            for sentinel in wait([process.sentinel for process in processes]):
+                index = next(i for i, process in enumerate(processes) if process.sentinel == sentinel)
+                processes[index] = spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        listener.close()
+        manager.shutdown()
+
+
+# Benchmark: every request books through the local slot-filling path, so it
+# measures the server itself (parsing, IPC to the store, session checkpoint)
+# rather than model latency.
+
+def _name(i: int) -> str:
+    # Unique "Pat Xyz" names; the name extractor wants surnames of 2+ letters
+    i += 26 * 26
+    letters = ""
+    while True:
+        letters = chr(ord("a") + i % 26) + letters
+        i //= 26
+        if not i:
+            return f"Pat {letters.capitalize()}"
+
+
+# Weekdays inside the booking window, so every request books
+_BENCH_DAYS = [day for day in (date.today() + timedelta(days=n) for n in range(1, 60)) if day.weekday() < 5]
+
+
+def _post(port: int, i: int) -> None:
+    message = (f"I want to book an appointment on {_BENCH_DAYS[i % len(_BENCH_DAYS)]} at 10:00. "
+               f"My name is {_name(i)}, phone 555-123-4567, email patient{i}@example.com")
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("POST", "/chat", json.dumps({"session_id": f"bench-{i}", "message": message}))
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+
+
+def bench(requests: int = 400, max_workers: int = DEFAULT_WORKERS, port: int = DEFAULT_PORT + 1) -> None:
+    counts = sorted({1, *[n for n in (2, 4, 8, 16, 32) if n < max_workers], max_workers})
+    print(f"{os.cpu_count()} CPU cores, {requests} booking requests per run")
+    baseline = None
+    for offset, workers in enumerate(counts):
+        context = multiprocessing.get_context("fork")
+        ready = context.Event()
+        store_address = ("127.0.0.1", STORE_ADDRESS[1] + 1 + offset)
+        session_db = os.path.join(tempfile.mkdtemp(), "sessions.db")
+        server = context.Process(target=serve, args=(workers, "127.0.0.1", port + offset, store_address, session_db, ready))
+        server.start()
+        ready.wait(60)
+        # Warm up every worker before timing
+        with ThreadPoolExecutor(workers * 4) as pool:
+            list(pool.map(lambda i: _post(port + offset, i), range(1_000_000, 1_000_000 + workers * 4)))
+            started = time.perf_counter()
+            list(pool.map(lambda i: _post(port + offset, i), range(offset * requests, (offset + 1) * requests)))
+            elapsed = time.perf_counter() - started
+        server.terminate()
+        server.join()
+        throughput = requests / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:3d} workers: {throughput:8.1f} req/s  speedup {throughput / baseline:4.2f}x  "
+              f"efficiency {throughput / baseline / workers:4.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--bench", action="store_true", help="measure throughput scaling with worker count")
+    parser.add_argument("--requests", type=int, default=400)
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.requests, args.workers)
+    else:
+        serve(args.workers, args.host, args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from profiling import profiled
+
+# Location of the shared session database. Every worker pointing at the same
+# file sees the same sessions, so a conversation can resume on any of them.
+DEFAULT_DB_PATH = os.getenv("DENTAL_SESSION_DB", "sessions.db")
+
+# Number of most recent messages kept verbatim; older ones are folded into the summary
+RECENT_MESSAGES = 6
+SUMMARY_MAX_CHARS = 1200
+SUMMARY_LINE_CHARS = 120
+
+
+def compact_history(history, summary="", keep=RECENT_MESSAGES):
+    """
+    Fold older messages into a short running summary
+
+    Args:
+        history (list): Messages as {"role": ..., "content": ...} dicts
+        summary (str): Summary carried over from earlier checkpoints
+        keep (int): Number of most recent messages kept verbatim
+
+    Returns:
+        tuple: (summary, recent_messages)
+    """
+    if len(history) <= keep:
+        return summary, list(history)
+
+    older, recent = history[:-keep], history[-keep:]
+    lines = [summary] if summary else []
+    for msg in older:
+        content = " ".join(str(msg.get("content", "")).split())
+        lines.append(f"{msg.get('role', 'user')}: {content[:SUMMARY_LINE_CHARS]}")
+
+    # Keep the tail of the summary, the most recent context matters most
+    summary = "\n".join(lines)[-SUMMARY_MAX_CHARS:]
+    return summary, list(recent)
+
+
+class SessionStore:
+    """Key-value store of compact conversation state, keyed by session id."""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets several worker processes read while one writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @profiled("session_store.load")
+    def load(self, session_id):
+        """Return the stored state for a session, or None if it is unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @profiled("session_store.save")
+    def save(self, session_id, state):
+        """Checkpoint the state of a session, replacing any previous checkpoint."""
+        payload = json.dumps(state, default=str, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, payload, time.time()),
+            )
+            self._conn.commit()
+
+    @profiled("session_store.set_field")
+    def set_field(self, session_id, key, value):
+        """
+        Set one top-level field of a stored state without marking the session as updated.
+
+        For annotations made about a conversation (a nightly summary) rather
+        than by it, so updated_since() does not select the session again.
+        Returns False if the session is unknown.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE sessions SET state = json_set(state, ?, json(?)) WHERE session_id = ?",
+                (f"$.{key}", json.dumps(value, default=str), session_id),
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    @profiled("session_store.updated_since")
+    def updated_since(self, since):
+        """Return (session_id, state) for every session checkpointed at or after `since` (epoch seconds)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, state FROM sessions WHERE updated_at >= ? ORDER BY updated_at", (since,)
+            ).fetchall()
+        return [(session_id, json.loads(state)) for session_id, state in rows]
+
+    @profiled("session_store.delete")
+    def delete(self, session_id):
+        """Forget a session."""
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,350 @@
+import re
+from datetime import date, datetime, timedelta
+
+# Service names used when the caller does not pass its own practice_info services
+DEFAULT_SERVICES = ["Cleaning", "Check-up", "Fillings", "Root Canal", "Crown", "Extraction"]
+
+# Slots needed before a booking can be made without asking the model
+BOOKING_SLOTS = ("patient_name", "phone", "service", "requested_date", "requested_time")
+
+# Other ways patients refer to our services
+SERVICE_ALIASES = {
+    "checkup": "Check-up",
+    "check up": "Check-up",
+    "exam": "Check-up",
+    "filling": "Fillings",
+    "cavity": "Fillings",
+    "pull": "Extraction",
+    "extract": "Extraction",
+    "root canal": "Root Canal",
+    "clean": "Cleaning",
+}
+
+# Booking rules for booking_problems(); assistants pass their own practice's
+DEFAULT_BOOKING_RULES = {
+    "hours": "Monday-Friday: 9:00 AM - 6:00 PM",
+    "open_days": range(0, 5),  # Monday to Friday
+    "opening_time": "09:00",
+    "closing_time": "18:00",
+    "booking_window_days": 90,
+}
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+
+# Checked in order: "reschedule" must win over "schedule"
+INTENT_PATTERNS = [
+    ("reschedule", re.compile(r"\b(reschedul\w*|move my appointment|change my appointment)\b", re.I)),
+    ("cancel", re.compile(r"\bcancel\w*\b", re.I)),
+    ("history", re.compile(r"\b(my appointments|appointment history|show my|view my)\b", re.I)),
+    ("book", re.compile(r"\b(book\w*|schedul\w*|make an appointment|new appointment)\b", re.I)),
+]
+
+# Messages longer than this with no recognised request are treated as uncertain
+LONG_MESSAGE_WORDS = 40
+
+PHONE_RE = re.compile(r"(?<!\d)(?:\+?1[\s.-]?)?\(?(\d{3})\)?[\s.-]?(\d{3})[\s.-]?(\d{4})(?!\d)")
+EMAIL_RE = re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b")
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+DMY_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+MONTH_DAY_RE = re.compile(r"\b(" + "|".join(MONTHS) + r")[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?\b", re.I)
+DAY_MONTH_RE = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?(" + "|".join(MONTHS) + r")[a-z]*\b", re.I)
+WEEKDAY_RE = re.compile(r"\b(?:(next|this|on)\s+)?(" + "|".join(WEEKDAYS) + r")\b", re.I)
+CLOCK_RE = re.compile(r"\b(\d{1,2}):(\d{2})\s*([ap]\.?m\.?)?(?![\w:])", re.I)
+MERIDIEM_RE = re.compile(r"\b(\d{1,2})\s*([ap]\.?m\.?)(?!\w)", re.I)
+AT_HOUR_RE = re.compile(r"\bat\s+(\d{1,2})\b(?![:/.\-\d])", re.I)
+NAME_RE = re.compile(
+    r"\b(my name is|name is|name:|i am|i'm|this is)\s+"
+    r"([A-Za-z][A-Za-z'\-]+(?:\s+[A-Za-z][A-Za-z'\-]+){0,2})",
+    re.I
+)
+# Words that end a name, or show that "I am ..." was not followed by a name
+NAME_STOPWORDS = {
+    "a", "an", "the", "and", "at", "on", "for", "my", "phone", "email", "from", "with",
+    "looking", "available", "new", "calling", "interested", "here", "trying", "not",
+    "free", "wondering", "going", "hoping", "existing", "booking", "in",
+    "to", "please", "would", "need", "want", "just", "also", "still", "sorry", "ready",
+}
+
+
+def detect_intent(text):
+    """Return 'book', 'reschedule', 'cancel' or 'history' if the text asks for one."""
+    for intent, pattern in INTENT_PATTERNS:
+        if pattern.search(text):
+            return intent
+    return None
+
+
+def intent_confidence(text):
+    """
+    How clearly the text maps to a single request, 0..1
+
+    Model policy escalates below ESCALATION_CONFIDENCE: a message that asks
+    for several things at once ("cancel Tuesday and book Friday") or a long
+    one with no request we recognise is left to the large tier.
+    """
+    intents = {intent for intent, pattern in INTENT_PATTERNS if pattern.search(text)}
+    if len(intents) > 1:
+        return 0.4
+    if intents:
+        return 0.9
+    # Replies to a question ("yes", a phone number) and FAQs are short
+    return 0.8 if len(text.split()) <= LONG_MESSAGE_WORDS else 0.5
+
+
+def extract_phone(text):
+    """Return the first 10-digit phone number in the text, digits only."""
+    match = PHONE_RE.search(text)
+    return "".join(match.groups()) if match else None
+
+
+def extract_email(text):
+    match = EMAIL_RE.search(text)
+    return match.group(0).lower() if match else None
+
+
+def _next_weekday(today, weekday):
+    days_ahead = (weekday - today.weekday()) % 7 or 7
+    return today + timedelta(days=days_ahead)
+
+
+def _month_day(today, month, day):
+    try:
+        candidate = date(today.year, month, day)
+    except ValueError:
+        return None
+    if candidate < today:
+        try:
+            candidate = date(today.year + 1, month, day)
+        except ValueError:
+            return None
+    return candidate
+
+
+def extract_date(text, today=None):
+    """
+    Parse the first date mentioned in the text
+
+    Understands YYYY-MM-DD, DD/MM/YYYY, "today", "tomorrow", weekday names
+    ("Friday", "next Tuesday") and month names ("Nov 3", "3rd of November").
+
+    Returns:
+        date: The parsed date, or None
+    """
+    today = today or date.today()
+    lowered = text.lower()
+
+    match = ISO_DATE_RE.search(text)
+    if match:
+        try:
+            return date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    match = DMY_DATE_RE.search(text)
+    if match:
+        day, month, year = map(int, match.groups())
+        try:
+            return date(year, month, day)
+        except ValueError:
+            pass
+    if re.search(r"\btoday\b", lowered):
+        return today
+    if re.search(r"\btomorrow\b", lowered):
+        return today + timedelta(days=1)
+    match = MONTH_DAY_RE.search(text)
+    if match:
+        return _month_day(today, MONTHS.index(match.group(1)[:3].lower()) + 1, int(match.group(2)))
+    match = DAY_MONTH_RE.search(text)
+    if match:
+        return _month_day(today, MONTHS.index(match.group(2)[:3].lower()) + 1, int(match.group(1)))
+    match = WEEKDAY_RE.search(text)
+    if match:
+        return _next_weekday(today, WEEKDAYS.index(match.group(2).lower()))
+    return None
+
+
+def _to_24h(hour, minute, meridiem):
+    if meridiem:
+        meridiem = meridiem[0].lower()
+        if meridiem == "p" and hour < 12:
+            hour += 12
+        elif meridiem == "a" and hour == 12:
+            hour = 0
+    elif 1 <= hour <= 7:
+        # "at 3" during business hours means the afternoon
+        hour += 12
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def extract_time(text):
+    """Return the first time mentioned in the text as HH:MM (24-hour), or None."""
+    match = CLOCK_RE.search(text)
+    if match:
+        return _to_24h(int(match.group(1)), int(match.group(2)), match.group(3))
+    match = MERIDIEM_RE.search(text)
+    if match:
+        return _to_24h(int(match.group(1)), 0, match.group(2))
+    match = AT_HOUR_RE.search(text)
+    if match:
+        return _to_24h(int(match.group(1)), 0, None)
+    return None
+
+
+def extract_service(text, services=DEFAULT_SERVICES):
+    """Return the service from `services` the text refers to, or None."""
+    lowered = text.lower()
+    for service in services:
+        name = service.lower()
+        variants = {name, name.rstrip("s"), name.replace("-", " "), name.replace("-", "")}
+        if any(re.search(r"\b" + re.escape(variant) + r"\b", lowered) for variant in variants):
+            return service
+    for alias, service in SERVICE_ALIASES.items():
+        if service in services and re.search(r"\b" + re.escape(alias), lowered):
+            return service
+    return None
+
+
+def extract_name(text):
+    """Return a patient name introduced with "my name is", "I'm", etc., or None."""
+    for match in NAME_RE.finditer(text):
+        lead, candidate = match.group(1).lower(), match.group(2)
+        words = []
+        for word in candidate.split():
+            if word.lower() in NAME_STOPWORDS:
+                break
+            words.append(word)
+        if not words:
+            continue
+        # "I'm looking..." is not a name; after "I'm" only accept capitalised words
+        if lead in ("i am", "i'm", "this is") and not words[0][0].isupper():
+            continue
+        return " ".join(word.capitalize() for word in words)
+    return None
+
+
+def extract_entities(text, services=DEFAULT_SERVICES, today=None):
+    """
+    Pull every slot value the text contains
+
+    Returns:
+        dict: Slot name -> value. Dates are ISO (YYYY-MM-DD) and times HH:MM
+    """
+    found = {
+        "intent": detect_intent(text),
+        "patient_name": extract_name(text),
+        "phone": extract_phone(text),
+        "email": extract_email(text),
+        "service": extract_service(text, services),
+        "requested_time": extract_time(text),
+    }
+    requested_date = extract_date(text, today)
+    if requested_date:
+        found["requested_date"] = requested_date.isoformat()
+    return {slot: value for slot, value in found.items() if value}
+
+
+def booking_problems(requested_date, requested_time, rules=DEFAULT_BOOKING_RULES, duration=0,
+                     service=None, today=None):
+    """
+    Check a requested slot against a practice's hours and booking rules
+
+    Args:
+        requested_date: Appointment date (YYYY-MM-DD)
+        requested_time: Appointment time (HH:MM)
+        rules: hours, open_days, opening_time, closing_time and booking_window_days
+        duration: Minutes the appointment takes; it must end by closing time
+        service: Named in the reason when the appointment would run past closing
+
+    Returns:
+        dict: "requested_date" and/or "requested_time" -> why it can't be booked; empty if it can
+    """
+    problems = {}
+    today = today or date.today()
+    try:
+        day = datetime.strptime(requested_date, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        problems["requested_date"] = "I couldn't read that date."
+    else:
+        if day < today:
+            problems["requested_date"] = "that date has already passed."
+        elif day > today + timedelta(days=rules["booking_window_days"]):
+            problems["requested_date"] = f"we only book up to {rules['booking_window_days']} days ahead."
+        elif day.weekday() not in rules["open_days"]:
+            problems["requested_date"] = f"we're closed on {day:%A}s."
+
+    try:
+        start = datetime.strptime(requested_time, "%H:%M")
+    except (TypeError, ValueError):
+        problems["requested_time"] = "I couldn't read that time."
+        return problems
+    opening = datetime.strptime(rules["opening_time"], "%H:%M")
+    closing = datetime.strptime(rules["closing_time"], "%H:%M")
+    if start < opening or start >= closing:
+        problems["requested_time"] = f"{requested_time} is outside our hours ({rules['hours']})."
+    elif start + timedelta(minutes=duration) > closing:
+        problems["requested_time"] = (f"{'a ' + service if service else 'the appointment'} at {requested_time} "
+                                      f"would run past closing; it has to finish by {rules['closing_time']}.")
+    return problems
+
+
+class SlotTracker:
+    """Deterministic dialogue-state tracker that fills booking slots across turns."""
+
+    def __init__(self, services=DEFAULT_SERVICES, slots=None, today=None):
+        self.services = list(services)
+        # Shared with the caller's session state so it is checkpointed with it
+        self.slots = slots if slots is not None else {}
+        self.today = today
+
+    def update(self, text):
+        """
+        Fill slots from a user message
+
+        Returns:
+            dict: The slots this message filled or changed
+        """
+        found = extract_entities(text, self.services, self.today)
+        changed = {slot: value for slot, value in found.items() if self.slots.get(slot) != value}
+        self.slots.update(changed)
+        return changed
+
+    def missing(self, required=BOOKING_SLOTS):
+        return [slot for slot in required if not self.slots.get(slot)]
+
+    def is_complete(self, required=BOOKING_SLOTS):
+        return not self.missing(required)
+
+    def next_question(self, required=BOOKING_SLOTS):
+        """Templated question for the first missing slot, or None when all are filled."""
+        missing = self.missing(required)
+        if not missing:
+            return None
+        questions = {
+            "patient_name": "May I have your full name, please?",
+            "phone": "What is the best phone number to reach you?",
+            "email": "What email address should we use for your confirmation?",
+            "service": f"Which service would you like? We offer {', '.join(self.services)}.",
+            "requested_date": "What day would you like to come in?",
+            "requested_time": "What time works best for you? We're open 9:00 AM to 6:00 PM.",
+        }
+        return questions[missing[0]]
+
+    def reask(self, problems, required=BOOKING_SLOTS):
+        """Forget the slots booking_problems() rejected and ask for them again"""
+        for slot in problems:
+            self.slots.pop(slot, None)
+        return f"Sorry, {' '.join(problems.values())} {self.next_question(required)}"
+
+    def describe_date(self):
+        """Human readable form of the requested date, e.g. 'Tuesday, November 03'."""
+        value = self.slots.get("requested_date")
+        if not value:
+            return None
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%A, %B %d")
+
+    def clear_request(self):
+        """Forget the finished request but keep who the patient is."""
+        for slot in ("intent", "service", "requested_date", "requested_time"):
+            self.slots.pop(slot, None)
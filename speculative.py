@@ -0,0 +1,189 @@
+import os
+import asyncio
+import threading
+import contextlib
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from agents import Agent
+
+# Specialist most likely to handle each conversation topic (see context_slicing)
+TOPIC_AGENTS = {
+    "book": "Booking Agent",
+    "reschedule": "Rescheduling Agent",
+    "cancel": "Cancellation Agent",
+    "history": "Cancellation Agent",
+    "faq": "FAQ Agent",
+}
+
+# Tokens we are willing to throw away on wrong guesses before speculation switches off
+DEFAULT_TOKEN_BUDGET = int(os.getenv("DENTAL_SPECULATIVE_TOKEN_BUDGET", "20000"))
+
+
+class Speculation:
+    """
+    Shared by the two runs of a speculative turn
+
+    Mutating tools must not act until we know which run's answer is used:
+    the speculative run never mutates (its answer may be thrown away), and
+    the router's run waits for the decision.
+    """
+
+    def __init__(self):
+        self.tainted = False
+        self.abandoned = False
+        self.decided = threading.Event()
+
+    def decide(self, use_router: bool) -> None:
+        self.abandoned = not use_router
+        self.decided.set()
+
+
+current_speculation: ContextVar[Optional[Speculation]] = ContextVar("current_speculation", default=None)
+is_speculative: ContextVar[bool] = ContextVar("is_speculative", default=False)
+
+# Upper bound on how long the router's tools wait for the speculative run
+DECISION_TIMEOUT = 60
+
+
+def mutation_blocked() -> bool:
+    """
+    Called by tools that change patients or appointments, from a worker thread
+
+    Returns:
+        bool: True if the tool must not apply its change
+    """
+    speculation = current_speculation.get()
+    if speculation is None:
+        return False
+    if is_speculative.get():
+        # Mark the speculative answer unusable; the router's run will do the work
+        speculation.tainted = True
+        return True
+    speculation.decided.wait(DECISION_TIMEOUT)
+    return speculation.abandoned
+
+
+def predict_agent(topic: Optional[str], previous_agent: Optional[str]) -> Optional[str]:
+    """Cheap local guess of the specialist the router will pick"""
+    return TOPIC_AGENTS.get(topic) or previous_agent
+
+
+@dataclass
+class SpeculationStats:
+    attempts: int = 0
+    hits: int = 0
+    misses: int = 0
+    unusable: int = 0
+    skipped_budget: int = 0
+    wasted_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    def summary(self) -> str:
+        return (f"speculation: {self.hits}/{self.attempts} hits ({self.hit_rate:.0%}), "
+                f"{self.misses} misses, {self.unusable} unusable, "
+                f"{self.skipped_budget} skipped over budget, {self.wasted_tokens} tokens wasted")
+
+
+def _estimate_tokens(items: List[Dict]) -> int:
+    # Roughly four characters per token, used when a cancelled run reports no usage
+    return sum(len(str(item.get("content", ""))) for item in items) // 4
+
+
+class SpeculativeRunner:
+    """
+    Runs the router and the predicted specialist at the same time
+
+    When the router hands off to the predicted specialist, the router run is
+    cancelled and the speculative result is used, saving one model round trip.
+    Otherwise the speculative run is cancelled and the router continues.
+    """
+
+    def __init__(self, router: "Agent", specialists: List["Agent"], token_budget: int = DEFAULT_TOKEN_BUDGET):
+        # Imported here so importing this module doesn't load the agents SDK
+        from agents import Runner
+        self.runner = Runner
+        self.router = router
+        self.specialists = {agent.name: agent for agent in specialists}
+        self.token_budget = token_budget
+        self.stats = SpeculationStats()
+
+    async def _speculate(self, agent: "Agent", specialist_input: List[Dict]):
+        is_speculative.set(True)
+        return await self.runner.run(agent, specialist_input)
+
+    async def _usable_result(self, task: asyncio.Task, speculation: Speculation):
+        """The speculative result, or None if it failed or wanted to mutate state"""
+        try:
+            result = await task
+        except Exception:
+            return None
+        return None if speculation.tainted else result
+
+    async def _cancel(self, task: asyncio.Task, specialist_input: List[Dict]) -> None:
+        if task.done():
+            if not task.cancelled() and task.exception() is None:
+                self.stats.wasted_tokens += task.result().context_wrapper.usage.total_tokens
+            return
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await task
+        self.stats.wasted_tokens += _estimate_tokens(specialist_input)
+
+    async def run(self, router_input: List[Dict], predicted: Optional[str], specialist_input: List[Dict]):
+        """
+        Run one turn, speculating on `predicted` if it is a known specialist
+
+        Returns:
+            The run result of whichever path produced the answer
+        """
+        agent = self.specialists.get(predicted)
+        if agent is None:
+            return await self.runner.run(self.router, router_input)
+        if self.stats.wasted_tokens >= self.token_budget:
+            self.stats.skipped_budget += 1
+            return await self.runner.run(self.router, router_input)
+
+        self.stats.attempts += 1
+        speculation = Speculation()
+        # Both runs copy this context when their tasks are created
+        token = current_speculation.set(speculation)
+        try:
+            task = asyncio.create_task(self._speculate(agent, specialist_input))
+            routed = self.runner.run_streamed(self.router, router_input)
+        finally:
+            current_speculation.reset(token)
+
+        try:
+            async for event in routed.stream_events():
+                if event.type != "agent_updated_stream_event" or event.new_agent.name == self.router.name:
+                    continue
+                if event.new_agent.name == predicted:
+                    result = await self._usable_result(task, speculation)
+                    if result is not None:
+                        speculation.decide(use_router=False)
+                        routed.cancel()
+                        self.stats.hits += 1
+                        return result
+                    self.stats.unusable += 1
+                else:
+                    self.stats.misses += 1
+                break
+            else:
+                # The router answered on its own without handing off
+                self.stats.misses += 1
+            speculation.decide(use_router=True)
+            await self._cancel(task, specialist_input)
+            # Let the router's own specialist finish the turn
+            async for _ in routed.stream_events():
+                pass
+            return routed
+        except BaseException:
+            speculation.decide(use_router=False)
+            await self._cancel(task, specialist_input)
+            raise
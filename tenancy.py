@@ -0,0 +1,417 @@
+"""
+Multi-clinic tenancy
+
+    python tenancy.py [clinics.json] nearest <service> [after YYYY-MM-DD HH:MM]
+
+Each clinic is a shard with its own practice config, patient and appointment
+partition, slot index, session database and worker threads. A ClinicRouter
+pins every session to the shard that owns its clinic, so a busy or large
+clinic only queues behind itself. Cross-clinic "nearest available slot"
+queries fan out to every shard in parallel and merge the answers; a shard
+that does not answer within FANOUT_TIMEOUT is left out rather than holding
+up the rest.
+
+clinics.json is a list of clinic objects:
+
+    [{"id": "downtown", "name": "Smile Bright Downtown", "location": "...",
+      "phone": "...", "open": "08:00", "close": "17:00", "days": [0, 1, 2, 3, 4],
+      "chairs": 3}]
+
+Fields that are left out ("services", "faqs", hours) come from
+DEFAULT_PRACTICE_INFO.
+
+A clinic with its own policy documents keeps them in DATA_DIR/<clinic
+id>/policies/; the others answer from the shared POLICY_DOCS.
+"""
+import os
+import sys
+import json
+import copy
+import heapq
+import itertools
+import sqlite3
+import threading
+from bisect import insort
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from dental_assistant import DentalAssistant, DEFAULT_PRACTICE_INFO
+from session_store import SessionStore
+from policy_index import PolicyIndex, policy_index
+
+CLINICS_FILE = os.getenv("DENTAL_CLINICS_FILE", "clinics.json")
+# Each clinic's sessions.db and exports live under DATA_DIR/<clinic id>/
+DATA_DIR = os.getenv("DENTAL_CLINIC_DATA", "clinics")
+
+# Worker threads per clinic; a clinic's turns never wait on another clinic's threads
+SHARD_THREADS = int(os.getenv("DENTAL_SHARD_THREADS", "4"))
+# Conversations each clinic keeps in memory; older ones are resumed from sessions.db
+SESSION_CACHE = int(os.getenv("DENTAL_SESSION_CACHE", "1024"))
+# Seconds a cross-clinic query waits for the slowest shard
+FANOUT_TIMEOUT = float(os.getenv("DENTAL_FANOUT_TIMEOUT", "2.0"))
+
+SLOT_STEP = 15       # Minutes between candidate start times
+BOOKING_HORIZON = 90  # Days ahead that can be booked, as in validate_appointment_time
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+@dataclass
+class ClinicConfig:
+    clinic_id: str
+    practice_info: Dict
+    open: int = 9 * 60      # Minutes after midnight
+    close: int = 18 * 60
+    days: Tuple[int, ...] = (0, 1, 2, 3, 4)
+    chairs: int = 1         # Appointments that can overlap
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ClinicConfig":
+        practice_info = copy.deepcopy(DEFAULT_PRACTICE_INFO)
+        practice_info.update({key: data[key] for key in ("name", "hours", "services", "location", "phone", "faqs")
+                              if key in data})
+        return cls(
+            clinic_id=str(data["id"]),
+            practice_info=practice_info,
+            open=_minutes(data.get("open", "09:00")),
+            close=_minutes(data.get("close", "18:00")),
+            days=tuple(data.get("days", (0, 1, 2, 3, 4))),
+            chairs=int(data.get("chairs", 1)),
+        )
+
+    def duration(self, service: str) -> int:
+        return int(self.practice_info["services"][service]["duration"])
+
+
+def load_clinics(path: str = CLINICS_FILE) -> List[ClinicConfig]:
+    """Read clinic configs; without a config file there is one clinic with the default practice info"""
+    if not os.path.exists(path):
+        return [ClinicConfig("main", copy.deepcopy(DEFAULT_PRACTICE_INFO))]
+    with open(path) as f:
+        return [ClinicConfig.from_dict(data) for data in json.load(f)]
+
+
+class SlotIndex:
+    """
+    Booked intervals per day for one clinic
+
+    Kept in step with every booking, cancellation and reschedule, so a free
+    slot is found from the day's few intervals instead of scanning all
+    appointments the clinic has ever had.
+    """
+
+    def __init__(self, chairs: int = 1):
+        self.chairs = chairs
+        self._days: Dict[date, List[Tuple[int, int, int]]] = {}  # day -> sorted (start, end, appointment id)
+        self._where: Dict[int, Tuple[date, Tuple[int, int, int]]] = {}
+
+    def add(self, appointment_id: int, day: date, start: int, end: int) -> None:
+        self.remove(appointment_id)
+        interval = (start, end, appointment_id)
+        insort(self._days.setdefault(day, []), interval)
+        self._where[appointment_id] = (day, interval)
+
+    def remove(self, appointment_id: int) -> None:
+        found = self._where.pop(appointment_id, None)
+        if found:
+            day, interval = found
+            self._days[day].remove(interval)
+
+    def is_free(self, day: date, start: int, end: int, ignore: Optional[int] = None) -> bool:
+        """True if fewer than `chairs` appointments overlap [start, end)"""
+        overlapping = 0
+        for booked_start, booked_end, appointment_id in self._days.get(day, ()):
+            if booked_start >= end:
+                break
+            if booked_end > start and appointment_id != ignore:
+                overlapping += 1
+        return overlapping < self.chairs
+
+    def next_free(self, config: ClinicConfig, duration: int, after: datetime, limit: int = 1,
+                  horizon: int = BOOKING_HORIZON) -> List[datetime]:
+        """The first `limit` start times at or after `after` with room for `duration` minutes"""
+        found = []
+        first_day = after.date()
+        for offset in range(horizon + 1):
+            day = first_day + timedelta(days=offset)
+            if day.weekday() not in config.days:
+                continue
+            start = config.open
+            if day == first_day:
+                # Round up onto the clinic's slot grid
+                late = max(0, after.hour * 60 + after.minute - config.open)
+                start = config.open + (late + SLOT_STEP - 1) // SLOT_STEP * SLOT_STEP
+            while start + duration <= config.close:
+                if self.is_free(day, start, start + duration):
+                    found.append(datetime.combine(day, datetime.min.time()) + timedelta(minutes=start))
+                    if len(found) == limit:
+                        return found
+                start += SLOT_STEP
+        return found
+
+
+class ClinicShard:
+    """One clinic's partition: its patients, appointments, slot index, sessions and threads"""
+
+    def __init__(self, config: ClinicConfig, data_dir: str = DATA_DIR, reminders=None):
+        self.config = config
+        self.directory = os.path.join(data_dir, config.clinic_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.sessions = SessionStore(os.path.join(self.directory, "sessions.db"))
+        self.slots = SlotIndex(config.chairs)
+        # Policy documents in the clinic's own policies/ directory, else the shared ones
+        clinic_docs = os.path.join(self.directory, "policies")
+        self.policies = (PolicyIndex(clinic_docs, os.path.join(self.directory, "policy_index"))
+                         if os.path.isdir(clinic_docs) else policy_index)
+        self.executor = ThreadPoolExecutor(SHARD_THREADS, thread_name_prefix=f"clinic-{config.clinic_id}")
+        self._sessions: "OrderedDict[str, ClinicAssistant]" = OrderedDict()
+        self._busy: Dict[str, int] = {}  # Turns running or waiting per session; those are never evicted
+        self._sessions_lock = threading.Lock()
+        # Owns the clinic's records; per-session assistants share them
+        self.records = ClinicAssistant(self, reminders=reminders)
+
+    def assistant(self, session_id: Optional[str] = None) -> "ClinicAssistant":
+        """The assistant for one conversation, backed by this clinic's records and kept between its turns"""
+        if session_id is None:
+            return ClinicAssistant(self, None, self.sessions, self.records.reminders)
+        with self._sessions_lock:
+            return self._cached(session_id)
+
+    def _cached(self, session_id: str) -> "ClinicAssistant":
+        # Callers hold self._sessions_lock
+        assistant = self._sessions.get(session_id)
+        if assistant is None:
+            assistant = ClinicAssistant(self, session_id, self.sessions, self.records.reminders)
+            self._sessions[session_id] = assistant
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return assistant
+
+    def _evict(self) -> None:
+        # Least recently used first, skipping sessions with a turn in progress, so
+        # a second assistant is never built for a conversation that is still running
+        idle = (session_id for session_id in self._sessions if session_id not in self._busy)
+        for session_id in list(itertools.islice(idle, max(0, len(self._sessions) - SESSION_CACHE))):
+            del self._sessions[session_id]
+
+    def turn(self, session_id: str, user_input: str) -> str:
+        """One turn of a conversation; runs on the shard's threads, one turn per session at a time"""
+        with self._sessions_lock:
+            self._busy[session_id] = self._busy.get(session_id, 0) + 1
+            assistant = self._cached(session_id)
+        try:
+            with assistant.turn_lock:
+                return assistant.respond(user_input)
+        finally:
+            with self._sessions_lock:
+                self._busy[session_id] -= 1
+                if not self._busy[session_id]:
+                    del self._busy[session_id]
+                self._evict()
+
+    def nearest_slots(self, service: str, after: datetime, limit: int = 1) -> List[datetime]:
+        with self.records._lock:
+            return self.slots.next_free(self.config, self.config.duration(service), after, limit)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.sessions.close()
+
+
+class ClinicAssistant(DentalAssistant):
+    """DentalAssistant bound to a clinic: its practice info, hours, chair count and shared records"""
+
+    def __init__(self, shard: ClinicShard, session_id=None, session_store=None, reminders=None):
+        self.shard = shard
+        super().__init__(session_id, session_store, reminders, shard.config.practice_info)
+        self.change_source = f"clinic:{shard.config.clinic_id}"
+        self.turn_lock = threading.Lock()  # Turns of one conversation run in order
+        self.policies = shard.policies
+        records = getattr(shard, "records", None)
+        if records is not None:
+            self.patients = records.patients
+            self.patient_index = records.patient_index
+            self.appointments = records.appointments
+            self.analytics = records.analytics
+            self.render_cache = records.render_cache
+            self._lock = records._lock
+
+    def _interval(self, date_str: str, time_str: str, service: str) -> Tuple[date, int, int]:
+        day = datetime.strptime(date_str, "%d/%m/%Y").date()
+        start = _minutes(time_str)
+        return day, start, start + self.shard.config.duration(service)
+
+    def validate_appointment_time(self, date_str, time_str=None):
+        """Validate the appointment date and time against this clinic's opening days and hours."""
+        config = self.shard.config
+        try:
+            day = datetime.strptime(date_str, "%d/%m/%Y").date()
+            start = _minutes(datetime.strptime(time_str, "%H:%M").strftime("%H:%M")) if time_str else None
+        except ValueError:
+            return False, "Invalid date/time format."
+        today = datetime.now().date()
+        if day < today:
+            return False, "Cannot book appointments in the past."
+        if day > today + timedelta(days=BOOKING_HORIZON):
+            return False, f"Appointments can only be booked up to {BOOKING_HORIZON} days in advance."
+        if day.weekday() not in config.days:
+            return False, f"{config.practice_info['name']} is closed on {DAY_NAMES[day.weekday()]}s."
+        if start is not None and not config.open <= start < config.close:
+            return False, (f"Appointments are only available between {config.open // 60}:{config.open % 60:02d} "
+                           f"and {config.close // 60}:{config.close % 60:02d}.")
+        return True, None
+
+    def past_closing(self, end: int, service: str) -> Optional[str]:
+        """Why an appointment ending at `end` minutes can't be booked, or None if it ends by closing time."""
+        close = self.shard.config.close
+        if end <= close:
+            return None
+        return f"A {service} takes {self.shard.config.duration(service)} minutes and must finish by {close // 60}:{close % 60:02d}."
+
+    def book_appointment(self, patient_id, date, time, service):
+        """Book an appointment if it ends by closing time and a chair is free."""
+        with self._lock:
+            try:
+                day, start, end = self._interval(date, time, service)
+            except ValueError:
+                return None, "Invalid date/time format."
+            is_valid, error_msg = self.validate_appointment_time(date, time)
+            if not is_valid:
+                return None, error_msg
+            error_msg = self.past_closing(end, service)
+            if error_msg:
+                return None, error_msg
+            if not self.shard.slots.is_free(day, start, end):
+                return None, "That time is fully booked. Please choose another time."
+            return super().book_appointment(patient_id, date, time, service)
+
+    def reschedule_appointment(self, appointment_id, new_date, new_time):
+        """Reschedule an appointment if a chair is free at the new time."""
+        with self._lock:
+            appointment = self.appointments.get(appointment_id)
+            if appointment is not None and appointment["status"] == "scheduled":
+                try:
+                    day, start, end = self._interval(new_date, new_time, appointment["service"])
+                except ValueError:
+                    return False, "Invalid date/time format."
+                is_valid, error_msg = self.validate_appointment_time(new_date, new_time)
+                if not is_valid:
+                    return False, error_msg
+                error_msg = self.past_closing(end, appointment["service"])
+                if error_msg:
+                    return False, error_msg
+                if not self.shard.slots.is_free(day, start, end, ignore=appointment_id):
+                    return False, "That time is fully booked. Please choose another time."
+            return super().reschedule_appointment(appointment_id, new_date, new_time)
+
+    def appointment_changed(self, event, before, after):
+        """Keep the slot index, reminders and analytics in step with a change."""
+        if event == "cancelled":
+            self.shard.slots.remove(after["id"])
+        else:
+            self.shard.slots.add(after["id"], *self._interval(after["date"], after["time"], after["service"]))
+        super().appointment_changed(event, before, after)
+
+
+class ClinicRouter:
+    """
+    Sends each session to the shard that owns its clinic
+
+    The session -> clinic mapping is kept in routes.db under the data
+    directory, so a conversation resumed later (or by another process) lands
+    on the same clinic's data.
+    """
+
+    def __init__(self, clinics: Optional[List[ClinicConfig]] = None, data_dir: str = DATA_DIR,
+                 routes_db: Optional[str] = None):
+        clinics = clinics if clinics is not None else load_clinics()
+        self.shards: Dict[str, ClinicShard] = {config.clinic_id: ClinicShard(config, data_dir) for config in clinics}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(routes_db or os.path.join(data_dir, "routes.db"), timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS routes (session_id TEXT PRIMARY KEY, clinic_id TEXT NOT NULL)")
+        self._conn.commit()
+
+    def shard(self, session_id: str, clinic_id: Optional[str] = None) -> ClinicShard:
+        """The shard for a session; a new session must name its clinic"""
+        with self._lock:
+            row = self._conn.execute("SELECT clinic_id FROM routes WHERE session_id = ?", (session_id,)).fetchone()
+            if row:
+                if clinic_id and clinic_id != row[0]:
+                    raise ValueError(f"Session {session_id} belongs to clinic {row[0]}, not {clinic_id}")
+                return self.shards[row[0]]
+            if clinic_id not in self.shards:
+                raise KeyError(f"Unknown clinic: {clinic_id}")
+            self._conn.execute("INSERT INTO routes VALUES (?, ?)", (session_id, clinic_id))
+            self._conn.commit()
+            return self.shards[clinic_id]
+
+    def submit(self, session_id: str, user_input: str, clinic_id: Optional[str] = None):
+        """Queue one turn on the owning clinic's threads; returns a future with the reply"""
+        shard = self.shard(session_id, clinic_id)
+        # respond(), not generate_response(): the CLI flows would prompt on the server's stdin
+        return shard.executor.submit(shard.turn, session_id, user_input)
+
+    def turn(self, session_id: str, user_input: str, clinic_id: Optional[str] = None) -> str:
+        return self.submit(session_id, user_input, clinic_id).result()
+
+    def nearest_slots(self, service: str, after: Optional[datetime] = None, limit: int = 5,
+                      clinics: Optional[List[str]] = None, timeout: float = FANOUT_TIMEOUT) -> Dict:
+        """
+        Earliest free slots for a service across clinics
+
+        Returns:
+            dict: "slots", a time-ordered list of (datetime, clinic id), and
+                "missing", the clinics that did not answer in time
+        """
+        after = after or datetime.now()
+        shards = [self.shards[clinic_id] for clinic_id in (clinics or self.shards)]
+        futures = {
+            shard.executor.submit(shard.nearest_slots, service, after, limit): shard.config.clinic_id
+            for shard in shards if service in shard.config.practice_info["services"]
+        }
+        done, pending = wait(futures, timeout=timeout)
+        per_clinic = [[(when, futures[future]) for when in future.result()]
+                      for future in done if future.exception() is None]
+        slots = list(heapq.merge(*per_clinic))[:limit]
+        missing = sorted(futures[future] for future in pending) + sorted(
+            futures[future] for future in done if future.exception() is not None)
+        return {"slots": slots, "missing": missing}
+
+    def close(self) -> None:
+        for shard in self.shards.values():
+            shard.close()
+        self._conn.close()
+
+
+def main():
+    args = sys.argv[1:]
+    path = args.pop(0) if args and args[0].endswith(".json") else CLINICS_FILE
+    if len(args) < 2 or args[0] != "nearest":
+        print(__doc__)
+        return 1
+    service = args[1]
+    after = datetime.strptime(" ".join(args[2:4]), "%Y-%m-%d %H:%M") if len(args) >= 4 else None
+    router = ClinicRouter(load_clinics(path))
+    try:
+        result = router.nearest_slots(service, after)
+        for when, clinic_id in result["slots"]:
+            info = router.shards[clinic_id].config.practice_info
+            print(f"{when:%a %d/%m/%Y %H:%M}  {info['name']} ({info['location']})")
+        if result["missing"]:
+            print(f"No answer in time from: {', '.join(result['missing'])}")
+    finally:
+        router.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
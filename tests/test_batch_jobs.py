@@ -0,0 +1,35 @@
+"""Write-back must not re-select summarised sessions or drop results it cannot apply"""
+import time
+from datetime import date, timedelta
+
+from batch_jobs import BatchJobStore, BatchPipeline, LocalBatchBackend, chat_request
+from session_store import SessionStore
+
+
+def pipeline(tmp_path, **kwargs):
+    directory = str(tmp_path / "batches")
+    return BatchPipeline(LocalBatchBackend(directory=directory), BatchJobStore(str(tmp_path / "jobs.db")),
+                         directory=directory, **kwargs)
+
+
+def test_summary_write_back_does_not_mark_the_session_updated(tmp_path):
+    sessions = SessionStore(str(tmp_path / "sessions.db"))
+    sessions.save("a", {"recent": [{"role": "user", "content": "Do you take Cigna?"}]})
+    batch = pipeline(tmp_path, session_store=sessions)
+    assert batch.submit_summaries(since=0)
+    before = time.time()
+
+    assert [job["status"] for job in batch.poll()] == ["written_back"]
+    assert sessions.load("a")["daily_summary"].startswith("[local batch]")
+    assert sessions.updated_since(before) == []
+    assert batch.submit_summaries(since=before) is None
+
+
+def test_results_without_their_records_stay_completed(tmp_path):
+    batch = pipeline(tmp_path)
+    request = chat_request("confirm:1", "Confirm", f"Cleaning on {date.today() + timedelta(days=1)}", "gpt-4o-mini")
+    job_id = batch.submit("confirmations", [request])
+
+    assert [job["status"] for job in batch.poll()] == ["completed"]
+    assert [job["job_id"] for job in batch.jobs.jobs(open_only=True)] == [job_id]
+    assert batch.waiting() == []
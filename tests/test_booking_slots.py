@@ -0,0 +1,63 @@
+"""Locally parsed bookings must respect the practice hours and booking window"""
+from datetime import date, timedelta
+
+import agentSDK_multiAgent as multi_agent
+from dental_assistant_responsesApi import DentalAssistant
+from scheduling_store import SchedulingStore
+from slot_filling import SlotTracker
+
+
+def next_day(weekday):
+    day = date.today() + timedelta(days=1)
+    while day.weekday() != weekday:
+        day += timedelta(days=1)
+    return day
+
+
+def assistant():
+    bot = DentalAssistant()
+    bot.handle_booking_slots("I'd like to book a cleaning. My name is Ann Lee, phone 555-010-0001")
+    return bot
+
+
+def test_saturday_at_eight_is_not_booked():
+    bot = assistant()
+    reply = bot.handle_booking_slots(f"Saturday {next_day(5):%d/%m/%Y} at 8")
+
+    assert "closed on Saturdays" in reply and "outside our hours" in reply
+    assert "What day" in reply
+    assert bot.appointments == {}
+    assert "requested_date" not in bot.slots and "requested_time" not in bot.slots
+
+
+def test_out_of_hours_weekday_keeps_the_date():
+    bot = assistant()
+    monday = next_day(0)
+    reply = bot.handle_booking_slots(f"{monday:%d/%m/%Y} at 17:30")
+
+    assert "run past closing" in reply and "What time" in reply
+    assert bot.appointments == {}
+    assert bot.slots["requested_date"] == monday.isoformat()
+
+    assert "booked" in bot.handle_booking_slots("10:00 then")
+    assert [appointment["time"] for appointment in bot.appointments.values()] == ["10:00"]
+
+
+def test_dates_outside_the_booking_window():
+    bot = DentalAssistant()
+    assert "already passed" in bot.slot_problems((date.today() - timedelta(days=1)).isoformat(), "10:00")["requested_date"]
+    assert "90 days" in bot.slot_problems((date.today() + timedelta(days=120)).isoformat(), "10:00")["requested_date"]
+
+
+def test_multi_agent_local_booking_checks_the_rules():
+    multi_agent.use_store(SchedulingStore())
+    tracker = SlotTracker()
+    tracker.update("I want to book an appointment on Saturday at 3am. "
+                   "My name is Ann Lee, phone 555-010-0001, email ann@example.com")
+    reply = multi_agent.try_local_booking(tracker)
+
+    assert "closed on Saturdays" in reply and "outside our hours" in reply
+    assert multi_agent.store.get_appointments("Ann Lee") == []
+    tracker.update(f"{next_day(0):%d/%m/%Y} at 16:30")
+    assert "booked for Ann Lee" in multi_agent.try_local_booking(tracker)
+    assert "Not booked" in multi_agent.book_appointment(next_day(6).isoformat(), "10:00", "Ann Lee", False)
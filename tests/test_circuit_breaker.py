@@ -0,0 +1,61 @@
+"""A half-open circuit lets exactly one probe through"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from model_client import CircuitBreaker, ResilientClient
+
+
+def half_open():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_only_one_concurrent_caller_probes():
+    breaker = half_open()
+    start = threading.Barrier(16)
+
+    def allow(_):
+        start.wait()
+        return breaker.allow()
+
+    with ThreadPoolExecutor(16) as pool:
+        assert sum(pool.map(allow, range(16))) == 1
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_callers_fail_fast_while_the_probe_runs():
+    client = ResilientClient("test", retries=0, hedge=False)
+    client._breakers["m"] = half_open()
+    probing, finish = threading.Event(), threading.Event()
+
+    def slow(model):
+        probing.set()
+        finish.wait(5)
+        return "probe"
+
+    with ThreadPoolExecutor(1) as pool:
+        probe = pool.submit(client.call, slow, ("m",), lambda: "degraded")
+        probing.wait(5)
+        assert client.call(slow, ("m",), lambda: "degraded") == "degraded"
+        finish.set()
+        assert probe.result() == "probe"
+
+    assert client.snapshot()["breakers"] == {"m": "closed"}
+    assert client.counters()["breaker_skips"] == 1
+
+
+def test_a_non_retryable_probe_error_frees_the_probe():
+    client = ResilientClient("test", retries=0, hedge=False)
+    breaker = client._breakers["m"] = half_open()
+
+    def bad_request(model):
+        raise ValueError("bad request")
+
+    try:
+        client.call(bad_request, ("m",))
+    except ValueError:
+        pass
+    assert breaker.allow()
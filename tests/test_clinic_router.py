@@ -0,0 +1,101 @@
+"""Routed turns run the headless flows and never read the terminal"""
+import builtins
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+import tenancy
+from tenancy import ClinicRouter, load_clinics
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    def no_terminal(prompt=""):
+        raise AssertionError(f"read stdin: {prompt!r}")
+    monkeypatch.setattr(builtins, "input", no_terminal)
+    router = ClinicRouter(load_clinics(str(tmp_path / "missing.json")), data_dir=str(tmp_path))
+    yield router
+    router.close()
+
+
+def next_weekday():
+    day = date.today() + timedelta(days=7)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.strftime("%d/%m/%Y")
+
+
+def test_booking_is_collected_over_several_turns(router):
+    assert "phone number" in router.turn("s1", "I want to book an appointment", "main")
+    assert "Full Name" in router.turn("s1", "5550100001")
+    router.turn("s1", "Ann Lee")
+    router.turn("s1", "ann@example.com")
+    assert "1. Cleaning" in router.turn("s1", "01/02/1990")
+    router.turn("s1", "1")
+    router.turn("s1", next_weekday())
+    assert "successfully booked" in router.turn("s1", "10:00")
+
+    shard = router.shards["main"]
+    assert shard.assistant("s1") is shard.assistant("s1")
+    assert len(shard.records.appointments) == 1
+
+
+def test_stop_leaves_the_flow(router):
+    router.turn("s2", "cancel my appointment", "main")
+    assert "stopped" in router.turn("s2", "never mind")
+    assert router.shards["main"].assistant("s2").flow is None
+
+
+def book_for_ann(router, session_id):
+    router.turn(session_id, "I want to book an appointment", "main")
+    for answer in ("5550100001", "Ann Lee", "ann@example.com", "01/02/1990", "1", next_weekday()):
+        router.turn(session_id, answer)
+    return router.turn(session_id, "10:00")
+
+
+def test_commands_only_act_for_the_patient_of_the_session(router):
+    assert "successfully booked" in book_for_ann(router, "victim")
+    records = router.shards["main"].records
+
+    reply = router.turn("attacker", "cancel appointment 1", "main")
+    assert "cancelled" not in reply and "phone number" in reply
+    assert records.appointments[1]["status"] == "scheduled"
+    assert "Booked" not in router.turn("attacker2", f"book a cleaning on {next_weekday()} at 11:00 for Ann Lee", "main")
+    assert "Booked" not in router.turn("attacker3", f"book a cleaning on {next_weekday()} at 11:00 for Ann Lee, phone 5550109999", "main")
+    assert len(records.appointments) == 1
+
+    assert "Booked Cleaning for Ann Lee" in router.turn("victim", f"book a cleaning on {next_weekday()} at 11:00 for Ann Lee")
+    assert "has been cancelled" in router.turn("victim", "cancel appointment 1")
+
+
+def test_appointments_must_end_by_closing_time(router):
+    records = router.shards["main"].records
+    patient_id = records.register_patient("Ann Lee", "5550100001", "ann@example.com", "01/02/1990")
+
+    appointment_id, error = records.book_appointment(patient_id, next_weekday(), "17:30", "Cleaning")
+    assert appointment_id is None and "must finish by 18:00" in error
+    appointment_id, _ = records.book_appointment(patient_id, next_weekday(), "17:00", "Cleaning")
+    assert appointment_id
+    ok, error = records.reschedule_appointment(appointment_id, next_weekday(), "17:45")
+    assert not ok and "must finish by 18:00" in error
+
+
+def test_a_running_session_is_not_evicted(router, monkeypatch):
+    monkeypatch.setattr(tenancy, "SESSION_CACHE", 1)
+    shard = router.shards["main"]
+    running, release = threading.Event(), threading.Event()
+    busy = shard.assistant("busy")
+
+    def slow_respond(user_input):
+        running.set()
+        release.wait(5)
+        return "done"
+    busy.respond = slow_respond
+
+    turn = shard.executor.submit(shard.turn, "busy", "hello")
+    running.wait(5)
+    shard.assistant("other")
+    assert shard.assistant("busy") is busy
+    release.set()
+    assert turn.result() == "done"
@@ -0,0 +1,9 @@
+"""The harness invariants hold for every target (Hypothesis sequences when installed: pip install hypothesis)"""
+import pytest
+
+from load_harness import TARGETS, check_properties
+
+
+@pytest.mark.parametrize("target_name", sorted(TARGETS))
+def test_invariants_hold(target_name):
+    assert check_properties(target_name, examples=20, threads=4, seed=0)
@@ -0,0 +1,18 @@
+"""Unclear turns go to the large tier"""
+from model_policy import ModelPolicy
+from slot_filling import intent_confidence
+
+
+def test_confidence_escalates_unclear_turns():
+    policy = ModelPolicy(log_path=None)
+
+    clear = policy.select("Front Desk Chat", confidence=intent_confidence("I'd like to book a cleaning"))
+    assert clear.tier == "small" and not clear.escalated
+    assert policy.select("Front Desk Chat", confidence=intent_confidence("555-010-0001")).tier == "small"
+
+    mixed = policy.select("Front Desk Chat", confidence=intent_confidence("Cancel Tuesday and book me in for Friday"))
+    assert mixed.tier == "large" and mixed.escalated and mixed.reason.startswith("low confidence")
+    rambling = " ".join(["my tooth has been hurting on and off since last week"] * 5)
+    assert policy.select("Front Desk Chat", confidence=intent_confidence(rambling)).escalated
+
+    assert not policy.select("Booking Agent", escalate=True).escalated  # Already on the large tier
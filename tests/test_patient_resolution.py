@@ -0,0 +1,44 @@
+"""A similar name alone must never resolve to another patient's record"""
+from datetime import date, timedelta
+
+import agentSDK_multiAgent as multi_agent
+from patient_index import PatientIndex
+from scheduling_store import SchedulingStore
+
+
+def test_similar_name_needs_phone_or_dob():
+    index = PatientIndex()
+    index.add("john", "John Smith", "5550100001", "1980-01-02")
+
+    assert index.resolve("John Smith") == "john"
+    assert index.resolve("Smith, John") == "john"
+    assert index.resolve("Joan Smith") is None
+    assert index.candidates("Joan Smith") == ["john"]
+    assert index.resolve("Joan Smith", phone="555-010-0001") == "john"
+    assert index.resolve("Joan Smith", dob="02/01/1980") == "john"
+    assert index.resolve("Joan Smith", phone="5550109999") is None
+
+
+def test_exact_name_shared_by_two_patients_needs_phone():
+    index = PatientIndex()
+    index.add(1, "John Smith", "5550100001")
+    index.add(2, "John Smith", "5550100002")
+
+    assert index.resolve("John Smith") is None
+    assert index.resolve("John Smith", phone="5550100002") == 2
+
+
+def test_agent_tools_do_not_act_on_a_similar_name():
+    multi_agent.use_store(SchedulingStore())
+    multi_agent.register_new_patient("John Smith", "5550100001", "john@example.com")
+
+    assert multi_agent.check_patient_status("Joan Smith") != "existing"
+    assert "John Smith" in multi_agent.check_patient_status("Joan Smith")
+    monday = (date.today() + timedelta(days=7 - date.today().weekday())).isoformat()
+    reply = multi_agent.book_appointment(monday, "10:00", "Joan Smith", False)
+    assert "booked" not in reply
+    assert multi_agent.store.get_appointments("John Smith") == []
+    assert "No patient is registered as Joan Smith" in multi_agent.check_appointments("Joan Smith")
+
+    assert "registered as John Smith" in multi_agent.confirm_patient("Joan Smith", "555 010 0001")
+    assert "booked for John Smith" in multi_agent.book_appointment(monday, "10:00", "John Smith", False)
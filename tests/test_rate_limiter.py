@@ -0,0 +1,38 @@
+"""Quota is reserved once per logical call and never after the caller's deadline"""
+import pytest
+
+from model_client import ModelUnavailable, ResilientClient
+from rate_limiter import QuotaTimeout, RateLimiter
+
+
+class Overloaded(Exception):
+    status_code = 503
+
+
+def test_retries_share_one_reservation():
+    limiter = RateLimiter(requests_per_minute=100, tokens_per_minute=10_000)
+    client = ResilientClient("test", retries=2, hedge=False)
+    attempts = []
+
+    def flaky(model):
+        attempts.append(model)
+        if len(attempts) < 3:
+            raise Overloaded()
+        return {"usage": 300}
+
+    result = limiter.call(lambda: client.call(limiter.pausing(flaky), ["m"]), 1000,
+                          usage=lambda result: result["usage"])
+    assert result == {"usage": 300} and len(attempts) == 3
+    assert 100 - limiter.requests.level == pytest.approx(1, abs=0.01)
+    assert 10_000 - limiter.tokens.level == pytest.approx(300, abs=5)
+
+
+def test_no_quota_before_the_deadline_gives_up_without_calling():
+    limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=10_000)
+    limiter.acquire(10)
+    called = []
+
+    with pytest.raises(QuotaTimeout) as raised:
+        limiter.call(lambda: called.append(1), 10, timeout=0.1)
+    assert isinstance(raised.value, ModelUnavailable)
+    assert called == [] and limiter._waiters == []
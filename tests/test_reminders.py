@@ -0,0 +1,70 @@
+"""One bad reminder must not hold back, or resend, the rest of its batch"""
+from datetime import datetime, timedelta
+
+from reminders import MAX_ATTEMPTS, ReminderDispatcher, ReminderQueue
+
+
+class RefusingSender:
+    """Refuses one address, like SMTPRecipientsRefused, and records the rest"""
+
+    def __init__(self, bad="bad@example.com"):
+        self.bad = bad
+        self.sent = []
+
+    def send_batch(self, jobs):
+        self.sent += [job["job_id"] for job in jobs if job["contact"]["email"] != self.bad]
+        return [job["job_id"] for job in jobs if job["contact"]["email"] == self.bad]
+
+
+def queue_with(tmp_path, *emails):
+    queue = ReminderQueue(str(tmp_path / "reminders.db"))
+    when = datetime.now() + timedelta(hours=1, days=2)
+    for i, email in enumerate(emails):
+        queue.schedule(f"appt-{i}", when, {"email": email}, "See you soon")
+    return queue, (when - timedelta(hours=47)).timestamp()
+
+
+def test_only_the_failed_job_is_retried_with_backoff(tmp_path):
+    queue, now = queue_with(tmp_path, "a@example.com", "bad@example.com", "c@example.com")
+    sender = RefusingSender()
+    dispatcher = ReminderDispatcher(queue, sender)
+
+    assert dispatcher.dispatch_due(now) == 2
+    assert sorted(sender.sent) == ["appt-0#48h", "appt-2#48h"]
+    assert dispatcher.failed == 1
+    assert dispatcher.dispatch_due(now) == 0  # Backing off, not retried straight away
+    assert dispatcher.failed == 1
+
+    for attempt in range(MAX_ATTEMPTS):
+        now += 7200
+        dispatcher.dispatch_due(now)
+    assert sorted(sender.sent) == ["appt-0#48h", "appt-2#48h"]
+    assert dispatcher.dropped == 1 and dispatcher.failed == MAX_ATTEMPTS
+    assert ReminderQueue(str(tmp_path / "reminders.db")).pop_due(now) == []
+
+
+def test_job_cancelled_in_flight_is_not_retried(tmp_path):
+    queue, now = queue_with(tmp_path, "bad@example.com")
+
+    class CancellingSender(RefusingSender):
+        def send_batch(self, jobs):
+            queue.cancel("appt-0")
+            return super().send_batch(jobs)
+
+    dispatcher = ReminderDispatcher(queue, CancellingSender())
+    dispatcher.dispatch_due(now)
+    assert dispatcher.dispatch_due(now + 86400) == 0
+    assert len(queue) == 0 and dispatcher.failed == 1
+
+
+def test_a_sender_that_raises_sends_nothing_twice(tmp_path):
+    queue, now = queue_with(tmp_path, "a@example.com")
+
+    class DownSender:
+        def send_batch(self, jobs):
+            raise ConnectionRefusedError
+
+    assert ReminderDispatcher(queue, DownSender()).dispatch_due(now) == 0
+    sender = RefusingSender()
+    assert ReminderDispatcher(queue, sender).dispatch_due(now + 120) == 1
+    assert sender.sent == ["appt-0#48h"]
@@ -0,0 +1,11 @@
+"""The pickle-speaking store must never start or connect without a key"""
+import pytest
+
+from scheduling_store import connect_store, start_store_server
+
+
+def test_store_refuses_to_run_without_an_authkey():
+    with pytest.raises(ValueError):
+        start_store_server(("127.0.0.1", 0), authkey=None)
+    with pytest.raises(ValueError):
+        connect_store(("127.0.0.1", 0), authkey=b"")
@@ -0,0 +1,24 @@
+"""The store publishes its own changes, in mutation order, with before/after taken under its lock"""
+from datetime import datetime
+
+from change_events import ChangeLog
+from scheduling_store import Appointment, Patient, SchedulingStore
+
+
+def test_store_publishes_each_mutation():
+    store = SchedulingStore(changes=ChangeLog(capacity=16))
+    monday, tuesday = datetime(2030, 1, 7, 10), datetime(2030, 1, 8, 10)
+    store.add_patient(Patient("Ann Lee", "5550100001", "ann@example.com", True), session_id="s1")
+    store.add_appointment(Appointment("Ann Lee", monday), session_id="s1")
+    assert not store.add_appointment(Appointment("Ann Lee", monday))
+    assert store.move_appointment("Ann Lee", monday, tuesday, session_id="s2")
+    store.cancel_appointment("Ann Lee", tuesday)
+
+    events, missed = store.changes_since(0)
+    assert missed == 0
+    assert [(event.seq, event.action, event.session_id) for event in events] == [
+        (1, "registered", "s1"), (2, "booked", "s1"), (3, "rescheduled", "s2"), (4, "cancelled", None)]
+    moved = events[2]
+    assert moved.key == f"Ann Lee|{tuesday.isoformat()}"
+    assert moved.before["datetime"] == monday and moved.after["datetime"] == tuesday
+    assert events[3].before["datetime"] == tuesday
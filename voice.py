@@ -0,0 +1,486 @@
+"""
+Telephony front end for DentalAssistant
+
+    python voice.py [script.txt] [--fake-model] [--latency 0.3]
+
+A CallSession takes 20 ms frames of 16 kHz, 16-bit mono PCM from the phone
+line (feed), transcribes them with a streaming speech-to-text stage, streams
+the assistant's reply (DentalAssistant.stream_response) phrase by phrase into
+a text-to-speech stage, and plays the audio back through a sink at the line's
+pace. When the caller talks over the reply for BARGE_IN_MS the model stream,
+synthesis and queued audio are dropped (barge-in).
+
+Stages are pluggable: anything with accept(frame) -> Transcript or None is a
+speech-to-text stage and anything with synthesize(text) -> frames is a
+text-to-speech stage. Included are ScriptedSTT and ToneTTS, fakes that need
+no models, VoskSTT (pip install vosk; DENTAL_VOSK_MODEL=<model dir>) and
+CommandTTS, which pipes text to a command printing raw PCM, e.g.
+DENTAL_TTS_COMMAND="piper --model en_US-lessac-low.onnx --output-raw".
+
+Each turn records when the caller stopped speaking, when the transcript was
+final, the first model token, the first phrase, the first synthesized audio
+and the first frame played, and reports those stages against LATENCY_BUDGET_MS.
+The demo plays a script (one utterance per line, "!" to talk over the reply)
+as tone audio through the fakes and prints the per-stage latencies.
+"""
+import os
+import re
+import json
+import time
+import queue
+import argparse
+import threading
+import subprocess
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import slot_filling
+from dental_assistant import DentalAssistant
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * 2  # 16-bit mono
+
+# Voice activity: a frame is speech when its peak is above SPEECH_LEVEL
+SPEECH_LEVEL = int(os.getenv("DENTAL_VOICE_SPEECH_LEVEL", "1000"))
+END_OF_SPEECH_MS = int(os.getenv("DENTAL_VOICE_END_MS", "400"))  # Silence that ends an utterance
+BARGE_IN_MS = int(os.getenv("DENTAL_VOICE_BARGE_IN_MS", "200"))  # Speech over the reply that interrupts it
+
+# Per-stage budget in milliseconds; mouth_to_ear runs from the end of the caller's speech to the first reply audio
+LATENCY_BUDGET_MS = {"asr": 450, "llm": 500, "phrase": 150, "tts": 150, "playout": 60, "mouth_to_ear": 1200}
+
+# Spoken questions for the fields the flows ask for; FIELD_PROMPTS are written for a terminal
+VOICE_PROMPTS = {
+    "phone": "What's your phone number?",
+    "name": "What's your full name?",
+    "email": "What's your email address?",
+    "dob": "What's your date of birth?",
+    "service": "Which service would you like?",
+    "date": "What date would suit you?",
+    "time": "And at what time?",
+    "appointment_id": "Which appointment number?",
+    "confirm": "Are you sure you want to cancel it?",
+}
+
+
+def frame_is_speech(frame: bytes, level: int = SPEECH_LEVEL) -> bool:
+    samples = array("h", frame)
+    return bool(samples) and max(max(samples), -min(samples)) >= level
+
+
+def tone_frames(ms: int, level: int = 8000) -> List[bytes]:
+    """Square-wave frames, loud enough to count as speech"""
+    period = SAMPLE_RATE // 200  # 200 Hz
+    samples = array("h", (level if (i // (period // 2)) % 2 else -level for i in range(FRAME_BYTES // 2)))
+    return [samples.tobytes()] * (ms // FRAME_MS)
+
+
+def silence_frames(ms: int) -> List[bytes]:
+    return [bytes(FRAME_BYTES)] * (ms // FRAME_MS)
+
+
+@dataclass
+class Transcript:
+    text: str
+    final: bool
+
+
+class ScriptedSTT:
+    """
+    File-based fake speech-to-text for tests and demos
+
+    Finds utterances by voice activity and transcribes the n-th one as the
+    n-th line of a script, with growing partial transcripts while it lasts.
+    """
+
+    def __init__(self, lines: Iterable[str], end_of_speech_ms: int = END_OF_SPEECH_MS, words_per_second: float = 3.0):
+        self.lines = [line.strip() for line in lines if line.strip()]
+        self.end_of_speech_ms = end_of_speech_ms
+        self.words_per_second = words_per_second
+        self.heard = 0
+        self.speech_ms = 0
+        self.silence_ms = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedSTT":
+        with open(path) as f:
+            return cls(f, **kwargs)
+
+    def accept(self, frame: bytes) -> Optional[Transcript]:
+        if frame_is_speech(frame):
+            self.speech_ms += FRAME_MS
+            self.silence_ms = 0
+            if self.speech_ms % 200 == 0 and self.heard < len(self.lines):
+                words = self.lines[self.heard].split()
+                return Transcript(" ".join(words[:int(self.speech_ms / 1000 * self.words_per_second)]), False)
+            return None
+        if not self.speech_ms:
+            return None
+        self.silence_ms += FRAME_MS
+        if self.silence_ms < self.end_of_speech_ms:
+            return None
+        self.speech_ms = self.silence_ms = 0
+        text = self.lines[self.heard] if self.heard < len(self.lines) else ""
+        self.heard += 1
+        return Transcript(text, True)
+
+
+class VoskSTT:
+    """Local streaming recognizer; the model directory comes from DENTAL_VOSK_MODEL"""
+
+    def __init__(self, model_path: Optional[str] = None):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("VoskSTT needs the vosk package: pip install vosk") from None
+        self._recognizer = vosk.KaldiRecognizer(vosk.Model(model_path or os.environ["DENTAL_VOSK_MODEL"]), SAMPLE_RATE)
+        self._partial = ""
+
+    def accept(self, frame: bytes) -> Optional[Transcript]:
+        if self._recognizer.AcceptWaveform(frame):
+            self._partial = ""
+            return Transcript(json.loads(self._recognizer.Result()).get("text", ""), True)
+        partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        if partial and partial != self._partial:
+            self._partial = partial
+            return Transcript(partial, False)
+        return None
+
+
+class ToneTTS:
+    """Fake text-to-speech: a tone as long as the text would take to say, after a fixed synthesis delay"""
+
+    def __init__(self, first_audio_ms: int = 80, ms_per_char: int = 60):
+        self.first_audio_ms = first_audio_ms
+        self.ms_per_char = ms_per_char
+
+    def synthesize(self, text: str) -> Iterator[bytes]:
+        time.sleep(self.first_audio_ms / 1000)
+        frames = max(1, len(text) * self.ms_per_char // FRAME_MS)
+        yield from tone_frames(frames * FRAME_MS, level=3000)
+
+
+class CommandTTS:
+    """Pipes each phrase to a command that writes raw 16 kHz 16-bit mono PCM to stdout"""
+
+    def __init__(self, command: Optional[str] = None):
+        self.command = (command or os.environ["DENTAL_TTS_COMMAND"]).split()
+
+    def synthesize(self, text: str) -> Iterator[bytes]:
+        process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        process.stdin.write(text.encode())
+        process.stdin.close()
+        try:
+            while True:
+                frame = process.stdout.read(FRAME_BYTES)
+                if not frame:
+                    break
+                yield frame.ljust(FRAME_BYTES, b"\0")
+        finally:
+            # Closing the generator early (barge-in) stops the synthesizer
+            process.kill()
+            process.wait()
+
+
+class RecordingSink:
+    """Stands in for the phone line: keeps the frames played and when"""
+
+    def __init__(self):
+        self.frames: List[bytes] = []
+        self.cleared = 0
+
+    def write(self, frame: bytes) -> None:
+        self.frames.append(frame)
+
+    def clear(self) -> None:
+        """Drop audio buffered on the line; called on barge-in"""
+        self.cleared += 1
+
+
+def phrases(deltas: Iterable[str], min_chars: int = 40) -> Iterator[str]:
+    """
+    Regroup streamed text into phrases worth synthesizing
+
+    The first phrase ends at the first punctuation, so speech starts as soon
+    as possible; later ones at sentence ends, or commas past min_chars.
+    """
+    buffer, first = "", True
+    for delta in deltas:
+        buffer += delta
+        while True:
+            match = re.search(r"[.!?\n](\s|$)" if not first else r"[.!?,;:\n](\s|$)", buffer)
+            if match is None and not first and len(buffer) >= min_chars:
+                match = re.search(r"[,;:](\s|$)", buffer[min_chars // 2:])
+                if match is not None:
+                    match = re.search(r"[,;:](\s|$)", buffer)
+            if match is None or not buffer[:match.end()].strip():
+                break
+            yield for_speech(buffer[:match.end()])
+            buffer, first = buffer[match.end():], False
+    if buffer.strip():
+        yield for_speech(buffer)
+
+
+def for_speech(text: str) -> str:
+    """Drop terminal decoration ("=====", "|") that a synthesizer would read out"""
+    return " ".join(re.sub(r"=+|\|", " ", text).split())
+
+
+@dataclass
+class TurnLatency:
+    """Timestamps of one turn, from time.perf_counter(), and the stages between them"""
+    text: str
+    spoke_at: float  # Last frame of the caller's speech
+    marks: Dict[str, float] = field(default_factory=dict)
+    said: List[str] = field(default_factory=list)  # Phrases of the reply sent to synthesis
+    interrupted: bool = False
+
+    def mark(self, name: str) -> None:
+        self.marks.setdefault(name, time.perf_counter())
+
+    def stages(self) -> Dict[str, float]:
+        points = [("asr", "spoke", "heard"), ("llm", "heard", "first_token"), ("phrase", "first_token", "first_phrase"),
+                  ("tts", "first_phrase", "first_audio"), ("playout", "first_audio", "played"),
+                  ("mouth_to_ear", "spoke", "played")]
+        marks = dict(self.marks, spoke=self.spoke_at)
+        return {stage: round((marks[end] - marks[start]) * 1000, 1)
+                for stage, start, end in points if start in marks and end in marks}
+
+    def over_budget(self, budget: Dict[str, float] = LATENCY_BUDGET_MS) -> List[str]:
+        return [f"{stage} {ms:.0f} ms > {budget[stage]} ms" for stage, ms in self.stages().items()
+                if stage in budget and ms > budget[stage]]
+
+
+class CallSession:
+    """One phone call: audio in, assistant in the middle, audio out"""
+
+    def __init__(self, assistant: DentalAssistant, stt, tts, sink, budget: Dict[str, float] = LATENCY_BUDGET_MS,
+                 pace: bool = True):
+        self.assistant = assistant
+        self.stt = stt
+        self.tts = tts
+        self.sink = sink
+        self.budget = budget
+        self.pace = pace
+        self.turns: List[TurnLatency] = []
+        # The assistant runs the flows; the call only asks and reads answers the spoken way
+        assistant.field_prompts = dict(assistant.field_prompts, **VOICE_PROMPTS)
+        assistant.answer_parser = lambda field_name, answer: spoken_value(field_name, answer, assistant)
+        self.speaking = False
+        self._last_speech_at = 0.0
+        self._speech_run_ms = 0
+        self._cancel = threading.Event()
+        self._responder: Optional[threading.Thread] = None
+        self._audio: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._player = threading.Thread(target=self._play, daemon=True, name="voice-playout")
+        self._player.start()
+
+    # Input side, called by the telephony transport for every frame
+
+    def feed(self, frame: bytes) -> None:
+        now = time.perf_counter()
+        if frame_is_speech(frame):
+            self._last_speech_at = now
+            self._speech_run_ms += FRAME_MS
+            if self.speaking and self._speech_run_ms >= BARGE_IN_MS:
+                self.barge_in()
+        else:
+            self._speech_run_ms = 0
+        result = self.stt.accept(frame)
+        if result is not None and result.final and result.text.strip():
+            self._start_turn(result.text.strip(), self._last_speech_at)
+
+    def barge_in(self) -> None:
+        """The caller talked over the reply: stop generating, synthesizing and playing it"""
+        if self.turns and not self._cancel.is_set():
+            self.turns[-1].interrupted = True
+        self._stop()
+
+    def _stop(self) -> None:
+        self._cancel.set()
+        while True:
+            try:
+                self._audio.get_nowait()
+            except queue.Empty:
+                break
+        self.sink.clear()
+        self.speaking = False
+
+    def _start_turn(self, text: str, spoke_at: float) -> None:
+        # A new utterance supersedes any reply still in progress
+        if self._responder is not None and self._responder.is_alive():
+            self.barge_in()
+            self._responder.join()
+        latency = TurnLatency(text, spoke_at)
+        latency.mark("heard")
+        self.turns.append(latency)
+        self._cancel = threading.Event()
+        self._responder = threading.Thread(target=self._respond, args=(text, latency, self._cancel),
+                                           daemon=True, name="voice-responder")
+        self._responder.start()
+
+    # Reply side
+
+    def _respond(self, text: str, latency: TurnLatency, cancel: threading.Event) -> None:
+        for phrase in phrases(self._marked(self.reply(text, cancel), latency)):
+            if cancel.is_set():
+                break
+            latency.mark("first_phrase")
+            latency.said.append(phrase)
+            synthesized = self.tts.synthesize(phrase)
+            for frame in synthesized:
+                if cancel.is_set():
+                    break
+                latency.mark("first_audio")
+                self._audio.put((frame, latency, cancel))
+            getattr(synthesized, "close", lambda: None)()
+        self._audio.put((None, latency, cancel))
+
+    @staticmethod
+    def _marked(deltas: Iterable[str], latency: TurnLatency) -> Iterator[str]:
+        for delta in deltas:
+            if delta:
+                latency.mark("first_token")
+                yield delta
+
+    def reply(self, text: str, cancel: threading.Event) -> Iterator[str]:
+        """Text deltas answering one utterance: the next step of a flow, or the assistant's streamed reply"""
+        return self.assistant.respond_stream(text, cancel)
+
+    def _play(self) -> None:
+        """Plays queued frames at the line's pace so barge-in and latency behave as on a call"""
+        next_at = time.perf_counter()
+        while not self._closed:
+            try:
+                frame, latency, cancel = self._audio.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if cancel.is_set():
+                continue
+            if frame is None:
+                self.speaking = False
+                continue
+            self.speaking = True
+            if self.pace:
+                next_at = max(next_at, time.perf_counter())
+                time.sleep(max(0.0, next_at - time.perf_counter()))
+                next_at += FRAME_MS / 1000
+            self.sink.write(frame)
+            latency.mark("played")
+
+    def wait_for_reply(self, timeout: float = 30.0) -> None:
+        """Block until the current reply has been played out"""
+        deadline = time.monotonic() + timeout
+        if self._responder is not None:
+            self._responder.join(timeout)
+        while (self.speaking or not self._audio.empty()) and time.monotonic() < deadline:
+            time.sleep(FRAME_MS / 1000)
+
+    def close(self) -> None:
+        self._stop()
+        self._closed = True
+        self._player.join()
+
+    @property
+    def transcript(self) -> List[tuple]:
+        """(speaker, text) pairs; replies cut off by barge-in are marked"""
+        lines = []
+        for turn in self.turns:
+            lines.append(("caller", turn.text))
+            lines.append(("assistant", " ".join(turn.said) + (" [interrupted]" if turn.interrupted else "")))
+        return lines
+
+    def report(self) -> str:
+        """Median and worst latency per stage across the call's turns, against the budget"""
+        lines = [f"{'stage':14} {'p50 ms':>8} {'max ms':>8} {'budget':>8}"]
+        for stage, budget in self.budget.items():
+            values = sorted(turn.stages()[stage] for turn in self.turns if stage in turn.stages())
+            if values:
+                flag = "  over" if values[len(values) // 2] > budget else ""
+                lines.append(f"{stage:14} {values[len(values) // 2]:>8.0f} {values[-1]:>8.0f} {budget:>8}{flag}")
+        return "\n".join(lines)
+
+
+def spoken_value(field_name: str, answer: str, assistant: DentalAssistant) -> str:
+    """Turn a transcribed answer ("my number is 555 010 0001", "next Tuesday") into the value a flow expects"""
+    answer = answer.strip().rstrip(".")
+    value = None
+    if field_name == "phone":
+        value = slot_filling.extract_phone(answer) or re.sub(r"\D", "", answer)
+    elif field_name == "appointment_id":
+        value = re.sub(r"\D", "", answer)
+    elif field_name == "email":
+        # Recognizers spell addresses out: "jamie at example dot com"
+        value = slot_filling.extract_email(re.sub(r"\s+", "", re.sub(r"\s+at\s+", "@", re.sub(r"\s+dot\s+", ".", answer))))
+    elif field_name == "confirm":
+        value = "yes" if answer.lower().split()[:1] in (["yes"], ["yeah"], ["yep"], ["sure"]) else "no"
+    elif field_name == "service":
+        value = slot_filling.extract_service(answer, list(assistant.practice_info["services"]))
+    elif field_name in ("date", "dob"):
+        day = slot_filling.extract_date(answer)
+        value = day and day.strftime("%d/%m/%Y")
+    elif field_name == "time":
+        value = slot_filling.extract_time(answer)
+    elif field_name == "name":
+        value = slot_filling.extract_name(answer)
+    # Anything not understood goes to the flow as said, which asks again with its own error
+    return value or answer
+
+
+def simulate(script: List[str], assistant: DentalAssistant, tts=None, words_per_second: float = 3.0) -> CallSession:
+    """Play a script as a call; lines starting with "!" are said over the reply once it starts"""
+    lines = [line.lstrip("!").strip() for line in script]
+    call = CallSession(assistant, ScriptedSTT(lines, words_per_second=words_per_second), tts or ToneTTS(), RecordingSink())
+    for line in script:
+        if line.startswith("!"):
+            # Wait for the reply to start, then talk over it
+            while not call.speaking:
+                time.sleep(FRAME_MS / 1000)
+            time.sleep(0.3)
+        else:
+            call.wait_for_reply()
+        speech_ms = int(len(line.split()) / words_per_second * 1000)
+        for frame in tone_frames(speech_ms) + silence_frames(END_OF_SPEECH_MS + 4 * FRAME_MS):
+            call.feed(frame)
+            time.sleep(FRAME_MS / 1000)
+    call.wait_for_reply()
+    call.close()
+    return call
+
+
+DEMO_SCRIPT = [
+    "What are your opening hours?",
+    "!Do you take insurance?",
+    "I'd like to book an appointment",
+    "555 010 0001",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a phone call through the voice pipeline")
+    parser.add_argument("script", nargs="?", help="Utterances, one per line; a leading ! talks over the reply")
+    parser.add_argument("--fake-model", action="store_true", help="Answer with load_harness.FakeModel instead of OpenAI")
+    parser.add_argument("--latency", type=float, default=0.3, help="Fake model latency to the first token, seconds")
+    args = parser.parse_args()
+    if args.fake_model:
+        from load_harness import FakeModel, install_fake_model
+        install_fake_model(FakeModel(latency=args.latency, jitter=0.0, token_latency=0.02))
+    script = DEMO_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = [line.rstrip("\n") for line in f if line.strip()]
+    call = simulate(script, DentalAssistant())
+    for speaker, text in call.transcript:
+        print(f"{speaker:>9}: {text}")
+    print()
+    for turn in call.turns:
+        problems = turn.over_budget(call.budget)
+        print(f"{turn.text[:30]:30} {json.dumps(turn.stages())}" + (f"  over: {', '.join(problems)}" if problems else ""))
+    print()
+    print(call.report())
+
+
+if __name__ == "__main__":
+    main()